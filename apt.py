@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Thorlabs APT protocol framing.
+
+Every APT message starts with a 6 byte header: a little-endian message id
+followed either by two parameter bytes (header-only messages) or, when bit
+0x80 of the destination byte is set, by a little-endian data length and that
+many bytes of data.
+"""
+
+import struct
+from collections import namedtuple
+
+HEADER_SIZE = 6
+MAX_DATA_LEN = 255
+
+# Source/destination addresses
+HOST = 0x01
+CONTROLLER = 0x11
+USB_UNIT = 0x50
+ADDRESSES = frozenset((HOST, CONTROLLER, 0x21, 0x22, 0x23, USB_UNIT))
+
+# Message ids
+HW_DISCONNECT = 0x0002
+HW_REQ_INFO = 0x0005
+HW_GET_INFO = 0x0006
+HW_START_UPDATEMSGS = 0x0011
+HW_STOP_UPDATEMSGS = 0x0012
+HW_RESPONSE = 0x0080
+HW_RICHRESPONSE = 0x0081
+MOD_IDENTIFY = 0x0223
+MOT_REQ_POSCOUNTER = 0x0411
+MOT_GET_POSCOUNTER = 0x0412
+MOT_SET_VELPARAMS = 0x0413
+MOT_REQ_VELPARAMS = 0x0414
+MOT_GET_VELPARAMS = 0x0415
+MOT_MOVE_HOME = 0x0443
+MOT_MOVE_HOMED = 0x0444
+MOT_SET_MOVERELPARAMS = 0x0445
+MOT_REQ_MOVERELPARAMS = 0x0446
+MOT_GET_MOVERELPARAMS = 0x0447
+MOT_MOVE_RELATIVE = 0x0448
+MOT_MOVE_ABSOLUTE = 0x0453
+MOT_MOVE_VELOCITY = 0x0457
+MOT_MOVE_COMPLETED = 0x0464
+MOT_MOVE_STOP = 0x0465
+MOT_MOVE_STOPPED = 0x0466
+MOT_MOVE_JOG = 0x046A
+MOT_GET_STATUSUPDATE = 0x0481
+MOT_REQ_DCSTATUSUPDATE = 0x0490
+MOT_GET_DCSTATUSUPDATE = 0x0491
+MOT_ACK_DCSTATUSUPDATE = 0x0492
+
+# Status bits
+STATUS_MOVING_FORWARD = 0x10
+STATUS_MOVING_REVERSE = 0x20
+STATUS_HOMING = 0x200
+STATUS_HOMED = 0x400
+STATUS_ENABLED = 0x80000000
+
+# Data length of every message id we know about, 0 for header-only messages.
+DATA_LENGTHS = {
+    HW_DISCONNECT: 0,
+    HW_REQ_INFO: 0,
+    HW_GET_INFO: 84,
+    HW_START_UPDATEMSGS: 0,
+    HW_STOP_UPDATEMSGS: 0,
+    HW_RESPONSE: 0,
+    HW_RICHRESPONSE: 68,
+    MOD_IDENTIFY: 0,
+    MOT_REQ_POSCOUNTER: 0,
+    MOT_GET_POSCOUNTER: 6,
+    MOT_SET_VELPARAMS: 14,
+    MOT_REQ_VELPARAMS: 0,
+    MOT_GET_VELPARAMS: 14,
+    MOT_MOVE_HOME: 0,
+    MOT_MOVE_HOMED: 0,
+    MOT_SET_MOVERELPARAMS: 6,
+    MOT_REQ_MOVERELPARAMS: 0,
+    MOT_GET_MOVERELPARAMS: 6,
+    MOT_MOVE_RELATIVE: 0,
+    MOT_MOVE_ABSOLUTE: 6,
+    MOT_MOVE_VELOCITY: 0,
+    MOT_MOVE_COMPLETED: 14,
+    MOT_MOVE_STOP: 0,
+    MOT_MOVE_STOPPED: 14,
+    MOT_MOVE_JOG: 0,
+    MOT_GET_STATUSUPDATE: 14,
+    MOT_REQ_DCSTATUSUPDATE: 0,
+    MOT_GET_DCSTATUSUPDATE: 14,
+    MOT_ACK_DCSTATUSUPDATE: 0,
+}
+
+Frame = namedtuple('Frame', ['msg_id', 'param1', 'param2',
+                             'dest', 'source', 'data'])
+
+
+def pack(msg_id, param1=0, param2=0, dest=CONTROLLER, source=HOST):
+    """
+    Builds a header-only message.
+    """
+    return struct.pack('<HBBBB', msg_id, param1, param2, dest, source)
+
+
+def pack_data(msg_id, data, dest=CONTROLLER, source=HOST):
+    """
+    Builds a message carrying a data packet.
+    """
+    return struct.pack('<HHBB', msg_id, len(data), dest | 0x80,
+                       source) + data
+
+
+def unpack_position(data):
+    """
+    Returns the (channel, position counts) pair at the start of the data
+    packet of a position, move-completed, stopped or status message.
+    """
+    return struct.unpack_from('<Hi', data)
+
+
+# HW_GET_INFO data: serial number, model, type, firmware version, notes,
+# reserved, hardware version, modification state, number of channels.
+INFO_FORMAT = '<I8sH4s48s12sHHH'
+
+
+def unpack_info(data):
+    """
+    Returns the serial number, model, firmware and hardware versions and
+    number of channels in the data packet of a HW_GET_INFO message, as a dict.
+    """
+    (serial_number, model, _, firmware, _, _, hardware, _,
+     channels) = struct.unpack_from(INFO_FORMAT, data)
+    return {'serial_number': serial_number,
+            'model': model.rstrip(b'\0').decode('ascii', 'replace'),
+            'firmware': '{}.{}.{}'.format(firmware[2], firmware[1],
+                                          firmware[0]),
+            'hardware': hardware,
+            'channels': channels}
+
+
+def frame_length(header):
+    """
+    Returns the total length of the frame starting with the 6 byte `header`,
+    or None if the header cannot be the start of a valid frame.
+    """
+    msg_id, length, dest, source = struct.unpack_from('<HHBB', header)
+    if source not in ADDRESSES or dest & 0x7F not in ADDRESSES:
+        return None
+    expected = DATA_LENGTHS.get(msg_id)
+    if dest & 0x80:
+        if length == 0 or length > MAX_DATA_LEN:
+            return None
+        if expected is not None and expected != length:
+            return None
+        return HEADER_SIZE + length
+    if expected:
+        return None
+    return HEADER_SIZE
+
+
+class FrameParser:
+    """
+    Incremental APT frame decoder.
+
+    Bytes are fed in arbitrarily sized chunks and complete frames are returned
+    as soon as they are available. Frames with unknown message ids are
+    decoded (and skipped by the caller) using the length in their header. Bytes
+    that cannot start a valid header are discarded one at a time until the
+    stream is back in step.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.discarded = 0
+
+    def feed(self, data):
+        """
+        Appends `data` to the receive buffer and returns a list of the complete
+        frames it now holds.
+        """
+        buf = self._buffer
+        buf += data
+        frames = []
+        start = 0
+        end = len(buf)
+        while end - start >= HEADER_SIZE:
+            length = frame_length(buf[start:start + HEADER_SIZE])
+            if length is None:
+                start += 1
+                self.discarded += 1
+                continue
+            if end - start < length:
+                break
+            msg_id, param1, param2, dest, source = struct.unpack_from(
+                '<HBBBB', buf, start)
+            if dest & 0x80:
+                frames.append(Frame(msg_id, 0, 0, dest & 0x7F, source,
+                                    bytes(buf[start + HEADER_SIZE:
+                                              start + length])))
+            else:
+                frames.append(Frame(msg_id, param1, param2, dest, source,
+                                    b''))
+            start += length
+        del buf[:start]
+        return frames
+
+    def reset(self):
+        """
+        Discards any partially received frame.
+        """
+        self._buffer.clear()
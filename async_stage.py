@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+asyncio interface to the stage and motors.
+
+Motor events arrive on the reactor thread and are handed to the event loop
+with call_soon_threadsafe(), so no Qt event loop is needed::
+
+    stage = await AsyncXYStage.connect(x_motor_sn, y_motor_sn)
+    await stage.home()
+    for x, y in targets:
+        await stage.move_to(x, y)
+        record(stage.position)
+"""
+
+import asyncio
+
+import stepper
+
+# Position updates buffered per stream before the oldest are dropped.
+STREAM_BUFFER = 100
+
+
+class _AsyncEvents:
+    """
+    Hands events from the reactor thread to futures and queues on the loop.
+    """
+
+    def __init__(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._waiters = []
+        self._queues = []
+
+    def _on_event(self, event):
+        self._loop.call_soon_threadsafe(self._dispatch, event)
+
+    def _dispatch(self, event):
+        waiters = []
+        for predicate, future in self._waiters:
+            if future.done():
+                continue
+            if predicate(event):
+                future.set_result(event)
+            else:
+                waiters.append((predicate, future))
+        self._waiters = waiters
+        position = self._position_of(event)
+        if position is None:
+            return
+        for queue in self._queues:
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(position)
+
+    def _position_of(self, event):
+        raise NotImplementedError
+
+    def _wait(self, predicate):
+        """
+        Returns a future resolved with the first event matching `predicate`.
+        Must be called before the command that causes the event is sent.
+        """
+        future = self._loop.create_future()
+        self._waiters.append((predicate, future))
+        return future
+
+    async def positions(self):
+        """
+        Yields positions as they are reported. If the consumer falls behind,
+        the oldest unread positions are dropped.
+        """
+        queue = asyncio.Queue(STREAM_BUFFER)
+        self._queues.append(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.remove(queue)
+
+
+class AsyncThorStepper(_AsyncEvents):
+    """
+    asyncio wrapper around a started ThorStepper.
+    """
+
+    def __init__(self, motor, loop=None):
+        super().__init__(loop)
+        self.motor = motor
+        motor.add_listener(self._on_event)
+
+    def _position_of(self, event):
+        event_type, data = event
+        if event_type in ('pos', 'status', 'move_completed', 'stop'):
+            return data
+        return None
+
+    @property
+    def pos(self):
+        return self.motor.pos
+
+    async def move_to(self, pos):
+        """
+        Moves to `pos` in mm. Returns the reported position once the move has
+        completed.
+        """
+        done = self._wait(lambda e: e[0] in ('move_completed', 'stop'))
+        self.motor.pos = pos
+        return (await done)[1]
+
+    async def home(self):
+        done = self._wait(lambda e: e[0] == 'homed')
+        self.motor.home()
+        await done
+
+    async def stop_move(self):
+        done = self._wait(lambda e: e[0] == 'stop')
+        self.motor.stop_move()
+        return (await done)[1]
+
+    def close(self):
+        self.motor.remove_listener(self._on_event)
+
+
+class AsyncXYStage(_AsyncEvents):
+    """
+    asyncio wrapper around an XYStage.
+
+    Parameters
+    ----------
+
+    stage : XYStage
+        Stage to control.
+
+    loop : asyncio.AbstractEventLoop
+        Loop to resolve futures on. Defaults to the current loop.
+    """
+
+    def __init__(self, stage, loop=None):
+        super().__init__(loop)
+        self.stage = stage
+        stage.add_listener(self._on_event)
+
+    @classmethod
+    async def connect(cls, x_motor_sn, y_motor_sn, ports=None):
+        """
+        Opens the motors without blocking the event loop.
+        """
+        loop = asyncio.get_running_loop()
+        stage = await loop.run_in_executor(
+            None, lambda: stepper.XYStage(x_motor_sn, y_motor_sn,
+                                          ports=ports))
+        return cls(stage, loop)
+
+    def _position_of(self, event):
+        axis, event_type, data = event
+        if event_type in ('pos', 'status', 'move_completed', 'stop'):
+            return (self.stage.x, self.stage.y)
+        return None
+
+    def _arrival(self, axis):
+        return self._wait(lambda e: e[0] == axis and e[1] == 'arrived')
+
+    @property
+    def position(self):
+        return (self.stage.x, self.stage.y)
+
+    async def move_to(self, x=None, y=None, synchronize=False):
+        """
+        Moves to (x, y) in mm relative to the zeroed position, both axes at
+        once. Either coordinate may be None to leave that axis alone. See
+        XYStage.move_to().
+
+        Returns
+        -------
+        The time.monotonic() timestamp at which the stage settled.
+        """
+        return await asyncio.wrap_future(
+            self.stage.move_to(x, y, synchronize=synchronize),
+            loop=self._loop)
+
+    async def home(self, center_pos=None):
+        """
+        Homes both axes, then moves to the absolute position `center_pos` in
+        mm if given.
+        """
+        homed = [self._wait(lambda e: e[0] == 'x' and e[1] == 'homed'),
+                 self._wait(lambda e: e[0] == 'y' and e[1] == 'homed')]
+        self.stage.home()
+        await asyncio.gather(*homed)
+        if center_pos is not None:
+            arrivals = [self._arrival('x'), self._arrival('y')]
+            self.stage.x_motor.pos = center_pos[0]
+            self.stage.y_motor.pos = center_pos[1]
+            await asyncio.gather(*arrivals)
+        return self.position
+
+    async def close(self):
+        self.stage.remove_listener(self._on_event)
+        await self._loop.run_in_executor(None, self.stage.stop)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Backlash compensation for one axis.
+
+Every move finishes approaching its target in the same direction, so gear
+backlash is always taken up on the same side. A move that already travels
+in that direction is sent as is; only a move against it gets an extra leg
+that overshoots the target and comes back.
+"""
+
+import threading
+import time
+
+
+class BacklashCompensator:
+    """
+    Plans the legs of a move for one axis.
+
+    Parameters
+    ----------
+
+    overshoot : float
+        Distance in mm to go past the target when the move travels against
+        the approach direction. 0 disables compensation.
+
+    direction : int
+        Direction of the final approach, 1 or -1.
+    """
+
+    def __init__(self, overshoot=0.2, direction=1):
+        self.overshoot = overshoot
+        self.direction = direction
+        self.last_direction = None
+
+    def plan(self, start, target, resolution=0):
+        """
+        Returns the absolute positions in mm to move through to get from
+        `start` to `target`. The last one is always `target`, and there are
+        none if `start` is already within `resolution` mm of it.
+        """
+        if abs(target - start) < resolution:
+            return []
+        if not self.overshoot:
+            return [target]
+        distance = (target - start) * self.direction
+        if distance > 0 and (self.last_direction == self.direction
+                             or distance >= self.overshoot):
+            # Already approaching from the right side, and either the slack
+            # is taken up or the move is long enough to take it up.
+            return [target]
+        return [target - self.direction * self.overshoot, target]
+
+    def moved(self, start, end):
+        """
+        Records a move from `start` to `end`.
+        """
+        if end > start:
+            self.last_direction = 1
+        elif end < start:
+            self.last_direction = -1
+
+    def moving(self, direction):
+        """
+        Records an open-ended move in `direction`, 1 or -1.
+        """
+        self.last_direction = direction
+
+    def reset(self):
+        """
+        Forgets the last approach direction, e.g. after homing.
+        """
+        self.last_direction = None
+
+
+def calibrate(motor, position, distance=0.5, repeats=3, settle=0.1,
+              timeout=10):
+    """
+    Measures the lost motion of `motor` from encoder readback.
+
+    The motor approaches `position` alternately from below and above, and the
+    position reported after each approach has settled is read back. The mean
+    difference between the two sides is returned. Blocks until done, so it
+    must not be called from the reactor thread.
+
+    Parameters
+    ----------
+
+    motor : ThorStepper
+        A started motor.
+
+    position : float
+        Absolute position in mm to measure around.
+
+    distance : float
+        How far from `position` each approach starts, in mm. Must be larger
+        than the backlash.
+
+    repeats : int
+        Number of approach pairs to average.
+
+    settle : float
+        Seconds to wait after each approach before reading the position.
+
+    timeout : float
+        Seconds to wait for any single move or reply.
+
+    Returns
+    -------
+    The measured backlash in mm.
+    """
+    lock = threading.Lock()
+    waiting = {}
+
+    def on_event(event):
+        with lock:
+            done = waiting.pop(event[0], None)
+        if done is not None:
+            done[1].append(event[1])
+            done[0].set()
+
+    def wait_for(event_type, command):
+        done = (threading.Event(), [])
+        with lock:
+            waiting[event_type] = done
+        command()
+        if not done[0].wait(timeout):
+            raise IOError('Timed out waiting for {}.'.format(event_type))
+        return done[1][0]
+
+    def approach(start):
+        for pos in (start, position):
+            wait_for('move_completed',
+                     lambda: setattr(motor, 'pos', pos))
+        time.sleep(settle)
+        return wait_for('pos', motor.request_pos)
+
+    motor.add_listener(on_event)
+    try:
+        differences = []
+        for _ in range(repeats):
+            below = approach(position - distance)
+            above = approach(position + distance)
+            differences.append(abs(above - below))
+    finally:
+        motor.remove_listener(on_event)
+    return sum(differences) / len(differences)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Outbound command queue of one motor.
+
+Commands are queued by any thread and written by the reactor thread, so only
+one thread ever writes to a serial port.
+"""
+
+import collections
+import threading
+import time
+
+Command = collections.namedtuple('Command', ['data', 'key', 'motion',
+                                             'throttle', 'timing'])
+
+
+class CommandQueue:
+    """
+    Queue of encoded commands that collapses superseded ones.
+
+    - A command with a `key` replaces any queued command with the same key,
+      e.g. the latest velocity or the latest target wins. The new command
+      goes to the back so it still follows anything it may depend on.
+    - An `urgent` command, e.g. stop, goes to the front and drops every queued
+      `motion` command.
+    - A `throttle` command is held back while it is the last command queued
+      and one with its key was written less than `min_interval` seconds ago,
+      so bursts of parameter updates are collapsed. It never delays commands
+      queued behind it.
+
+    `timing` is passed through untouched, for the writer to record when the
+    command actually went out.
+    """
+
+    def __init__(self, min_interval=0.05):
+        self.min_interval = min_interval
+        self._queue = collections.deque()
+        self._last_written = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, data, key=None, motion=False, urgent=False,
+            throttle=False, timing=None):
+        command = Command(data, key, motion, throttle, timing)
+        with self._lock:
+            if urgent:
+                self._queue = collections.deque(
+                    c for c in self._queue if not c.motion)
+                self._queue.appendleft(command)
+                return
+            if key is not None:
+                self._queue = collections.deque(
+                    c for c in self._queue if c.key != key)
+            self._queue.append(command)
+
+    def pop(self, now=None):
+        """
+        Returns (command, 0) for the next Command to write, or (None, delay)
+        when nothing should be written for `delay` seconds. The delay is None
+        if the queue is empty.
+        """
+        with self._lock:
+            if not self._queue:
+                return None, None
+            command = self._queue[0]
+            if command.throttle and len(self._queue) == 1:
+                now = time.monotonic() if now is None else now
+                wait = (self._last_written.get(command.key, -self.min_interval)
+                        + self.min_interval - now)
+                if wait > 0:
+                    return None, wait
+            self._queue.popleft()
+            if command.key is not None:
+                self._last_written[command.key] = (
+                    time.monotonic() if now is None else now)
+            return command, 0
+
+    def clear(self):
+        with self._lock:
+            self._queue.clear()
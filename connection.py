@@ -0,0 +1,252 @@
+#!/usr/bin/env python3
+"""
+Finding and opening motors by serial number.
+
+Enumerating serial ports is slow, so the port of each serial number is
+cached on disk. A cached port is checked against the udev links in
+/dev/serial/by-id when they exist, and every motor's serial number is
+confirmed by the controller's answer to a hardware info request. A stale
+entry triggers a fresh scan. All motors are opened and configured in
+parallel. A Supervisor reopens motors whose link drops.
+"""
+
+import concurrent.futures
+import functools
+import glob
+import json
+import os
+import threading
+
+import serial
+from serial.tools import list_ports
+
+import stepper
+
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'ncp_stage',
+                          'ports.json')
+BY_ID = '/dev/serial/by-id'
+
+
+class PortCache:
+    """
+    Serial number to device path mapping, persisted to `path`. Thread safe.
+    """
+
+    def __init__(self, path=CACHE_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        try:
+            with open(path) as f:
+                self.ports = json.load(f)
+        except (OSError, ValueError):
+            self.ports = {}
+
+    def save(self):
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(self.ports, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            pass
+
+    def _by_id(self, serial_number):
+        """
+        Returns the port udev links to `serial_number`, None if there is no
+        such link, or False if udev links aren't available.
+        """
+        if not os.path.isdir(BY_ID):
+            return False
+        for link in glob.glob(os.path.join(BY_ID, '*')):
+            if serial_number in os.path.basename(link):
+                return os.path.realpath(link)
+        return None
+
+    def find(self, serial_number, rescan=False):
+        """
+        Returns the port of `serial_number`, or None if it isn't connected.
+        """
+        port = self._by_id(serial_number)
+        if port:
+            self._set(serial_number, port)
+            return port
+        cached = self.ports.get(serial_number)
+        if (not rescan and port is False and cached is not None and
+                os.path.exists(cached)):
+            return cached
+        for p in list_ports.comports():
+            if serial_number in p[2]:
+                self._set(serial_number, p[0])
+                return p[0]
+        self.forget(serial_number)
+        return None
+
+    def _set(self, serial_number, port):
+        with self._lock:
+            if self.ports.get(serial_number) != port:
+                self.ports[serial_number] = port
+                self._save()
+
+    def forget(self, serial_number):
+        with self._lock:
+            if self.ports.pop(serial_number, None) is not None:
+                self._save()
+
+
+def open_motor(port, timeout=2.0):
+    """
+    Opens and configures the motor on `port`, and waits for its controller
+    to answer.
+
+    Returns
+    -------
+    The started ThorStepper.
+    """
+    try:
+        motor = stepper.ThorStepper(port=port)
+    except serial.SerialException as e:
+        raise IOError(str(e))
+    try:
+        motor.start()
+        motor.wait_ready(timeout)
+    except IOError:
+        motor.stop()
+        raise
+    return motor
+
+
+def _matches(serial_number, info):
+    return not serial_number.isdigit() or \
+        int(serial_number) == info['serial_number']
+
+
+class Supervisor:
+    """
+    Reopens motors whose link drops.
+
+    On a motor's 'disconnected' event its port is looked up again by serial
+    number and reopened on a background thread, retrying every
+    `retry_interval` seconds until the controller answers or stop() is
+    called. The motor then emits a 'reconnected' event.
+
+    Parameters
+    ----------
+
+    motors : list
+        ThorSteppers to watch.
+
+    serial_numbers : list
+        Serial number identifier of each motor. None uses the serial number
+        the controller reported.
+
+    cache : PortCache
+        Defaults to the cache in the user's cache directory.
+    """
+
+    def __init__(self, motors, serial_numbers=None, cache=None,
+                 retry_interval=0.5, timeout=2.0):
+        self.cache = cache or PortCache()
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self._stop = threading.Event()
+        self._listeners = []
+        for motor, serial_number in zip(
+                motors, serial_numbers or [None] * len(motors)):
+            listener = functools.partial(self._on_event, motor, serial_number)
+            motor.add_listener(listener)
+            self._listeners.append((motor, listener))
+
+    def find_port(self, serial_number):
+        """
+        Returns the current port of `serial_number`, or None.
+        """
+        return self.cache.find(serial_number, rescan=True)
+
+    def _on_event(self, motor, serial_number, event):
+        if event[0] == 'disconnected' and not self._stop.is_set():
+            threading.Thread(target=self._reconnect,
+                             args=(motor, serial_number), daemon=True,
+                             name='Reconnect').start()
+
+    def _reconnect(self, motor, serial_number):
+        if serial_number is None and motor.info is not None:
+            serial_number = str(motor.info['serial_number'])
+        expected = None
+        if serial_number is not None and serial_number.isdigit():
+            expected = int(serial_number)
+        while not self._stop.is_set() and not motor.connected:
+            port = self.find_port(serial_number) if serial_number else None
+            if port is not None:
+                try:
+                    motor.reopen(port, self.timeout, expected)
+                    return
+                except IOError:
+                    pass
+            self._stop.wait(self.retry_interval)
+
+    def stop(self):
+        self._stop.set()
+        for motor, listener in self._listeners:
+            motor.remove_listener(listener)
+
+
+def _connect(serial_number, port, cache, timeout):
+    if port is not None:
+        return open_motor(port, timeout)
+    for rescan in (False, True):
+        port = cache.find(serial_number, rescan)
+        if port is None:
+            break
+        try:
+            motor = open_motor(port, timeout)
+        except IOError:
+            continue
+        if _matches(serial_number, motor.info):
+            return motor
+        motor.stop()
+    cache.forget(serial_number)
+    raise IOError('Motor {} not connected.'.format(serial_number))
+
+
+def connect(serial_numbers, ports=None, timeout=2.0, cache=None):
+    """
+    Opens the motors with `serial_numbers` in parallel.
+
+    Parameters
+    ----------
+
+    serial_numbers : list
+        Serial number identifiers of the motors.
+
+    ports : list
+        Ports to open instead of looking up the serial numbers. Not
+        verified.
+
+    timeout : float
+        Seconds to wait for each controller to answer.
+
+    cache : PortCache
+        Defaults to the cache in the user's cache directory.
+
+    Returns
+    -------
+    A list of started ThorSteppers in the order of `serial_numbers`.
+    """
+    cache = cache or PortCache()
+    ports = ports or [None] * len(serial_numbers)
+    with concurrent.futures.ThreadPoolExecutor(len(serial_numbers)) as pool:
+        futures = [pool.submit(_connect, serial_number, port, cache, timeout)
+                   for serial_number, port in zip(serial_numbers, ports)]
+        concurrent.futures.wait(futures)
+    motors = [f.result() for f in futures if f.exception() is None]
+    for f in futures:
+        if f.exception() is not None:
+            for motor in motors:
+                motor.stop()
+            raise f.exception()
+    return motors
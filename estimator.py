@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Position estimates between controller updates.
+
+The controller only reports its position every so often, so a move is
+modelled as the rest-to-rest trapezoidal profile it was commanded with,
+starting from where the axis was estimated to be. Each reported position
+shifts the model in time to pass through it, which absorbs command latency
+and start-up delays without any extra serial traffic.
+"""
+
+import math
+import threading
+import time
+
+import motion
+
+
+class MotionEstimator:
+    """
+    Estimates the position of one axis at any moment. Thread safe.
+
+    Times are time.monotonic() seconds and positions absolute mm.
+
+    Parameters
+    ----------
+
+    pos : float
+        Position to start from.
+    """
+
+    def __init__(self, pos=0.0):
+        self._lock = threading.Lock()
+        self._pos = pos
+        # (start time, start pos, distance, velocity, acceleration)
+        self._move = None
+        self._last = None
+
+    @property
+    def moving(self):
+        return self._move is not None
+
+    def command(self, t, target, velocity, acceleration):
+        """
+        Starts modelling a move to `target` commanded at `t`.
+        """
+        with self._lock:
+            start = self._predict(t)
+            self._move = (t, start, target - start, velocity, acceleration)
+
+    def sample(self, t, pos):
+        """
+        Corrects the model with the position `pos` reported at `t`.
+        """
+        with self._lock:
+            self._pos = pos
+            if self._move is None:
+                return
+            t0, start, distance, velocity, acceleration = self._move
+            covered = math.copysign(1, distance) * (pos - start)
+            if covered <= 0:
+                # Not started yet, so it can't have started before now.
+                t0 = max(t0, t)
+            else:
+                t0 = t - motion.move_elapsed(distance, velocity, acceleration,
+                                             covered)
+            self._move = (t0, start, distance, velocity, acceleration)
+
+    def stop(self, t):
+        """
+        Holds the estimate where it is at `t`, e.g. when a move is stopped.
+        Later samples still correct it.
+        """
+        with self._lock:
+            self._pos = self._predict(t)
+            self._last, self._move = self._move or self._last, None
+
+    def stopped(self, t, pos):
+        """
+        Ends the move at the position `pos` reported at `t`.
+        """
+        with self._lock:
+            self._pos = pos
+            self._last, self._move = self._move or self._last, None
+
+    def predict(self, t=None):
+        """
+        Returns the estimated position at `t`, defaulting to now.
+        """
+        with self._lock:
+            return self._predict(time.monotonic() if t is None else t)
+
+    def _predict(self, t):
+        if self._move is None:
+            return self._pos
+        t0, start, distance, velocity, acceleration = self._move
+        return start + motion.move_position(distance, velocity, acceleration,
+                                            t - t0)
+
+    def time_at(self, pos):
+        """
+        Returns the time at which the current, or else the last, move passes
+        `pos`, or None if it doesn't.
+        """
+        with self._lock:
+            move = self._move or self._last
+            if move is None:
+                return None
+            t0, start, distance, velocity, acceleration = move
+            covered = math.copysign(1, distance) * (pos - start)
+            if covered < 0 or covered > abs(distance):
+                return None
+            return t0 + motion.move_elapsed(distance, velocity, acceleration,
+                                            covered)
+
+    def eta(self, t=None):
+        """
+        Returns the estimated seconds from `t`, defaulting to now, until the
+        move arrives, 0 if there is none.
+        """
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            if self._move is None:
+                return 0
+            t0, start, distance, velocity, acceleration = self._move
+            return max(0, t0 + motion.move_time(distance, velocity,
+                                                acceleration) - t)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Command-to-reply latency and move settle measurement.
+
+Commands are timestamped with a monotonic clock when they are written and
+matched to the reply that completes them when it is parsed. Latencies are
+collected per axis and command kind, e.g. ('x', 'move') or ('y', 'pos').
+Moves are recorded per axis with the time they took to settle on target
+and the position error they were left with.
+"""
+
+import bisect
+import collections
+import math
+import threading
+import time
+
+
+def _bucket_bounds(lowest=0.001, highest=100.0, per_decade=10):
+    """
+    Returns log spaced upper bucket bounds in seconds.
+    """
+    decades = int(round(math.log10(highest / lowest)))
+    return [lowest * 10**(i / per_decade)
+            for i in range(decades * per_decade + 1)]
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies in log spaced buckets, 10 per decade from 1 ms to
+    100 s. Percentiles are interpolated within a bucket, so they are accurate
+    to about 12%.
+    """
+
+    BOUNDS = _bucket_bounds()
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last = None
+
+    def add(self, latency):
+        self.counts[bisect.bisect_left(self.BOUNDS, latency)] += 1
+        self.count += 1
+        self.total += latency
+        self.last = latency
+        if self.min is None or latency < self.min:
+            self.min = latency
+        if self.max is None or latency > self.max:
+            self.max = latency
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, p):
+        """
+        Returns the approximate `p`th percentile in seconds, or None if empty.
+        """
+        if not self.count:
+            return None
+        rank = p / 100 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lo = self.BOUNDS[i - 1] if i > 0 else 0
+                hi = self.BOUNDS[i] if i < len(self.BOUNDS) else self.max
+                value = lo + (hi - lo) * (rank - seen) / n
+                return min(max(value, self.min), self.max)
+            seen += n
+        return self.max
+
+    def summary(self):
+        """
+        Returns a dict of count, mean, min, p50, p90, p99, max and last.
+        """
+        return {'count': self.count, 'mean': self.mean, 'min': self.min,
+                'p50': self.percentile(50), 'p90': self.percentile(90),
+                'p99': self.percentile(99), 'max': self.max,
+                'last': self.last}
+
+
+class LatencyTracker:
+    """
+    Matches sent commands to their replies and keeps a LatencyHistogram per
+    (axis, kind). Thread safe.
+
+    A command is sent() with the kind of command and the reply that
+    completes it. Replies are matched to the oldest outstanding command
+    waiting for them, unless `replace` was given when sending, in which case
+    only the latest command is outstanding. That is the case for moves,
+    where a new move supersedes the one in progress.
+
+    Other commands outstanding for more than `timeout` seconds are taken to
+    have lost their reply and are dropped, so that a later reply isn't
+    matched to them. They are counted in `lost`.
+    """
+
+    def __init__(self, timeout=5.0):
+        self.timeout = timeout
+        self.lost = collections.Counter()
+        self.histograms = {}
+        self._pending = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+
+    def sent(self, axis, kind, reply, t=None, replace=False):
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            pending = self._pending[(axis, reply)]
+            if replace:
+                pending.clear()
+                pending.append((kind, t, None))
+            else:
+                self._expire(axis, pending, t)
+                pending.append((kind, t, t + self.timeout))
+
+    def _expire(self, axis, pending, t):
+        while pending and pending[0][2] is not None and pending[0][2] < t:
+            kind = pending.popleft()[0]
+            self.lost[(axis, kind)] += 1
+
+    def received(self, axis, reply, t=None):
+        """
+        Records the latency of the command completed by `reply`. Returns it
+        in seconds, or None if no command was waiting for it.
+        """
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            pending = self._pending.get((axis, reply))
+            if pending:
+                self._expire(axis, pending, t)
+            if not pending:
+                return None
+            kind, start, expires = pending.popleft()
+            histogram = self.histograms.get((axis, kind))
+            if histogram is None:
+                histogram = self.histograms[(axis, kind)] = LatencyHistogram()
+            histogram.add(t - start)
+        return t - start
+
+    def discard(self, axis, reply):
+        """
+        Forgets commands waiting for `reply`, e.g. moves that were stopped.
+        """
+        with self._lock:
+            self._pending.pop((axis, reply), None)
+
+    def histogram(self, axis, kind):
+        """
+        Returns the LatencyHistogram of (axis, kind), or None.
+        """
+        return self.histograms.get((axis, kind))
+
+    def summary(self):
+        """
+        Returns {(axis, kind): histogram summary} for everything measured.
+        """
+        with self._lock:
+            return {key: h.summary()
+                    for key, h in sorted(self.histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self.histograms = {}
+            self.lost.clear()
+            self._pending.clear()
+
+
+SettleRecord = collections.namedtuple(
+    'SettleRecord', ['axis', 't', 'settle_time', 'error', 'corrections',
+                     'on_target', 'clamped'])
+
+
+class SettleTracker:
+    """
+    Keeps the settle time and residual error of every move. Thread safe.
+
+    Each move of an axis is added as a SettleRecord: when it settled, the
+    seconds from the move command, the final error in encoder counts, the
+    number of correction moves, whether it ended within tolerance and
+    whether its target was clamped to the axis limits. The latest `size`
+    records are kept in `records`.
+    """
+
+    def __init__(self, size=1000):
+        self.records = collections.deque(maxlen=size)
+        self.histograms = {}
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.records.append(record)
+            histogram = self.histograms.get(record.axis)
+            if histogram is None:
+                histogram = self.histograms[record.axis] = LatencyHistogram()
+                self._totals[record.axis] = collections.Counter()
+            histogram.add(record.settle_time)
+            totals = self._totals[record.axis]
+            totals['error_sum'] += abs(record.error)
+            totals['error_max'] = max(totals['error_max'], abs(record.error))
+            totals['corrections'] += record.corrections
+            totals['off_target'] += not record.on_target
+            totals['clamped'] += record.clamped
+
+    def summary(self):
+        """
+        Returns {axis: summary} with the settle time histogram summary, and
+        error_mean and error_max in counts, corrections, off_target and
+        clamped totals.
+        """
+        with self._lock:
+            summary = {}
+            for axis, histogram in sorted(self.histograms.items()):
+                totals = self._totals[axis]
+                stats = histogram.summary()
+                stats.update(error_mean=totals['error_sum'] / histogram.count,
+                             error_max=totals['error_max'],
+                             corrections=totals['corrections'],
+                             off_target=totals['off_target'],
+                             clamped=totals['clamped'])
+                summary[axis] = stats
+            return summary
+
+    def reset(self):
+        with self._lock:
+            self.records.clear()
+            self.histograms = {}
+            self._totals = {}
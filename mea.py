@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+MEA electrode layouts.
+
+Layout coordinates are in um, x along the lettered columns and y along the
+numbered rows. The 120 electrode MEA has its electrodes on a 100 um grid
+with A1 at the origin.
+
+Other layouts are loaded from JSON files into a registry:
+
+    {"name": "256", "pitch": 200, "origin": "h8",
+     "electrodes": {"a2": [0, 200], "a3": [0, 400], ...}}
+
+`origin` is the electrode, or [x, y] layout position, the stage is centered
+on when zeroed, and an optional `flip` of [1 or -1, 1 or -1] gives the
+direction of the stage axes relative to the layout, [-1, -1] by default.
+"""
+
+import glob
+import json
+import os
+
+import numpy as np
+
+ELECTRODES_120 = ['f7', 'f8', 'f12', 'f11', 'f10', 'f9', 'e12', 'e11',
+                  'e10', 'e9', 'd12', 'd11', 'd10', 'd9', 'c11', 'c10',
+                  'b10', 'e8', 'c9', 'b9', 'a9', 'd8', 'c8', 'b8',
+                  'a8', 'd7', 'c7', 'b7', 'a7', 'e7', 'f6', 'e6', 'a6',
+                  'b6', 'c6', 'd6', 'a5', 'b5', 'c5', 'd5', 'a4', 'b4',
+                  'c4', 'd4', 'b3', 'c3', 'c2', 'e5', 'd3', 'd2', 'd1',
+                  'e4', 'e3', 'e2', 'e1', 'f4', 'f3', 'f2', 'f1', 'f5',
+                  'g6', 'g5', 'g1', 'g2', 'g3', 'g4', 'h1', 'h2', 'h3',
+                  'h4', 'j1', 'j2', 'j3', 'j4', 'k2', 'k3', 'l3', 'h5',
+                  'k4', 'l4', 'm4', 'j5', 'k5', 'l5', 'm5', 'j6', 'k6',
+                  'l6', 'm6', 'h6', 'g7', 'h7', 'm7', 'l7', 'k7', 'j7',
+                  'm8', 'l8', 'k8', 'j8', 'm9', 'l9', 'k9', 'j9',
+                  'l10', 'k10', 'k11', 'h8', 'j10', 'j11', 'j12', 'h9',
+                  'h10', 'h11', 'h12', 'g8', 'g9', 'g10', 'g11', 'g12']
+
+COLUMNS_120 = {'a': 0, 'b': 1, 'c': 2, 'd': 3, 'e': 4, 'f': 5, 'g': 6,
+               'h': 7, 'j': 8, 'k': 9, 'l': 10, 'm': 11}
+
+PITCH = 100
+
+# Column letters of grid layouts, skipping 'i' like the 120 electrode MEA.
+COLUMN_LETTERS = 'abcdefghjklmnopqrstuvwxyz'
+
+LAYOUT_DIR = os.path.join(os.path.expanduser('~'), '.config', 'ncp_stage',
+                          'layouts')
+
+
+class _GridIndex:
+    """
+    Spatial hash of points in square cells for nearest neighbour queries.
+    """
+
+    def __init__(self, points, cell):
+        self.points = points
+        self.cell = cell
+        self.cells = {}
+        keys = np.floor(points / cell).astype(int)
+        for i, key in enumerate(map(tuple, keys)):
+            self.cells.setdefault(key, []).append(i)
+        self.cells = {k: np.array(v) for k, v in self.cells.items()}
+        # Bounding box of the occupied cells.
+        lo = keys.min(axis=0) if len(keys) else (0, 0)
+        hi = keys.max(axis=0) if len(keys) else (0, 0)
+        self._lo = (int(lo[0]), int(lo[1]))
+        self._hi = (int(hi[0]), int(hi[1]))
+
+    def nearest(self, x, y):
+        """
+        Returns the index of the point nearest (x, y), or None if empty.
+        """
+        if not self.cells:
+            return None
+        cx, cy = int(np.floor(x / self.cell)), int(np.floor(y / self.cell))
+        (left, top), (right, bottom) = self._lo, self._hi
+        # Rings inside `first` miss the occupied cells, those past `last`
+        # lie wholly outside them.
+        first = max(0, left - cx, cx - right, top - cy, cy - bottom)
+        last = max(abs(cx - left), abs(cx - right), abs(cy - top),
+                   abs(cy - bottom))
+        best, best_d = None, None
+        for ring in range(first, last + 1):
+            # Points beyond this ring are at least `ring` cells away.
+            if best_d is not None and best_d <= ((ring - 1) * self.cell)**2:
+                break
+            for key in self._ring(cx, cy, ring):
+                idx = self.cells.get(key)
+                if idx is None:
+                    continue
+                d = ((self.points[idx] - (x, y))**2).sum(axis=1)
+                i = d.argmin()
+                if best_d is None or d[i] < best_d:
+                    best, best_d = int(idx[i]), d[i]
+        return best
+
+    def _ring(self, cx, cy, r):
+        """
+        Yields the keys of the cells `r` cells from (cx, cy) that lie within
+        the bounding box of the occupied cells.
+        """
+        (left, top), (right, bottom) = self._lo, self._hi
+        if r == 0:
+            yield (cx, cy)
+            return
+        xs = range(max(cx - r, left), min(cx + r, right) + 1)
+        for y in (cy - r, cy + r):
+            if top <= y <= bottom:
+                for x in xs:
+                    yield (x, y)
+        ys = range(max(cy - r + 1, top), min(cy + r - 1, bottom) + 1)
+        for x in (cx - r, cx + r):
+            if left <= x <= right:
+                for y in ys:
+                    yield (x, y)
+
+
+class Layout:
+    """
+    Electrode positions of an MEA and the stage coordinates they map to.
+
+    Parameters
+    ----------
+
+    name : str
+        Registry name, e.g. '120'.
+
+    tags : list
+        Electrode names, e.g. 'a4'.
+
+    positions : array
+        (n, 2) layout positions in um of the electrodes in `tags`.
+
+    pitch : float
+        Electrode spacing in um.
+
+    origin : str or tuple
+        Electrode, or layout position in um, the zeroed stage is centered
+        on.
+
+    flip : tuple
+        Direction, 1 or -1, of the stage x and y axes relative to the
+        layout's.
+    """
+
+    def __init__(self, name, tags, positions, pitch, origin=(0, 0),
+                 flip=(-1, -1)):
+        self.name = name
+        self.tags = [t.lower() for t in tags]
+        self.positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        self.pitch = pitch
+        self._indices = {tag: i for i, tag in enumerate(self.tags)}
+        self.origin = np.array(self.position(origin) if isinstance(
+            origin, str) else origin, dtype=float)
+        self.flip = np.array(flip, dtype=float)
+        self.index = _GridIndex(self.positions, pitch)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def position(self, tag):
+        """
+        Returns the (x, y) layout position in um of electrode `tag`.
+        """
+        x, y = self.positions[self._indices[tag.lower()]]
+        return (float(x), float(y))
+
+    @property
+    def bounds(self):
+        """
+        (left, top, right, bottom) of the electrode positions in um.
+        """
+        (left, top), (right, bottom) = (self.positions.min(axis=0),
+                                        self.positions.max(axis=0))
+        return (float(left), float(top), float(right), float(bottom))
+
+    def nearest(self, layout_pos):
+        """
+        Returns the tag of the electrode nearest `layout_pos` in um.
+        """
+        i = self.index.nearest(*layout_pos)
+        return None if i is None else self.tags[i]
+
+    def stage_position(self, layout_pos):
+        """
+        Returns the (x, y) stage position in mm for a layout position in um.
+        """
+        x, y = self.flip * (np.asarray(layout_pos) - self.origin) / 1000
+        return (float(x), float(y))
+
+    def stage_layout_position(self, stage_pos):
+        """
+        Returns the (x, y) layout position in um for a stage position in mm.
+        The inverse of stage_position().
+        """
+        x, y = self.origin + np.asarray(stage_pos) * 1000 / self.flip
+        return (float(x), float(y))
+
+
+def grid_layout(name, columns, rows, pitch, origin=(0, 0), flip=(-1, -1),
+                skip=()):
+    """
+    Returns a Layout of `columns` x `rows` electrodes `pitch` um apart,
+    tagged like 'a1' with the column letters the 120 electrode MEA uses, or
+    like '1-1' with more columns than letters. Tags in `skip` are left out.
+    """
+    tags, positions = [], []
+    for c in range(columns):
+        for r in range(rows):
+            if columns <= len(COLUMN_LETTERS):
+                tag = '{}{}'.format(COLUMN_LETTERS[c], r + 1)
+            else:
+                tag = '{}-{}'.format(c + 1, r + 1)
+            if tag not in skip:
+                tags.append(tag)
+                positions.append((c * pitch, r * pitch))
+    return Layout(name, tags, positions, pitch, origin, flip)
+
+
+def read_layout(path):
+    """
+    Returns the Layout described by the JSON file at `path`.
+    """
+    with open(path) as f:
+        spec = json.load(f)
+    electrodes = spec['electrodes']
+    name = spec.get('name', os.path.splitext(os.path.basename(path))[0])
+    return Layout(name, list(electrodes), list(electrodes.values()),
+                  spec['pitch'], spec.get('origin', (0, 0)),
+                  spec.get('flip', (-1, -1)))
+
+
+LAYOUTS = {}
+
+
+def register(layout):
+    LAYOUTS[layout.name] = layout
+    return layout
+
+
+def load_layouts(directory=LAYOUT_DIR):
+    """
+    Registers every *.json layout in `directory`. Returns their names.
+    """
+    names = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        names.append(register(read_layout(path)).name)
+    return names
+
+
+def get_layout(name):
+    """
+    Returns the registered layout `name`, loading the layout directory if it
+    isn't registered yet. `name` may also be the path of a layout file.
+    """
+    if name not in LAYOUTS:
+        if name.endswith('.json') and os.path.isfile(name):
+            return register(read_layout(name))
+        load_layouts()
+    return LAYOUTS[name]
+
+
+MEA_120 = register(Layout(
+    '120', ELECTRODES_120, [(COLUMNS_120[t[0]] * PITCH, (int(t[1:]) - 1) *
+                             PITCH) for t in ELECTRODES_120],
+    PITCH, origin='a4'))
+
+
+def layout_position(tag):
+    """
+    Returns the (x, y) layout position in um of electrode `tag`, e.g. 'a4',
+    of the 120 electrode MEA.
+    """
+    return MEA_120.position(tag)
+
+
+def stage_position(layout_pos):
+    """
+    Returns the (x, y) stage position in mm for a layout position in um. The
+    zeroed stage is centered on A4.
+    """
+    return MEA_120.stage_position(layout_pos)
+
+
+def stage_layout_position(stage_pos):
+    """
+    Returns the (x, y) layout position in um for a stage position in mm. The
+    inverse of stage_position().
+    """
+    return MEA_120.stage_layout_position(stage_pos)
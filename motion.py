@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Trapezoidal motion profile calculations.
+
+Distances are in mm, velocities in mm/s and accelerations in mm/s^2.
+"""
+
+import math
+from collections import namedtuple
+
+from util import limit
+
+
+def move_time(distance, velocity, acceleration):
+    """
+    Returns the time in seconds of a rest-to-rest move over `distance`.
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return 0
+    if distance >= velocity * velocity / acceleration:
+        # Reaches cruise velocity.
+        return distance / velocity + velocity / acceleration
+    return 2 * math.sqrt(distance / acceleration)
+
+
+def velocity_for_time(distance, duration, acceleration):
+    """
+    Returns the cruise velocity that makes a move over `distance` take
+    `duration` seconds, or None if it can't be done that quickly.
+    """
+    distance = abs(distance)
+    if distance == 0:
+        return None
+    disc = (acceleration * duration)**2 - 4 * acceleration * distance
+    if disc < 0:
+        return None
+    return (acceleration * duration - math.sqrt(disc)) / 2
+
+
+def move_position(distance, velocity, acceleration, t):
+    """
+    Returns the distance covered `t` seconds into a rest-to-rest move over
+    `distance`, with the sign of `distance`.
+    """
+    d = abs(distance)
+    total = move_time(d, velocity, acceleration)
+    if t >= total:
+        return distance
+    if t <= 0:
+        return 0
+    peak = min(velocity, math.sqrt(d * acceleration))
+    ramp = peak / acceleration
+    if t < ramp:
+        covered = acceleration * t * t / 2
+    elif t < total - ramp:
+        covered = peak * ramp / 2 + peak * (t - ramp)
+    else:
+        covered = d - acceleration * (total - t)**2 / 2
+    return math.copysign(covered, distance)
+
+
+def move_elapsed(distance, velocity, acceleration, covered):
+    """
+    Returns the time in seconds at which a rest-to-rest move over `distance`
+    has covered `covered`. The inverse of move_position().
+    """
+    d = abs(distance)
+    covered = limit(abs(covered), 0, d)
+    total = move_time(d, velocity, acceleration)
+    if d == 0:
+        return 0
+    peak = min(velocity, math.sqrt(d * acceleration))
+    ramp = peak / acceleration
+    ramp_distance = peak * ramp / 2
+    if covered < ramp_distance:
+        return math.sqrt(2 * covered / acceleration)
+    if covered <= d - ramp_distance:
+        return ramp + (covered - ramp_distance) / peak
+    return total - math.sqrt(2 * (d - covered) / acceleration)
+
+
+Profile = namedtuple('Profile', ['velocity', 'acceleration', 'duration'])
+
+
+class MotionPlanner:
+    """
+    Chooses the velocity and acceleration of each move within hardware
+    limits so that the stage settles as soon as possible.
+
+    Settling is modelled as `settle_time` plus `settle_per_acceleration`
+    times the acceleration used, since harder stops ring for longer. With
+    the default of no acceleration penalty every move uses the limits.
+
+    Parameters
+    ----------
+
+    max_velocity : float
+        Highest velocity the hardware supports, in mm/s.
+
+    max_acceleration : float
+        Highest acceleration the hardware supports, in mm/s^2.
+
+    min_acceleration : float
+        Lowest acceleration worth using, in mm/s^2.
+
+    settle_time : float
+        Seconds the stage takes to settle after any move.
+
+    settle_per_acceleration : float
+        Additional settle seconds per mm/s^2 of acceleration.
+    """
+
+    def __init__(self, max_velocity=30, max_acceleration=180000 / 34304,
+                 min_acceleration=0.5, settle_time=0.0,
+                 settle_per_acceleration=0.0):
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.min_acceleration = min_acceleration
+        self.settle_time = settle_time
+        self.settle_per_acceleration = settle_per_acceleration
+
+    def _time(self, distance, acceleration):
+        return (move_time(distance, self.max_velocity, acceleration) +
+                self.settle_time + self.settle_per_acceleration * acceleration)
+
+    def plan(self, distance, current=None):
+        """
+        Returns the Profile to use for a move over `distance` mm, with its
+        predicted time-to-settle as the duration.
+
+        If `current` (velocity, acceleration) parameters would give the same
+        motion, they are returned unchanged so they needn't be resent.
+        """
+        distance = abs(distance)
+        lo, hi = self.min_acceleration, self.max_acceleration
+        candidates = {lo, hi}
+        k = self.settle_per_acceleration
+        if k > 0 and distance > 0:
+            # Optimum without (triangle) and with (trapezoid) a cruise phase.
+            candidates.add(limit((math.sqrt(distance) / k)**(2 / 3), lo, hi))
+            candidates.add(limit(math.sqrt(self.max_velocity / k), lo, hi))
+        acceleration = min(sorted(candidates),
+                           key=lambda a: (self._time(distance, a), -a))
+        duration = self._time(distance, acceleration)
+        velocity = self.max_velocity
+        if current is not None:
+            v, a = current
+            peak = math.sqrt(distance * acceleration)
+            if a == acceleration and peak <= v <= self.max_velocity:
+                # Cruise velocity isn't reached, so any higher one will do.
+                velocity = v
+        return Profile(velocity, acceleration, duration)
+
+    def predict(self, distances):
+        """
+        Returns the predicted time-to-settle of moves over each of
+        `distances` mm in turn.
+        """
+        return sum(self.plan(d).duration for d in distances)
@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 
 from PyQt4 import QtGui, QtCore  # noqa
+from ui.diagnostics import DiagnosticsDialog
 from ui.main_window import Ui_MainWindow
 
+import mea
+import server
+import stage_state
 import stepper
+from qt_stage import StageSignals
 
 
 class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
@@ -18,6 +24,7 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
         self.x_motor_sn = None
         self.y_motor_sn = None
         self.saved_zero_pos = (4, 4)
+        self.diagnostics = None
 
         # UI initialization
         self.setupUi(self)
@@ -25,8 +32,8 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
 
         # Hardware initialization
         try:
-            self.stage = stepper.XYStage(
-                self, self.x_motor_sn, self.y_motor_sn)
+            self.stage = stepper.XYStage(self.x_motor_sn, self.y_motor_sn,
+                                         state_path=stage_state.STATE_PATH)
             self.stage.velocity = self.jogSpeedSlider.value() / 10
         except IOError as e:
             message = QtGui.QMessageBox(self)
@@ -34,6 +41,24 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
             message.setText(str(e))
             message.exec_()
             sys.exit()
+        self.stage.center_pos = self.saved_zero_pos
+        if self.stage.restore_state():
+            self.statusbar.showMessage('Resumed from the saved position.')
+        else:
+            self.statusbar.showMessage('Stage not homed.')
+        self.stage_signals = StageSignals(self.stage, self)
+        self.stage_signals.event.connect(self.on_stage_event)
+        self.meaNavigationWidget.set_layout(
+            mea.get_layout(os.environ.get('NCP_MEA_LAYOUT', '120')))
+        self.meaNavigationWidget.set_trail(self.stage.trail)
+        self.meaNavigationWidget.set_estimator(self.estimate_position)
+        self.etaLabel = QtGui.QLabel(self)
+        self.statusbar.addPermanentWidget(self.etaLabel)
+        self.control_server = None
+        if os.environ.get('NCP_STAGE_LISTEN'):
+            self.control_server = server.ControlServer(
+                self.stage,
+                server.parse_address(os.environ['NCP_STAGE_LISTEN']))
 
         # Application initializations
         self._timer = QtCore.QTimer(self)
@@ -41,17 +66,55 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
         self._timer.start(150)
 
     def tick(self):
-        self.stage.update()
+        interval = self.stage.update()
+        self._timer.start(int(interval * 1000))
+
+    def on_stage_moved(self):
+        self.meaNavigationWidget.schedule_frame()
+
+    def estimate_position(self, t):
+        if self.stage.moving:
+            return self.stage.estimate(t)
+        return None
+
+    def on_stage_event(self, event):
+        axis, event_type, data = event
+        if event_type == 'disconnected':
+            self.statusbar.showMessage(
+                '{} motor disconnected, reconnecting...'.format(axis.upper()))
+        elif event_type == 'reconnected':
+            self.statusbar.showMessage(
+                '{} motor reconnected.'.format(axis.upper()), 5000)
+        elif event_type == 'position_lost':
+            self.statusbar.showMessage(
+                '{} motor lost its position. Home the stage.'.format(
+                    axis.upper()))
+        elif event_type == 'move_failed':
+            self.statusbar.showMessage(data)
+        elif event_type == 'clamped':
+            self.statusbar.showMessage(
+                '{} target {:.3f} mm is out of range.'.format(
+                    axis.upper(), data), 5000)
+        elif event_type == 'off_target':
+            self.statusbar.showMessage(
+                '{} settled {} counts off target.'.format(
+                    axis.upper(), data), 5000)
 
-    def on_xPos_changed(self, val):
-        self.xPosSpinBox.setValue(val * 1000)
-
-    def on_yPos_changed(self, val):
-        self.yPosSpinBox.setValue(val * 1000)
+    @QtCore.pyqtSlot(object)
+    def on_meaNavigationWidget_frame(self, sample):
+        # Position displays follow the stage overlay, once per frame.
+        t, x, y = sample
+        self.xPosSpinBox.setValue(x * 1000)
+        self.yPosSpinBox.setValue(y * 1000)
+        if self.stage.moving:
+            self.etaLabel.setText('ETA {:.1f} s'.format(self.stage.eta(t)))
+        else:
+            self.etaLabel.clear()
 
     @QtCore.pyqtSlot()
     def on_zeroButton_pressed(self):
         self.saved_zero_pos = self.stage.zero()
+        self.stage.center_pos = self.saved_zero_pos
 
     @QtCore.pyqtSlot()
     def on_jogLeftButton_pressed(self):
@@ -95,9 +158,17 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
 
     @QtCore.pyqtSlot(object)
     def on_meaNavigationWidget_clicked(self, coord):
-        # When stage is zeroed, should be centered on A4
-        self.stage.x = -coord[0] / 1000
-        self.stage.y = -(coord[1] - 300) / 1000
+        # The layout knows where the zeroed stage is centered.
+        layout = self.meaNavigationWidget.mea_layout
+        self.stage.move_to(*layout.stage_position(coord))
+
+    @QtCore.pyqtSlot()
+    def on_diagnosticsButton_clicked(self):
+        if self.diagnostics is None:
+            self.diagnostics = DiagnosticsDialog(self.stage.latency, self,
+                                                 self.stage.settle)
+        self.diagnostics.show()
+        self.diagnostics.raise_()
 
     @QtCore.pyqtSlot()
     def on_retractYButton_clicked(self):
@@ -138,6 +209,8 @@ class MainWindow(QtGui.QMainWindow, Ui_MainWindow):
         Called when window is trying to be closed.  Call event.accept() to
         allow the window to be closed.
         """
+        if self.control_server is not None:
+            self.control_server.close()
         self.stage.stop()
         self.save_settings()
         event.accept()
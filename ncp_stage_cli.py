@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""
+Command line stage control without the GUI.
+
+    ncp_stage_cli.py --ports /dev/ttyUSB0 /dev/ttyUSB1 home --center 4 4
+    ncp_stage_cli.py --zero 4 4 move 0.2 -0.1
+    ncp_stage_cli.py --zero 4 4 scan a4 b4 c4 --dwell 0.5
+    ncp_stage_cli.py --zero 4 4 scan --file plan.txt
+    ncp_stage_cli.py --zero 4 4 raster -1 1 11 -1 1 5 --velocity 2
+    ncp_stage_cli.py --zero 4 4 serve --listen /tmp/ncp_stage.sock
+
+Motors are found by serial number, given with --x-sn and --y-sn or the
+NCP_X_SN and NCP_Y_SN environment variables, or opened from --ports.
+Positions are in mm relative to --zero, or absolute without it.
+
+The axis state is saved on exit and restored on start when the controllers
+have stayed homed, so home only homes with --force or when that fails. The
+restored state includes the zero, so without --zero positions are relative
+to the zero last set, by --zero or the GUI, rather than absolute. Homing
+resets the zero, and home --center is always absolute.
+
+A scan plan file has one target per line, an electrode tag or an x y
+position in mm. Blank lines and anything after # are ignored. Tags refer to
+the MEA layout given with --layout or NCP_MEA_LAYOUT, the 120 electrode MEA
+by default, see mea.py.
+
+raster sweeps x continuously across rows of y and prints the row, x and
+time.monotonic() of every crossing of the x grid, see raster.py.
+
+serve runs a control server, see server.py, until interrupted.
+"""
+
+import argparse
+import os
+import sys
+import threading
+
+
+def read_plan(path):
+    """
+    Returns the targets of a scan plan file.
+    """
+    targets = []
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if len(fields) == 1:
+                targets.append(fields[0])
+            elif len(fields) == 2:
+                targets.append((float(fields[0]), float(fields[1])))
+            elif fields:
+                raise ValueError('Bad scan target: {}'.format(line.strip()))
+    return targets
+
+
+def wait_for(stage, events, action, timeout):
+    """
+    Calls `action()` and waits until the stage has sent each of `events`,
+    (axis, event_type) tuples.
+    """
+    remaining = set(events)
+    done = threading.Event()
+
+    def on_event(event):
+        remaining.discard(event[:2])
+        if not remaining:
+            done.set()
+    stage.add_listener(on_event)
+    try:
+        action()
+        if not done.wait(timeout):
+            raise IOError('Timed out waiting for {}.'.format(
+                ', '.join(' '.join(e) for e in sorted(remaining))))
+    finally:
+        stage.remove_listener(on_event)
+
+
+def request_pos(stage):
+    stage.x_motor.request_pos()
+    stage.y_motor.request_pos()
+
+
+def _grid(start, stop, n):
+    if n < 2:
+        return [start]
+    return [start + (stop - start) * i / (n - 1) for i in range(n)]
+
+
+def _poll(stage, reactor):
+    # Position requests for controllers that don't push status updates.
+    reactor.call_later(stage.update(), _poll, stage, reactor)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Control the NCP stage without the GUI.')
+    parser.add_argument('--x-sn', default=os.environ.get('NCP_X_SN'),
+                        help='x motor serial number')
+    parser.add_argument('--y-sn', default=os.environ.get('NCP_Y_SN'),
+                        help='y motor serial number')
+    parser.add_argument('--ports', nargs=2, metavar=('X', 'Y'),
+                        help='x and y motor ports instead of serial numbers')
+    parser.add_argument('--zero', nargs=2, type=float, metavar=('X', 'Y'),
+                        help='absolute position in mm of the origin')
+    parser.add_argument('--timeout', type=float, default=60,
+                        help='seconds to wait for any move')
+    parser.add_argument('--no-state', action='store_true',
+                        help="don't restore or save the axis state")
+    parser.add_argument('--tolerance', type=int,
+                        help='read back each move and correct it until '
+                        'within this many encoder counts')
+    parser.add_argument('--layout',
+                        default=os.environ.get('NCP_MEA_LAYOUT', '120'),
+                        help='MEA layout name or JSON file for electrode tags')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    commands.add_parser('pos', help='print the position')
+
+    home = commands.add_parser('home', help='home both axes')
+    home.add_argument('--center', nargs=2, type=float, metavar=('X', 'Y'),
+                      help='absolute position in mm to move to afterwards')
+    home.add_argument('--force', action='store_true',
+                      help='home even if the saved state was restored')
+
+    move = commands.add_parser('move', help='move to a position')
+    move.add_argument('x', type=float)
+    move.add_argument('y', type=float)
+    move.add_argument('--sync', action='store_true',
+                      help='make both axes arrive together')
+
+    scan = commands.add_parser('scan', help='visit a list of targets')
+    scan.add_argument('targets', nargs='*',
+                      help='electrode tags, e.g. a4')
+    scan.add_argument('--file', help='scan plan file')
+    scan.add_argument('--dwell', type=float, default=0.0,
+                      help='seconds to stay at each target')
+    scan.add_argument('--in-order', action='store_true',
+                      help='visit targets in the given order')
+    scan.add_argument('--dry-run', action='store_true',
+                      help='print the visit order and predicted time only')
+
+    raster = commands.add_parser(
+        'raster', help='sweep x across rows of y, reporting grid crossings')
+    raster.add_argument('x0', type=float)
+    raster.add_argument('x1', type=float)
+    raster.add_argument('nx', type=int, help='x crossings per row')
+    raster.add_argument('y0', type=float)
+    raster.add_argument('y1', type=float)
+    raster.add_argument('ny', type=int, help='rows')
+    raster.add_argument('--velocity', type=float, default=2.0,
+                        help='sweep velocity in mm/s')
+    raster.add_argument('--dry-run', action='store_true',
+                        help='print the predicted time only')
+
+    serve = commands.add_parser('serve', help='run a control server')
+    serve.add_argument('--listen', default=os.environ.get('NCP_STAGE_LISTEN',
+                                                          'localhost:7357'),
+                       help='port, host:port or Unix socket path')
+
+    args = parser.parse_args(argv)
+    if args.ports is None and (args.x_sn is None or args.y_sn is None):
+        parser.error('give --ports or both motor serial numbers')
+
+    # Imported here so --help doesn't wait for the serial stack.
+    import reactor
+    import stage_state
+    import stepper
+
+    try:
+        stage = stepper.XYStage(
+            args.x_sn, args.y_sn, ports=args.ports,
+            state_path=None if args.no_state else stage_state.STATE_PATH,
+            tolerance=args.tolerance)
+    except IOError as e:
+        print(e, file=sys.stderr)
+        return 1
+    _poll(stage, reactor.get_reactor())
+    try:
+        restored = not args.no_state and stage.restore_state()
+        if args.command == 'home' and (args.force or not restored):
+            wait_for(stage, [('x', 'homed'), ('y', 'homed')], stage.home,
+                     args.timeout)
+        if args.command == 'home':
+            if args.center is not None:
+                # --center is absolute, whatever zero was restored.
+                stage.move_to(*(c - z for c, z in zip(
+                    args.center, stage.zero_pos))).result(args.timeout)
+        wait_for(stage, [('x', 'pos'), ('y', 'pos')],
+                 lambda: request_pos(stage), args.timeout)
+        if args.zero is not None:
+            stage.zero(args.zero)
+
+        if args.command == 'move':
+            stage.move_to(args.x, args.y,
+                          synchronize=args.sync).result(args.timeout)
+        elif args.command == 'scan':
+            import mea
+            import scheduler
+            layout = mea.get_layout(args.layout)
+            targets = list(args.targets)
+            if args.file:
+                targets += read_plan(args.file)
+            plan = scheduler.Scan(
+                stage, targets, args.dwell, optimize=not args.in_order,
+                timeout=args.timeout, layout=layout,
+                on_visit=lambda target, t: print(target, flush=True))
+            if args.dry_run:
+                for i in plan.order:
+                    print(plan.targets[i])
+                print('predicted {:.2f} s'.format(plan.predicted_time()))
+            else:
+                plan.run()
+        elif args.command == 'raster':
+            import raster
+            scan = raster.Raster(
+                stage, _grid(args.x0, args.x1, args.nx),
+                _grid(args.y0, args.y1, args.ny), args.velocity,
+                timeout=args.timeout,
+                on_crossing=lambda row, x, t: print(
+                    '{} {:.4f} {:.6f}'.format(row, x, t), flush=True))
+            if args.dry_run:
+                print('predicted {:.2f} s'.format(scan.predicted_time()))
+            else:
+                scan.run()
+        elif args.command == 'serve':
+            import server
+            control = server.ControlServer(
+                stage, server.parse_address(args.listen))
+            print('listening on {}'.format(control.address), flush=True)
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                control.close()
+        print('{:.4f} {:.4f}'.format(stage.x, stage.y))
+    except IOError as e:
+        print(e, file=sys.stderr)
+        return 1
+    finally:
+        stage.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Qt signals for an XYStage.
+"""
+
+from PyQt4 import QtCore
+
+# Stage events whose data is the position of the axis.
+POSITION_EVENTS = ('pos', 'status', 'move_completed', 'stop', 'homed',
+                   'arrived')
+
+
+class StageSignals(QtCore.QObject):
+    """
+    Re-emits XYStage events as Qt signals.
+
+    Stage events arrive on the reactor thread, so slots of objects living on
+    another thread are called through queued connections.
+
+    Position events come as fast as the controllers report, so they aren't
+    queued one by one. The first sets a dirty flag and emits `moved`; later
+    ones only set the flag again until the slot has called
+    clear_moved(). Read the position from the stage, or its trail, in the
+    slot. Every other event is emitted as `event`.
+
+    Parameters
+    ----------
+
+    stage : XYStage
+        Stage to listen to.
+
+    parent : QWidget
+        Widget to handle callbacks. If it implements on_stage_moved(), it is
+        connected to `moved`, called on the widget's thread, and the flag is
+        cleared before each call. May be None.
+    """
+
+    moved = QtCore.pyqtSignal()
+    settled = QtCore.pyqtSignal(float)
+    event = QtCore.pyqtSignal(object)
+
+    def __init__(self, stage, parent=None):
+        super().__init__(parent)
+        self.stage = stage
+        self._dirty = False
+        if hasattr(parent, 'on_stage_moved'):
+            self._on_moved = parent.on_stage_moved
+            self.moved.connect(self._deliver_moved,
+                               QtCore.Qt.QueuedConnection)
+        stage.add_listener(self._on_event)
+
+    def _on_event(self, event):
+        axis, event_type, data = event
+        if event_type in POSITION_EVENTS:
+            # A plain assignment is atomic, so no lock is needed.
+            if not self._dirty:
+                self._dirty = True
+                self.moved.emit()
+            return
+        self.event.emit(event)
+        if event_type == 'settled':
+            self.settled.emit(data)
+
+    def clear_moved(self):
+        """
+        Lets the next position event emit `moved` again.
+        """
+        self._dirty = False
+
+    def _deliver_moved(self):
+        self.clear_moved()
+        self._on_moved()
+
+    def close(self):
+        self.stage.remove_listener(self._on_event)
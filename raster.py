@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Continuous raster scans.
+
+Instead of stopping at every target, the sweep axis crosses each row at
+constant velocity while the controller pushes status updates. The time
+each configured position was crossed is worked out from the motion model
+of the sweep, corrected by those updates (see estimator.MotionEstimator),
+so no extra serial traffic is needed. The step axis moves to the next row
+between sweeps.
+"""
+
+import concurrent.futures
+import threading
+
+import motion
+
+
+class Raster:
+    """
+    Sweeps a stage across rows and reports when it crosses given positions.
+
+    Each row starts a run-up distance before the first crossing, long
+    enough to reach the sweep velocity, and ends as far past the last.
+
+    Parameters
+    ----------
+
+    stage : MultiAxisStage
+        Stage to move, e.g. an XYStage.
+
+    crossings : list
+        Positions in mm along the sweep axis to report crossing in each row.
+
+    rows : list
+        Positions in mm of the step axis, one per row.
+
+    velocity : float
+        Sweep velocity in mm/s.
+
+    on_crossing : callable
+        Called as on_crossing(row, position, t) for each crossing, with the
+        index of the row and the time.monotonic() at which `position` was
+        crossed. Runs on the reactor thread as soon as a status update past
+        `position` arrives, so it must return quickly.
+
+    sweep_axis, step_axis : str
+        Names of the axes to sweep and step.
+
+    serpentine : bool
+        Sweep alternate rows in opposite directions. Otherwise every row is
+        swept in the direction of increasing position.
+    """
+
+    def __init__(self, stage, crossings, rows, velocity=2.0, on_crossing=None,
+                 sweep_axis='x', step_axis='y', serpentine=True, timeout=60):
+        self.stage = stage
+        self.crossings = sorted(crossings)
+        self.rows = list(rows)
+        self.velocity = velocity
+        self.on_crossing = on_crossing
+        self.sweep_axis = sweep_axis
+        self.step_axis = step_axis
+        self.serpentine = serpentine
+        self.timeout = timeout
+        acceleration = stage.planner.max_acceleration
+        self.run_up = velocity * velocity / (2 * acceleration)
+        self.crossed = []
+        self._active = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _row_path(self, row):
+        """
+        Returns (start, end, direction) of the sweep of `row`.
+        """
+        direction = -1 if self.serpentine and row % 2 else 1
+        ordered = self.crossings[::direction]
+        return (ordered[0] - direction * self.run_up,
+                ordered[-1] + direction * self.run_up, direction)
+
+    def predicted_time(self):
+        """
+        Returns the predicted duration of the scan in seconds.
+        """
+        planner = self.stage.planner
+        acceleration = planner.max_acceleration
+        total = 0
+        pos = self.stage.position(self.sweep_axis)
+        row_pos = self.stage.position(self.step_axis)
+        for row, row_pos_next in enumerate(self.rows):
+            start, end, direction = self._row_path(row)
+            total += max(planner.predict([start - pos]),
+                         planner.predict([row_pos_next - row_pos]))
+            total += motion.move_time(end - start, self.velocity,
+                                      acceleration)
+            pos, row_pos = end, row_pos_next
+        return total
+
+    def run(self):
+        """
+        Runs the scan on the calling thread. Returns the list of
+        (row, position, t) crossed.
+        """
+        self._stop.clear()
+        self.crossed = []
+        self.stage.add_listener(self._on_event)
+        try:
+            for row, row_pos in enumerate(self.rows):
+                if self._stop.is_set():
+                    break
+                start, end, direction = self._row_path(row)
+                self.stage.move({self.sweep_axis: start,
+                                 self.step_axis: row_pos}).result(self.timeout)
+                with self._lock:
+                    if self._stop.is_set():
+                        break
+                    self._active = (row, direction,
+                                    self.crossings[::direction])
+                try:
+                    self.stage.sweep(self.sweep_axis, end,
+                                     self.velocity).result(self.timeout)
+                except concurrent.futures.CancelledError:
+                    break
+                finally:
+                    with self._lock:
+                        self._active = None
+        finally:
+            self.stage.remove_listener(self._on_event)
+        return self.crossed
+
+    def _on_event(self, event):
+        axis, event_type, pos = event
+        if axis != self.sweep_axis or event_type not in (
+                'status', 'pos', 'move_completed'):
+            return
+        crossed = []
+        with self._lock:
+            if self._active is None:
+                return
+            row, direction, pending = self._active
+            while pending and (pos - pending[0]) * direction >= 0:
+                position, pending = pending[0], pending[1:]
+                t = self.stage.passing_time(axis, position)
+                if t is None:
+                    t = self.stage.motor(axis).read_time
+                crossed.append((row, position, t))
+            self._active = (row, direction, pending)
+            self.crossed.extend(crossed)
+        if self.on_crossing is not None:
+            for crossing in crossed:
+                self.on_crossing(*crossing)
+
+    def start(self):
+        """
+        Runs the scan on a background thread.
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True,
+                                        name='Raster')
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stops the scan, cutting the current sweep short.
+        """
+        with self._lock:
+            self._stop.set()
+            sweeping = self._active is not None
+        if sweeping:
+            self.stage.stop_move(self.sweep_axis)
+        if wait and self._thread is not None:
+            self._thread.join()
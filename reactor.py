@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Shared I/O thread for serial devices.
+
+A single Reactor waits on every registered file descriptor with `selectors`
+(epoll on Linux) and calls the handler of whichever becomes ready, so the
+number of threads doesn't grow with the number of motors.
+"""
+
+import collections
+import heapq
+import itertools
+import logging
+import os
+import selectors
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+
+class Timer:
+    """
+    Handle returned by Reactor.call_later().
+    """
+
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Reactor:
+    """
+    Runs file descriptor and timer callbacks on one background thread.
+
+    All methods may be called from any thread. Callbacks are run on the
+    reactor thread and must not block.
+    """
+
+    def __init__(self):
+        self._selector = selectors.DefaultSelector()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._ready = collections.deque()
+        self._timers = []
+        self._counter = itertools.count()
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='Reactor')
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake()
+        if self._thread is not None and not self.in_thread():
+            self._thread.join()
+        self._thread = None
+
+    def in_thread(self):
+        """
+        Returns True when called from the reactor thread.
+        """
+        return threading.current_thread() is self._thread
+
+    def call_soon(self, callback, *args):
+        """
+        Runs `callback(*args)` on the reactor thread.
+        """
+        self._ready.append((callback, args))
+        if not self.in_thread():
+            self._wake()
+
+    def call_later(self, delay, callback, *args):
+        """
+        Runs `callback(*args)` on the reactor thread after `delay` seconds.
+
+        Returns
+        -------
+        A Timer that can be cancelled.
+        """
+        timer = Timer(time.monotonic() + delay, callback, args)
+        self.call_soon(self._add_timer, timer)
+        return timer
+
+    def add_reader(self, fileobj, callback):
+        """
+        Calls `callback()` on the reactor thread whenever `fileobj` is
+        readable.
+        """
+        self.call_blocking(self._selector.register, fileobj,
+                           selectors.EVENT_READ, callback)
+
+    def remove_reader(self, fileobj):
+        """
+        Stops watching `fileobj`. Once this returns its callback won't run
+        again, so the file can be closed.
+        """
+        self.call_blocking(self._unregister, fileobj)
+
+    def call_blocking(self, callback, *args):
+        """
+        Runs `callback(*args)` on the reactor thread and waits for it.
+        """
+        if self.in_thread() or self._thread is None:
+            callback(*args)
+            return
+        done = threading.Event()
+
+        def call():
+            try:
+                callback(*args)
+            finally:
+                done.set()
+        self.call_soon(call)
+        done.wait()
+
+    def _unregister(self, fileobj):
+        try:
+            self._selector.unregister(fileobj)
+        except (KeyError, ValueError):
+            pass
+
+    def _add_timer(self, timer):
+        heapq.heappush(self._timers, (timer.when, next(self._counter), timer))
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'\0')
+        except BlockingIOError:
+            pass
+
+    def _run_callback(self, callback, args):
+        try:
+            callback(*args)
+        except Exception:
+            log.exception('Error in reactor callback %r', callback)
+
+    def _run(self):
+        while self._running:
+            timeout = None
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            for key, mask in self._selector.select(timeout):
+                if key.fd == self._wake_r:
+                    try:
+                        os.read(self._wake_r, 4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self._run_callback(key.data, ())
+            while self._ready:
+                self._run_callback(*self._ready.popleft())
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                timer = heapq.heappop(self._timers)[2]
+                if not timer.cancelled:
+                    self._run_callback(timer.callback, timer.args)
+
+
+_reactor = None
+_reactor_lock = threading.Lock()
+
+
+def get_reactor():
+    """
+    Returns the process wide reactor, starting it on first use.
+    """
+    global _reactor
+    with _reactor_lock:
+        if _reactor is None:
+            _reactor = Reactor()
+            _reactor.start()
+        return _reactor
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Recording and replay of raw serial traffic.
+
+A log starts with MAGIC followed by one record per read or write:
+
+    <dBBH  monotonic timestamp, stream, direction, length
+    bytes  the data
+
+`stream` tells apart the motors sharing a log, e.g. 0 for x and 1 for y.
+Each record goes to the OS in a single unbuffered write as it happens, so a
+log cut short by a crash or kill of the process is still readable up to the
+last complete record. Only a power loss can lose what the OS hasn't written
+to disk yet.
+"""
+
+import argparse
+import struct
+import threading
+import time
+
+import apt
+
+MAGIC = b'NCPREC1\n'
+RECORD = struct.Struct('<dBBH')
+
+READ = 0
+WRITE = 1
+
+
+class Recorder:
+    """
+    Appends serial traffic to a log file. Thread safe.
+
+    Parameters
+    ----------
+
+    path : str
+        Log file to append to. Created if it doesn't exist.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # Unbuffered, so nothing is lost with the process.
+        self._file = open(path, 'ab', buffering=0)
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self._lock = threading.Lock()
+
+    def record(self, stream, direction, data, t=None):
+        t = time.monotonic() if t is None else t
+        header = RECORD.pack(t, stream, direction, len(data))
+        with self._lock:
+            if self._file is not None:
+                self._file.write(header + data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_log(path):
+    """
+    Yields the (timestamp, stream, direction, data) records of a log.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('{} is not a traffic log.'.format(path))
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            t, stream, direction, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield t, stream, direction, data
+
+
+def replay(path, motors, speed=None, on_write=None):
+    """
+    Feeds the data read in a log to `motors` on the calling thread.
+
+    Parameters
+    ----------
+
+    path : str
+        Log to replay.
+
+    motors : dict
+        {stream: ThorStepper}. Streams without a motor are skipped.
+
+    speed : float
+        Multiple of the recorded speed to replay at. None replays as fast as
+        possible.
+
+    on_write : callable
+        Called as on_write(stream, data) for every recorded write, at its
+        place in the log.
+
+    Returns
+    -------
+    A dict with the number of records and bytes replayed and the seconds
+    spent feeding them.
+    """
+    records = 0
+    nbytes = 0
+    busy = 0.0
+    start = None
+    begin = time.monotonic()
+    for t, stream, direction, data in read_log(path):
+        if start is None:
+            start = t
+        if speed is not None:
+            delay = begin + (t - start) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if direction == WRITE:
+            if on_write is not None:
+                on_write(stream, data)
+            continue
+        motor = motors.get(stream)
+        if motor is None:
+            continue
+        t0 = time.perf_counter()
+        motor.feed(data)
+        busy += time.perf_counter() - t0
+        records += 1
+        nbytes += len(data)
+    return {'records': records, 'bytes': nbytes, 'busy': busy,
+            'elapsed': time.monotonic() - begin}
+
+
+MESSAGE_NAMES = {value: name for name, value in vars(apt).items()
+                 if name.startswith(('HW_', 'MOD_', 'MOT_'))}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Print the APT messages in a serial traffic log.')
+    parser.add_argument('log')
+    args = parser.parse_args()
+
+    parsers = {}
+    start = None
+    for t, stream, direction, data in read_log(args.log):
+        if start is None:
+            start = t
+        frame_parser = parsers.setdefault((stream, direction),
+                                          apt.FrameParser())
+        for frame in frame_parser.feed(data):
+            print('{:10.4f} {} {} {:<24} {}'.format(
+                t - start, stream, '<' if direction == READ else '>',
+                MESSAGE_NAMES.get(frame.msg_id, hex(frame.msg_id)),
+                frame.data.hex() if frame.data else
+                '{} {}'.format(frame.param1, frame.param2)))
+    for (stream, direction), frame_parser in sorted(parsers.items()):
+        if frame_parser.discarded:
+            print('stream {} {}: {} bytes discarded'.format(
+                stream, 'read' if direction == READ else 'write',
+                frame_parser.discarded))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Visit order planning and execution for stage scans.
+
+The cost of moving between two targets is the predicted time-to-settle of the
+slower axis, since both axes move at once. Moves that need a backlash
+overshoot leg cost more than the same move in the other direction, so costs
+are asymmetric. The order is built by nearest neighbour and then improved
+with 2-opt.
+"""
+
+import threading
+
+import mea
+import motion
+
+
+def travel_time(planner=None, overshoot=(0, 0), direction=1):
+    """
+    Returns a cost function giving the predicted time in seconds to move
+    between two (x, y) positions in mm.
+
+    Parameters
+    ----------
+
+    planner : motion.MotionPlanner
+        Predicts the duration of each leg.
+
+    overshoot : tuple
+        (x, y) backlash overshoot in mm added to moves against `direction`.
+
+    direction : int
+        Final approach direction of the backlash compensation.
+    """
+    planner = planner or motion.MotionPlanner()
+    cache = {}
+
+    def leg_time(distance):
+        # Cache at 1 um resolution; scan targets sit on a grid.
+        key = round(abs(distance), 3)
+        if key not in cache:
+            cache[key] = planner.plan(key).duration if key else 0
+        return cache[key]
+
+    def axis_time(distance, overshoot):
+        if overshoot and distance * direction < 0:
+            return leg_time(abs(distance) + overshoot) + leg_time(overshoot)
+        return leg_time(distance)
+
+    def cost(a, b):
+        return max(axis_time(b[0] - a[0], overshoot[0]),
+                   axis_time(b[1] - a[1], overshoot[1]))
+    return cost
+
+
+def stage_travel_time(stage):
+    """
+    Returns the travel_time() cost function for `stage`'s planner and
+    backlash compensation.
+    """
+    return travel_time(stage.planner, stage.backlash_comp)
+
+
+def plan_visit_order(targets, cost=None, start=None, max_passes=50):
+    """
+    Returns the indices of `targets` in a low travel time visit order.
+
+    Parameters
+    ----------
+
+    targets : list
+        (x, y) positions in mm.
+
+    cost : callable
+        cost(a, b) of moving between two positions. Defaults to
+        travel_time().
+
+    start : tuple
+        Position the stage starts from. Defaults to the first target.
+
+    max_passes : int
+        Upper bound on 2-opt improvement passes.
+    """
+    n = len(targets)
+    if n < 2:
+        return list(range(n))
+    cost = cost or travel_time()
+    points = list(targets)
+    if start is not None:
+        points.append(start)
+        origin = n
+    else:
+        origin = 0
+    m = len(points)
+    c = [[cost(points[i], points[j]) for j in range(m)] for i in range(m)]
+
+    # Nearest neighbour.
+    path = [origin]
+    remaining = set(range(m)) - {origin}
+    while remaining:
+        last = c[path[-1]]
+        nearest = min(remaining, key=lambda j: last[j])
+        path.append(nearest)
+        remaining.remove(nearest)
+
+    # 2-opt on the open path, keeping the start fixed. Reversing a segment
+    # also changes the cost of the moves inside it, tracked with prefix sums
+    # of the forward and backward costs along the path.
+    def prefix_sums():
+        fwd = [0]
+        bwd = [0]
+        for k in range(m - 1):
+            fwd.append(fwd[-1] + c[path[k]][path[k + 1]])
+            bwd.append(bwd[-1] + c[path[k + 1]][path[k]])
+        return fwd, bwd
+
+    for _ in range(max_passes):
+        improved = False
+        fwd, bwd = prefix_sums()
+        for i in range(1, m - 1):
+            a, b = path[i - 1], path[i]
+            for j in range(i + 1, m):
+                d, e = path[j], path[j + 1] if j + 1 < m else None
+                delta = (c[a][d] - c[a][b] +
+                         (bwd[j] - bwd[i]) - (fwd[j] - fwd[i]))
+                if e is not None:
+                    delta += c[b][e] - c[d][e]
+                if delta < -1e-9:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    b = path[i]
+                    fwd, bwd = prefix_sums()
+                    improved = True
+        if not improved:
+            break
+
+    if start is not None:
+        path = path[1:]
+    return path
+
+
+def order_cost(targets, order, cost=None, start=None):
+    """
+    Returns the total cost of visiting `targets` in `order`.
+    """
+    cost = cost or travel_time()
+    points = [targets[i] for i in order]
+    if start is not None:
+        points.insert(0, start)
+    return sum(cost(a, b) for a, b in zip(points, points[1:]))
+
+
+class Scan:
+    """
+    Visits a set of targets on an XYStage in an optimized order.
+
+    Parameters
+    ----------
+
+    stage : XYStage
+        Stage to move.
+
+    targets : list
+        Electrode tags such as 'a4', or (x, y) stage positions in mm.
+
+    dwell : float
+        Seconds to stay at each target after it has settled.
+
+    on_visit : callable
+        Called as on_visit(target, settled_timestamp) on arrival at each
+        target, before the dwell. Runs on the scan thread.
+
+    optimize : bool
+        Plan the visit order. Otherwise targets are visited as given.
+
+    synchronize : bool
+        Passed to XYStage.move_to().
+
+    layout : mea.Layout
+        Layout the electrode tags refer to. Defaults to the 120 electrode
+        MEA.
+    """
+
+    def __init__(self, stage, targets, dwell=0.0, on_visit=None,
+                 optimize=True, synchronize=False, timeout=30, layout=None):
+        self.stage = stage
+        self.layout = mea.MEA_120 if layout is None else layout
+        self.targets = list(targets)
+        self.dwell = dwell
+        self.on_visit = on_visit
+        self.synchronize = synchronize
+        self.timeout = timeout
+        self.positions = [self._position(t) for t in self.targets]
+        if optimize:
+            self.order = plan_visit_order(
+                self.positions, stage_travel_time(stage),
+                start=(stage.x, stage.y))
+        else:
+            self.order = list(range(len(self.targets)))
+        self.visited = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _position(self, target):
+        if isinstance(target, str):
+            return self.layout.stage_position(self.layout.position(target))
+        return tuple(target)
+
+    def predicted_time(self):
+        """
+        Returns the predicted duration of the scan in seconds.
+        """
+        travel = order_cost(self.positions, self.order,
+                            stage_travel_time(self.stage),
+                            start=(self.stage.x, self.stage.y))
+        return travel + self.dwell * len(self.order)
+
+    def run(self):
+        """
+        Runs the scan on the calling thread. Returns the list of
+        (target, settled timestamp) visited.
+        """
+        self._stop.clear()
+        self.visited = []
+        for i in self.order:
+            if self._stop.is_set():
+                break
+            x, y = self.positions[i]
+            settled = self.stage.move_to(
+                x, y, synchronize=self.synchronize).result(self.timeout)
+            self.visited.append((self.targets[i], settled))
+            if self.on_visit is not None:
+                self.on_visit(self.targets[i], settled)
+            if self.dwell:
+                self._stop.wait(self.dwell)
+        return self.visited
+
+    def start(self):
+        """
+        Runs the scan on a background thread.
+        """
+        self._thread = threading.Thread(target=self.run, daemon=True,
+                                        name='Scan')
+        self._thread.start()
+
+    def stop(self, wait=True):
+        """
+        Stops the scan after the current move.
+        """
+        self._stop.set()
+        if wait and self._thread is not None:
+            self._thread.join()
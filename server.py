@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Control server for driving a stage from other processes.
+
+Requests and replies are JSON objects, one per line, on a TCP or Unix
+socket:
+
+    > {"id": 1, "op": "move_to", "x": 0.2, "y": -0.1}
+    < {"id": 1, "result": {"predicted_arrival": 5123.41}}
+    > {"id": 2, "op": "subscribe", "topics": ["settled"]}
+    < {"id": 2, "result": ["settled"]}
+    < {"event": "settled", "t": 5123.42, "pos": [0.2, -0.1]}
+    > {"id": 3, "op": "zero", "position": [1]}
+    < {"id": 3, "error": "position must have 2 axes."}
+
+Any number of requests may be sent without waiting for their replies. Each
+reply carries the id of its request, and replies to requests that wait, e.g.
+move_to with "wait": true, may arrive out of order. Positions are in mm
+relative to the stage's zero and times are time.monotonic() seconds, which
+on Linux are comparable between processes on the same machine.
+
+Operations:
+
+    ping                            null
+    pos                             position of every axis, e.g. [x, y]
+    estimate                        estimated position now and seconds
+                                    until arrival
+    move_to <axis>... [sync] [wait] predicted arrival, or settle time and
+                                    position with wait
+    stop                            stops every axis
+    home [center] [force]
+    zero [position]                 absolute zero position
+    retract [axis], unretract [axis]
+    retract_y, return_y
+    subscribe topics                'settled', 'pos' and 'events'
+    unsubscribe [topics]
+
+Subscribers to 'settled' get {"event": "settled", "t", "pos"} as soon as a
+move settles, 'pos' {"event": "pos", "t", "pos"} on every position update and
+'events' {"event": [axis, event_type, data]} for every stage event.
+
+Sockets are served on the stage's reactor thread, next to the serial links,
+so a request is handled as soon as it arrives.
+"""
+
+import concurrent.futures
+import itertools
+import json
+import os
+import socket
+import threading
+import time
+
+DEFAULT_PORT = 7357
+TOPICS = ('settled', 'pos', 'events')
+MAX_BUFFER = 1 << 20
+
+
+def parse_address(text):
+    """
+    Returns the socket address of `text`: a port, host:port or a Unix socket
+    path.
+    """
+    if '/' in text:
+        return text
+    host, _, port = text.rpartition(':')
+    return (host or '127.0.0.1', int(port))
+
+
+def _open_socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def _encode(message):
+    return json.dumps(message, separators=(',', ':'),
+                      default=str).encode() + b'\n'
+
+
+class _Connection:
+    """
+    A client of a ControlServer. Only used on the reactor thread.
+    """
+
+    def __init__(self, server, sock):
+        self.server = server
+        self.sock = sock
+        self.topics = set()
+        self._received = b''
+        self._out = bytearray()
+        self._reading = False
+        self._retry_timer = None
+
+    def on_readable(self):
+        try:
+            data = self.sock.recv(65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self.close()
+            return
+        *lines, self._received = (self._received + data).split(b'\n')
+        # Replies to pipelined requests go out together.
+        self._reading = True
+        try:
+            for line in lines:
+                if line.strip():
+                    self.server._handle(self, line)
+        finally:
+            self._reading = False
+        self.flush()
+
+    def send(self, message):
+        if self.sock is None:
+            return
+        self._out += _encode(message)
+        if not self._reading:
+            self.flush()
+
+    def flush(self):
+        self._retry_timer = None
+        if not self._out or self.sock is None:
+            return
+        try:
+            sent = self.sock.send(self._out)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self.close()
+            return
+        del self._out[:sent]
+        if len(self._out) > MAX_BUFFER:
+            # Too slow to keep up with its subscriptions.
+            self.close()
+        elif self._out and self._retry_timer is None:
+            self._retry_timer = self.server.reactor.call_later(0.01,
+                                                               self.flush)
+
+    def close(self):
+        if self.sock is None:
+            return
+        if self._retry_timer is not None:
+            self._retry_timer.cancel()
+        self.server.reactor.remove_reader(self.sock)
+        self.sock.close()
+        self.sock = None
+        self.server._connections.discard(self)
+
+
+class ControlServer:
+    """
+    Serves stage control requests on a socket. See the module documentation
+    for the protocol.
+
+    Parameters
+    ----------
+
+    stage : MultiAxisStage
+        Stage to control, e.g. an XYStage.
+
+    address : tuple or str
+        (host, port) to listen on with TCP, or a Unix socket path. Port 0
+        picks a free port; the bound address is in `address`.
+    """
+
+    def __init__(self, stage, address=('127.0.0.1', DEFAULT_PORT)):
+        self.stage = stage
+        self.reactor = stage.reactor
+        self._connections = set()
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        self._sock = _open_socket(address)
+        if not isinstance(address, str):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(address)
+        self._sock.listen()
+        self._sock.setblocking(False)
+        self.address = self._sock.getsockname()
+        stage.add_settled_callback(self._on_settled)
+        stage.add_listener(self._on_event)
+        self.reactor.add_reader(self._sock, self._on_accept)
+
+    def _on_accept(self):
+        try:
+            sock, _ = self._sock.accept()
+        except BlockingIOError:
+            return
+        sock.setblocking(False)
+        if sock.family != socket.AF_UNIX:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = _Connection(self, sock)
+        self._connections.add(connection)
+        self.reactor.add_reader(sock, connection.on_readable)
+
+    def _handle(self, connection, line):
+        request_id = None
+        try:
+            request = json.loads(line.decode())
+            if not isinstance(request, dict):
+                raise ValueError('Request must be a JSON object.')
+            request_id = request.pop('id', None)
+            op = request.pop('op', None)
+            handler = getattr(self, '_op_' + str(op), None)
+            if handler is None:
+                raise ValueError('Unknown op: {}'.format(op))
+            result = handler(connection, **request)
+        except (ValueError, TypeError, LookupError, IOError) as e:
+            connection.send({'id': request_id, 'error': str(e)})
+            return
+        except Exception as e:
+            # Still reply, and go on to the rest of a pipelined batch.
+            connection.send({'id': request_id, 'error': '{}: {}'.format(
+                type(e).__name__, e)})
+            return
+        if isinstance(result, concurrent.futures.Future):
+            result.add_done_callback(
+                lambda future: self._reply_later(connection, request_id,
+                                                 future))
+        else:
+            connection.send({'id': request_id, 'result': result})
+
+    def _reply_later(self, connection, request_id, future):
+        if future.cancelled():
+            message = {'id': request_id, 'error': 'Move superseded.'}
+        elif future.exception() is not None:
+            message = {'id': request_id, 'error': str(future.exception())}
+        else:
+            message = {'id': request_id,
+                       'result': {'t': future.result(),
+                                  'pos': list(self.stage.pos)}}
+        # Futures can be resolved, e.g. cancelled, on any thread.
+        self.reactor.call_soon(connection.send, message)
+
+    def _publish(self, topic, message):
+        for connection in list(self._connections):
+            if topic in connection.topics:
+                connection.send(message)
+
+    def _on_settled(self, t, pos):
+        self._publish('settled', {'event': 'settled', 't': t,
+                                  'pos': list(pos)})
+
+    def _on_event(self, event):
+        if not self.reactor.in_thread():
+            self.reactor.call_soon(self._on_event, event)
+            return
+        if event[0] in self.stage.axes:
+            self._publish('pos', {'event': 'pos', 't': time.monotonic(),
+                                  'pos': list(self.stage.pos)})
+        self._publish('events', {'event': list(event)})
+
+    def _op_ping(self, connection):
+        return None
+
+    def _op_pos(self, connection):
+        return list(self.stage.pos)
+
+    def _op_estimate(self, connection):
+        now = time.monotonic()
+        return {'t': now, 'pos': list(self.stage.estimate(now)),
+                'eta': self.stage.eta(now)}
+
+    def _op_move_to(self, connection, sync=False, wait=False, **targets):
+        future = self.stage.move(targets, synchronize=sync)
+        if wait:
+            return future
+        return {'predicted_arrival': self.stage.predicted_arrival}
+
+    def _op_stop(self, connection):
+        for axis in self.stage.axes:
+            self.stage.stop_move(axis)
+
+    def _op_home(self, connection, center=False, force=True):
+        self.stage.home(center=center, force=force)
+
+    def _op_zero(self, connection, position=None):
+        if position is not None and len(position) != len(self.stage.axes):
+            raise ValueError('position must have {} axes.'.format(
+                len(self.stage.axes)))
+        return list(self.stage.zero(position))
+
+    def _op_retract(self, connection, axis=None):
+        self.stage.retract(axis)
+
+    def _op_unretract(self, connection, axis=None):
+        self.stage.unretract(axis)
+
+    def _op_retract_y(self, connection):
+        self.stage.retract('y')
+
+    def _op_return_y(self, connection):
+        self.stage.unretract('y')
+
+    def _op_subscribe(self, connection, topics):
+        unknown = set(topics) - set(TOPICS)
+        if unknown:
+            raise ValueError('Unknown topics: {}'.format(
+                ', '.join(sorted(unknown))))
+        connection.topics.update(topics)
+        return sorted(connection.topics)
+
+    def _op_unsubscribe(self, connection, topics=TOPICS):
+        connection.topics.difference_update(topics)
+        return sorted(connection.topics)
+
+    def close(self):
+        """
+        Stops listening and disconnects every client.
+        """
+        self.stage.remove_settled_callback(self._on_settled)
+        self.stage.remove_listener(self._on_event)
+        self.reactor.remove_reader(self._sock)
+        self.reactor.call_blocking(self._close_connections)
+        self._sock.close()
+        if isinstance(self.address, str):
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def _close_connections(self):
+        for connection in list(self._connections):
+            connection.close()
+
+
+class ControlClient:
+    """
+    Blocking client of a ControlServer.
+
+    Replies are read on a background thread, so any number of requests can
+    be in flight with submit().
+
+    Parameters
+    ----------
+
+    address : tuple or str
+        (host, port) or Unix socket path of the server.
+
+    on_event : callable
+        Called on the reader thread with each message of the subscribed
+        topics.
+    """
+
+    def __init__(self, address=('127.0.0.1', DEFAULT_PORT), on_event=None):
+        self.on_event = on_event
+        self._sock = _open_socket(address)
+        self._sock.connect(address)
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._read, daemon=True,
+                                        name='ControlClient')
+        self._thread.start()
+
+    def submit(self, op, **params):
+        """
+        Sends a request without waiting for its reply.
+
+        Returns
+        -------
+        A concurrent.futures.Future of the result, which raises IOError if
+        the server answered with an error.
+        """
+        future = concurrent.futures.Future()
+        with self._lock:
+            if self._closed:
+                raise IOError('Connection closed.')
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+            params.update(id=request_id, op=op)
+            self._sock.sendall(_encode(params))
+        return future
+
+    def call(self, op, timeout=None, **params):
+        """
+        Sends a request and returns its result.
+        """
+        return self.submit(op, **params).result(timeout)
+
+    def pos(self):
+        return tuple(self.call('pos'))
+
+    def move_to(self, x=None, y=None, sync=False, wait=True, timeout=None):
+        """
+        Moves the stage. With `wait`, returns (settle time, (x, y)) once it
+        has settled, otherwise the predicted arrival time.
+        """
+        result = self.call('move_to', timeout, x=x, y=y, sync=sync,
+                           wait=wait)
+        if wait:
+            return result['t'], tuple(result['pos'])
+        return result['predicted_arrival']
+
+    def subscribe(self, *topics):
+        return self.call('subscribe', topics=topics)
+
+    def _read(self):
+        for line in self._sock.makefile('rb'):
+            message = json.loads(line.decode())
+            if 'event' in message:
+                if self.on_event is not None:
+                    self.on_event(message)
+                continue
+            with self._lock:
+                future = self._pending.pop(message.get('id'), None)
+            if future is None:
+                continue
+            if 'error' in message:
+                future.set_exception(IOError(message['error']))
+            else:
+                future.set_result(message.get('result'))
+        with self._lock:
+            self._closed = True
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for future in pending:
+            future.set_exception(IOError('Connection closed.'))
+
+    def close(self):
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._sock.close()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,557 @@
+#!/usr/bin/env python3
+"""
+Simulated Thorlabs APT TDC001 controller on a Linux pseudo-terminal.
+
+The simulator answers the messages ThorStepper sends over the slave end of a
+pty, so the stage code can be run and benchmarked without hardware::
+
+    sim = TDC001Simulator(latency=0.002, drop_rate=1e-4)
+    sim.start()
+    motor = ThorStepper(port=sim.port)
+"""
+
+import argparse
+import heapq
+import itertools
+import math
+import os
+import random
+import selectors
+import struct
+import threading
+import time
+import tty
+
+import apt
+
+# Seconds between pushed status updates.
+STATUS_INTERVAL = 0.1
+# Pushed updates stop after this many unacknowledged messages.
+STATUS_MAX_UNACKED = 50
+
+
+class MotionProfile:
+    """
+    Piecewise constant-acceleration motion.
+
+    Each phase is a (start time, start position, start velocity, acceleration,
+    duration) tuple; the last phase of an open-ended move has an infinite
+    duration.
+    """
+
+    def __init__(self, t, pos, phases=()):
+        self.start = t
+        self.origin = pos
+        self.phases = []
+        self.end = t
+        for acc, v0, duration in phases:
+            self._append(acc, v0, duration)
+
+    def _append(self, acc, v0, duration):
+        if self.phases:
+            t, p, v, a, d = self.phases[-1]
+            p = p + v*d + a*d*d/2
+        else:
+            p = self.origin
+        self.phases.append((self.end, p, v0, acc, duration))
+        self.end += duration
+
+    @classmethod
+    def trapezoid(cls, t, pos, target, velocity, acceleration):
+        """
+        Rest-to-rest move from `pos` to `target`.
+        """
+        d = target - pos
+        sign = 1 if d >= 0 else -1
+        d = abs(d)
+        if d == 0 or velocity <= 0 or acceleration <= 0:
+            return cls(t, target)
+        if d >= velocity*velocity / acceleration:
+            t_acc = velocity / acceleration
+            t_cruise = (d - velocity*t_acc) / velocity
+        else:
+            t_acc = math.sqrt(d / acceleration)
+            t_cruise = 0
+        v_peak = acceleration * t_acc
+        return cls(t, pos, [(sign*acceleration, 0, t_acc),
+                            (0, sign*v_peak, t_cruise),
+                            (-sign*acceleration, sign*v_peak, t_acc)])
+
+    @classmethod
+    def ramp(cls, t, pos, v0, v1, acceleration, hold=True):
+        """
+        Changes velocity from `v0` to `v1`, then holds `v1` forever if `hold`.
+        """
+        dv = v1 - v0
+        duration = abs(dv) / acceleration if acceleration > 0 else 0
+        phases = [(math.copysign(acceleration, dv), v0, duration)]
+        if hold:
+            phases.append((0, v1, math.inf))
+        return cls(t, pos, phases)
+
+    def state(self, t):
+        """
+        Returns (position, velocity) at time `t`.
+        """
+        if not self.phases or t <= self.start:
+            return self.origin, (self.phases[0][2] if self.phases else 0)
+        for t0, p0, v0, a, d in self.phases:
+            if t < t0 + d:
+                dt = t - t0
+                return p0 + v0*dt + a*dt*dt/2, v0 + a*dt
+        t0, p0, v0, a, d = self.phases[-1]
+        return p0 + v0*d + a*d*d/2, 0
+
+    @property
+    def finite(self):
+        return self.end != math.inf
+
+
+class TDC001Simulator:
+    """
+    Simulated TDC001 controller.
+
+    Parameters
+    ----------
+
+    counts_per_mm : int
+        Encoder counts per mm, used for the travel range.
+
+    travel : float
+        Travel range in mm.
+
+    velocity : float
+        Initial maximum velocity in counts/s.
+
+    acceleration : float
+        Initial acceleration in counts/s^2.
+
+    latency : float
+        Seconds added before every reply is written.
+
+    jitter : float
+        Upper bound of a uniformly distributed extra reply delay in seconds.
+
+    drop_rate : float
+        Probability that any single outgoing byte is lost.
+
+    noise_rate : float
+        Probability that a burst of random bytes is inserted before a reply.
+
+    seed : int
+        Seed for the fault injection random generator.
+
+    status_updates : bool
+        Whether the controller pushes status updates when asked to.
+
+    backlash : float
+        Lost motion in mm between the motor and the reported position. The
+        reported position trails the motor by half of it in the direction of
+        the last move.
+    """
+
+    def __init__(self, counts_per_mm=34304, travel=12, velocity=30*34304,
+                 acceleration=180000, position=0, latency=0.0, jitter=0.0,
+                 drop_rate=0.0, noise_rate=0.0, seed=None,
+                 serial_number=83000001, status_updates=True, backlash=0):
+        self.counts_per_mm = counts_per_mm
+        self.max_counts = travel * counts_per_mm
+        self.velocity = velocity
+        self.acceleration = acceleration
+        self.step_counts = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.noise_rate = noise_rate
+        self.serial_number = serial_number
+        self.status_updates = status_updates
+        self.backlash_counts = backlash * counts_per_mm
+        self.homed = False
+        self.port = None
+
+        self.frames_received = 0
+        self.frames_sent = 0
+        self.bytes_dropped = 0
+        self.noise_bytes = 0
+
+        self._random = random.Random(seed)
+        self._motion = MotionProfile(time.monotonic(), position)
+        self._motion_kind = None
+        self._motion_token = 0
+        self._offset_start = 0
+        self._status_token = 0
+        self._unacked = 0
+        self._timers = []
+        self._counter = itertools.count()
+        self._parser = apt.FrameParser()
+        self._out = bytearray()
+        self._last_send = 0
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+        self._master = None
+        self._slave = None
+        self._wake_r, self._wake_w = os.pipe()
+        self._handlers = {
+            apt.MOT_MOVE_HOME: self._on_home,
+            apt.MOT_MOVE_ABSOLUTE: self._on_move_absolute,
+            apt.MOT_MOVE_RELATIVE: self._on_move_relative,
+            apt.MOT_MOVE_JOG: self._on_move_relative,
+            apt.MOT_MOVE_VELOCITY: self._on_move_velocity,
+            apt.MOT_MOVE_STOP: self._on_move_stop,
+            apt.MOT_SET_VELPARAMS: self._on_set_velparams,
+            apt.MOT_SET_MOVERELPARAMS: self._on_set_moverelparams,
+            apt.MOT_REQ_MOVERELPARAMS: self._on_req_moverelparams,
+            apt.MOT_REQ_POSCOUNTER: self._on_req_poscounter,
+            apt.MOT_REQ_DCSTATUSUPDATE: self._on_req_status,
+            apt.MOT_ACK_DCSTATUSUPDATE: self._on_ack_status,
+            apt.HW_START_UPDATEMSGS: self._on_start_updates,
+            apt.HW_STOP_UPDATEMSGS: self._on_stop_updates,
+            apt.HW_REQ_INFO: self._on_req_info,
+        }
+
+    def start(self):
+        """
+        Opens the pseudo-terminal and starts answering on it. Returns the path
+        of the slave device.
+        """
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self.port = os.ttyname(self._slave)
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='TDC001Simulator')
+        self._thread.start()
+        return self.port
+
+    def stop(self):
+        self._running = False
+        os.write(self._wake_w, b'\0')
+        if self._thread is not None:
+            self._thread.join()
+        for fd in (self._master, self._slave, self._wake_r, self._wake_w):
+            try:
+                os.close(fd)
+            except (OSError, TypeError):
+                pass
+
+    def replug(self):
+        """
+        Simulates the USB link dropping and coming back on a new device: the
+        pty is closed and a new one opened. The controller keeps its state,
+        as one that stayed powered would. Returns the new port.
+        """
+        self._running = False
+        os.write(self._wake_w, b'\0')
+        self._thread.join()
+        for fd in (self._master, self._slave):
+            os.close(fd)
+        self._out.clear()
+        self._parser.reset()
+        return self.start()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def position(self):
+        """
+        Current position in encoder counts.
+        """
+        return self._reported(time.monotonic())
+
+    def _load_offset(self, t):
+        """
+        Returns the offset of the reported position from the motor's.
+        """
+        if not self.backlash_counts:
+            return 0
+        half = self.backlash_counts / 2
+        travelled = self._motion.state(t)[0] - self._motion.origin
+        return min(max(self._offset_start - travelled, -half), half)
+
+    def _reported(self, t):
+        return int(round(self._motion.state(t)[0] + self._load_offset(t)))
+
+    def _run(self):
+        sel = selectors.DefaultSelector()
+        sel.register(self._master, selectors.EVENT_READ)
+        sel.register(self._wake_r, selectors.EVENT_READ)
+        writing = False
+        while self._running:
+            timeout = None
+            if self._timers:
+                timeout = max(0, self._timers[0][0] - time.monotonic())
+            for key, mask in sel.select(timeout):
+                if key.fd == self._wake_r:
+                    os.read(self._wake_r, 64)
+                elif mask & selectors.EVENT_READ:
+                    try:
+                        data = os.read(self._master, 4096)
+                    except (BlockingIOError, OSError):
+                        continue
+                    for frame in self._parser.feed(data):
+                        self.frames_received += 1
+                        handler = self._handlers.get(frame.msg_id)
+                        if handler is not None:
+                            with self._lock:
+                                handler(frame)
+                if mask & selectors.EVENT_WRITE:
+                    self._flush()
+            now = time.monotonic()
+            while self._timers and self._timers[0][0] <= now:
+                _, _, callback = heapq.heappop(self._timers)
+                with self._lock:
+                    callback()
+            if self._out and not writing:
+                self._flush()
+            if bool(self._out) != writing:
+                writing = bool(self._out)
+                events = selectors.EVENT_READ
+                if writing:
+                    events |= selectors.EVENT_WRITE
+                sel.modify(self._master, events)
+        sel.close()
+
+    def _flush(self):
+        try:
+            n = os.write(self._master, self._out)
+        except (BlockingIOError, OSError):
+            return
+        del self._out[:n]
+
+    def _call_at(self, when, callback):
+        heapq.heappush(self._timers, (when, next(self._counter), callback))
+
+    def _send(self, message):
+        """
+        Queues a reply, applying the configured latency and faults.
+        """
+        when = time.monotonic() + self.latency
+        if self.jitter:
+            when += self._random.uniform(0, self.jitter)
+        when = self._last_send = max(when, self._last_send)
+        if self.noise_rate and self._random.random() < self.noise_rate:
+            noise = bytes(self._random.getrandbits(8)
+                          for _ in range(self._random.randint(1, 16)))
+            self.noise_bytes += len(noise)
+            message = noise + message
+        if self.drop_rate:
+            kept = bytes(b for b in message
+                         if self._random.random() >= self.drop_rate)
+            self.bytes_dropped += len(message) - len(kept)
+            message = kept
+        self.frames_sent += 1
+        self._call_at(when, lambda: self._out.extend(message))
+
+    def _status_bits(self, t):
+        bits = apt.STATUS_ENABLED
+        velocity = self._motion.state(t)[1]
+        if velocity > 0:
+            bits |= apt.STATUS_MOVING_FORWARD
+        elif velocity < 0:
+            bits |= apt.STATUS_MOVING_REVERSE
+        if self._motion_kind == 'home':
+            bits |= apt.STATUS_HOMING
+        if self.homed:
+            bits |= apt.STATUS_HOMED
+        return bits
+
+    def _status_data(self, t):
+        pos = self._reported(t)
+        return struct.pack('<HiHHI', 1, pos, 0, 0, self._status_bits(t))
+
+    def _start_motion(self, profile, kind, reply):
+        """
+        Replaces the current motion and schedules `reply` for when it ends.
+        """
+        self._offset_start = self._load_offset(profile.start)
+        self._motion = profile
+        self._motion_kind = kind
+        self._motion_token += 1
+        if reply is None or not profile.finite:
+            return
+        token = self._motion_token
+
+        def done():
+            if token != self._motion_token:
+                return
+            self._motion_kind = None
+            if kind == 'home':
+                self.homed = True
+                self._send(apt.pack(reply, 1, dest=apt.HOST,
+                                    source=apt.USB_UNIT))
+            else:
+                self._send(apt.pack_data(reply, self._status_data(profile.end),
+                                         dest=apt.HOST, source=apt.USB_UNIT))
+        self._call_at(profile.end, done)
+
+    def _move_to(self, target, kind, reply=apt.MOT_MOVE_COMPLETED,
+                 velocity=None):
+        now = time.monotonic()
+        pos, v = self._motion.state(now)
+        target = min(max(target, 0), self.max_counts)
+        velocity = velocity or self.velocity
+        if v:
+            # Come to rest before starting the new move.
+            stop = MotionProfile.ramp(now, pos, v, 0, self.acceleration,
+                                      hold=False)
+            pos = stop.state(stop.end)[0]
+            move = MotionProfile.trapezoid(stop.end, pos, target, velocity,
+                                           self.acceleration)
+            profile = MotionProfile(now, stop.origin)
+            for t0, p0, v0, a, d in stop.phases + move.phases:
+                profile._append(a, v0, d)
+        else:
+            profile = MotionProfile.trapezoid(now, pos, target, velocity,
+                                              self.acceleration)
+        self._start_motion(profile, kind, reply)
+
+    def _on_home(self, frame):
+        self.homed = False
+        self._move_to(0, 'home', apt.MOT_MOVE_HOMED)
+
+    def _on_move_absolute(self, frame):
+        counts = apt.unpack_position(frame.data)[1]
+        self._move_to(counts, 'move')
+
+    def _on_move_relative(self, frame):
+        direction = -1 if frame.param2 == 1 else 1
+        target = self._motion.state(time.monotonic())[0]
+        self._move_to(target + direction * self.step_counts, 'move')
+
+    def _on_move_velocity(self, frame):
+        now = time.monotonic()
+        pos, v = self._motion.state(now)
+        target_v = -self.velocity if frame.param2 == 1 else self.velocity
+        profile = MotionProfile.ramp(now, pos, v, target_v, self.acceleration)
+        self._start_motion(profile, 'velocity', None)
+        # Stop at the end of travel like a limit switch would.
+        limit = 0 if target_v < 0 else self.max_counts
+        ramp_t, ramp_p, ramp_v, ramp_a, ramp_d = profile.phases[0]
+        ramp_end = ramp_p + ramp_v*ramp_d + ramp_a*ramp_d*ramp_d/2
+        token = self._motion_token
+        t_limit = profile.phases[-1][0] + (limit - ramp_end) / target_v
+        self._call_at(max(now, t_limit),
+                      lambda: token == self._motion_token
+                      and self._on_move_stop(None, immediate=True))
+
+    def _on_move_stop(self, frame, immediate=False):
+        now = time.monotonic()
+        pos, v = self._motion.state(now)
+        if frame is not None and frame.param2 == 1:
+            immediate = True
+        if immediate or not v:
+            profile = MotionProfile(now, min(max(pos, 0), self.max_counts))
+        else:
+            profile = MotionProfile.ramp(now, pos, v, 0, self.acceleration,
+                                         hold=False)
+        self._start_motion(profile, 'stop', apt.MOT_MOVE_STOPPED)
+
+    def _on_set_velparams(self, frame):
+        chan, v_min, acc, v_max = struct.unpack('<HLLL', frame.data)
+        self.acceleration = acc
+        self.velocity = v_max
+
+    def _on_set_moverelparams(self, frame):
+        self.step_counts = apt.unpack_position(frame.data)[1]
+
+    def _on_req_moverelparams(self, frame):
+        self._send(apt.pack_data(apt.MOT_GET_MOVERELPARAMS,
+                                 struct.pack('<Hi', 1, self.step_counts),
+                                 dest=apt.HOST, source=apt.USB_UNIT))
+
+    def _on_req_poscounter(self, frame):
+        pos = self._reported(time.monotonic())
+        self._send(apt.pack_data(apt.MOT_GET_POSCOUNTER,
+                                 struct.pack('<Hi', 1, pos),
+                                 dest=apt.HOST, source=apt.USB_UNIT))
+
+    def _send_status(self):
+        self._send(apt.pack_data(apt.MOT_GET_DCSTATUSUPDATE,
+                                 self._status_data(time.monotonic()),
+                                 dest=apt.HOST, source=apt.USB_UNIT))
+
+    def _on_req_info(self, frame):
+        info = struct.pack(apt.INFO_FORMAT, self.serial_number, b'TDC001',
+                           16, bytes([2, 0, 3, 0]), b'APT DC Motor Controller',
+                           b'', 1, 0, 1)
+        self._send(apt.pack_data(apt.HW_GET_INFO, info, dest=apt.HOST,
+                                 source=apt.USB_UNIT))
+
+    def _on_req_status(self, frame):
+        self._send_status()
+
+    def _on_ack_status(self, frame):
+        self._unacked = 0
+
+    def _on_start_updates(self, frame):
+        if not self.status_updates:
+            return
+        self._status_token += 1
+        self._unacked = 0
+        token = self._status_token
+
+        def push():
+            if token != self._status_token:
+                return
+            if self._unacked >= STATUS_MAX_UNACKED:
+                return
+            self._unacked += 1
+            self._send_status()
+            self._call_at(time.monotonic() + STATUS_INTERVAL, push)
+        push()
+
+    def _on_stop_updates(self, frame):
+        self._status_token += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run a simulated TDC001 controller on a pseudo-terminal.')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='reply latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0,
+                        help='maximum extra random reply delay in seconds')
+    parser.add_argument('--drop-rate', type=float, default=0.0,
+                        help='probability of dropping each reply byte')
+    parser.add_argument('--noise-rate', type=float, default=0.0,
+                        help='probability of garbage before each reply')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--serial-number', type=int, default=83000001,
+                        help='serial number reported to hardware info '
+                        'requests')
+    parser.add_argument('--backlash', type=float, default=0.0,
+                        help='lost motion in mm')
+    parser.add_argument('--no-status-updates', action='store_true',
+                        help='ignore requests to push status updates')
+    args = parser.parse_args()
+
+    sim = TDC001Simulator(latency=args.latency, jitter=args.jitter,
+                          drop_rate=args.drop_rate,
+                          noise_rate=args.noise_rate, seed=args.seed,
+                          serial_number=args.serial_number,
+                          status_updates=not args.no_status_updates,
+                          backlash=args.backlash)
+    print(sim.start(), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sim.stop()
+        print('received {} frames, sent {} frames, dropped {} bytes, '
+              'injected {} noise bytes'.format(sim.frames_received,
+                                               sim.frames_sent,
+                                               sim.bytes_dropped,
+                                               sim.noise_bytes))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Axis state kept between sessions, so a homed stage needn't be homed again.
+
+Entries are keyed by motor serial number and hold the last absolute position
+in mm, whether the axis was homed, and its zero offset.
+"""
+
+import json
+import os
+import threading
+
+STATE_PATH = os.path.join(os.path.expanduser('~'), '.cache', 'ncp_stage',
+                          'state.json')
+
+_lock = threading.Lock()
+
+
+def load(path=STATE_PATH):
+    """
+    Returns {serial number: entry} saved at `path`, empty if there is none.
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save(entries, path=STATE_PATH):
+    """
+    Saves {serial number: entry}, keeping the entries of other motors.
+    """
+    with _lock:
+        state = load(path)
+        state.update(entries)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f, indent=1)
+            os.replace(tmp, path)
+        except OSError:
+            pass
@@ -1,13 +1,34 @@
 #!/usr/bin/env python3
+"""
+Thorlabs APT stepper motors and the stages built from them.
 
+Pure Python, so scripts don't need Qt. The GUI adapts XYStage events to Qt
+signals with qt_stage.StageSignals.
+"""
+
+import collections
+import concurrent.futures
+import functools
+import os
 import struct
+import threading
 import time
 
-from PyQt4 import QtCore
-
 import serial
 from serial.tools import list_ports
 
+import apt
+import backlash
+import connection
+import motion
+import recorder
+import stage_state
+from commands import CommandQueue
+from estimator import MotionEstimator
+from latency import LatencyTracker, SettleRecord, SettleTracker
+from trail import PositionTrail
+from reactor import get_reactor
+
 
 def float32_to_bytes(float32_value):
     int_val = struct.unpack('!i', struct.pack('!f', float32_value))[0]
@@ -23,87 +44,313 @@ def limit(val, minimum, maximum):
         return val
 
 
-class XYStage:
+AxisConfig = collections.namedtuple(
+    'AxisConfig', ['name', 'serial_number', 'port', 'overshoot', 'limits',
+                   'travel', 'counts_per_mm', 'zero', 'center', 'retract'])
+AxisConfig.__new__.__defaults__ = (None, None, 0.2, (0, 10), 12, None, 0,
+                                   None, None)
+AxisConfig.__doc__ = """
+Configuration of one stage axis.
+
+name : str
+    Axis name used in events and commands, e.g. 'x' or 'z'.
+
+serial_number : str
+    Serial number identifier to find the motor's port with.
+
+port : str
+    Device path to open instead of searching for the serial number.
+
+overshoot : float
+    Backlash overshoot in mm. 0 disables compensation.
+
+limits : tuple
+    (min, max) absolute position in mm that moves are clamped to.
+
+travel : float
+    Absolute position in mm of the far end of the motor's travel.
+
+counts_per_mm : int
+    Encoder counts per mm, if not the TDC001 default.
+
+zero : float
+    Initial absolute position in mm of the axis zero.
+
+center : float
+    Absolute position in mm to move to when homing with center, or None to
+    stay at home.
+
+retract : float
+    Absolute position in mm retract() moves to, or None if the axis
+    doesn't retract.
+"""
+
+
+class _Move:
     """
-    Implements interface to two Thor motors creating an x-y stage.
+    A move() or sweep() in progress.
+    """
+
+    def __init__(self, future, axes, verify=True):
+        self.future = future
+        self.axes = set(axes)  # names of the axes yet to arrive
+        self.verify = verify  # read back the position with a tolerance
+        self.predicted_arrival = None
+
+
+class _Axis:
+    """
+    State of one stage axis.
+    """
+
+    def __init__(self, config, motor):
+        self.name = config.name
+        self.motor = motor
+        self.limits = config.limits
+        self.travel = config.travel
+        self.retract = config.retract
+        self.backlash = backlash.BacklashCompensator(config.overshoot)
+        self.zero = config.zero  # absolute pos of zeroed axis
+        self.legs = []  # (absolute pos, velocity) still to be moved through
+        self.leg = None  # (absolute pos, velocity) being moved through
+        self.retracted_from = None  # absolute pos before retract()
+        self.reconnecting = False
+        self.estimator = MotionEstimator(motor.pos)
+        self.target = None  # absolute pos of the current move
+        self.clamped = False  # target clamped to limits
+        self.move_start = None
+        self.corrections = 0
+        self.verifying = False
+        self.move = None  # _Move the axis is part of
+
+    @property
+    def pos(self):
+        return self.motor.pos - self.zero
+
+
+class MultiAxisStage:
+    """
+    A stage built from any number of named Thor motor axes.
+
+    Motor events are handled on the reactor thread. Listeners added with
+    add_listener() are called there with (axis, event_type, data) tuples, where
+    position data is relative to the zeroed position and an 'arrived' event
+    follows the final leg of a move. When every axis of a move() has
+    arrived, a (name, 'settled', timestamp) event follows, where `name` joins
+    the axis names, e.g. 'xyz'. If a motor's link drops, (axis,
+    'disconnected', reason) and later (axis, 'reconnected', info) events are
+    sent, and a move in progress is either sent again with an (axis,
+    'move_reissued', target) event or fails with a (name, 'move_failed',
+    message) event. Every event also records the position of the first two
+    axes in `trail`. Callbacks that must not wait for listeners or the GUI,
+    e.g. to trigger recording hardware, are added with add_settled_callback()
+    and add_lead_callback(). Command latencies of all motors are collected
+    in `latency`, a LatencyTracker. Between position reports, estimate() and
+    eta() model where the axes are and when they will arrive.
+
+    The settle time and final error of every axis move are collected in
+    `settle`, a SettleTracker. A target outside an axis's limits is clamped
+    with an (axis, 'clamped', target) event. With a `tolerance`, an axis
+    isn't settled until its position, read back after the move, is within
+    `tolerance` encoder counts of the target. Up to `max_corrections` moves
+    to the target are made, each with an (axis, 'correcting', error) event,
+    and an axis still off target settles with an (axis, 'off_target',
+    error) event.
+
+    Positions are tuples in the order of `axes`, and targets are dicts by
+    axis name.
 
     Parameters
     ----------
 
-    parent : QWidget
-        Widget to handle callbacks. Should implement on_xPos_changed(event) and
-        on_yPos_changed(event)
+    axes : list
+        AxisConfig, or dict of AxisConfig fields, of each axis.
 
-    x_motor_sn : str
-        Serial number identifier to use to find correct x motor com port.
+    planner : motion.MotionPlanner
+        Chooses the velocity and acceleration of each move. `velocity` only
+        applies to continuous moves.
 
-    y_motor_sn : str
-        Serial number identifier to use to find correct y motor com port.
+    motors : list
+        ThorSteppers of each axis to use instead of opening ports, e.g.
+        offline motors to replay recorded traffic into. Motors are otherwise
+        found with connection.connect(), which opens all of them in parallel.
+
+    state_path : str
+        File to save the axis state to on stop(), for restore_state(), e.g.
+        stage_state.STATE_PATH.
+
+    reissue_moves : bool
+        When a motor's link drops during a move and is restored, send the
+        move again. Otherwise the move fails as soon as the link drops.
+
+    tolerance : int
+        Encoder counts a move may end off target. None skips the read back.
+
+    max_corrections : int
+        Correction moves made to bring an axis within `tolerance`.
     """
 
-    def __init__(self, parent, x_motor_sn, y_motor_sn, backlash_comp=(0, 0)):
-        self.parent = parent
-        print(x_motor_sn)
-        print(y_motor_sn)
-        x_port = None
-        y_port = None
-        self._zx = 0  # absolute pos of zeroed x
-        self._zy = 0
-        self._velocity = 0
-        self._old_y = 0
-        self.backlash_comp = backlash_comp
-        self._x_update = False
-        self._y_update = False
-
-        for p in list_ports.comports():
-            if x_motor_sn in p[2]:
-                x_port = p[0]
-            elif y_motor_sn in p[2]:
-                y_port = p[0]
-        if x_port is None:
-            raise IOError('X motor not connected.')
-        if y_port is None:
-            raise IOError('Y motor not connected.')
-
-        self.x_motor = ThorStepper(port=x_port)
-        self.x_motor.event.connect(self.on_xMotor_event,
-                                   QtCore.Qt.QueuedConnection)
-        self.x_motor.start()
-
-        self.y_motor = ThorStepper(port=y_port)
-        self.y_motor.event.connect(self.on_yMotor_event,
-                                   QtCore.Qt.QueuedConnection)
-        self.y_motor.start()
+    def __init__(self, axes, planner=None, motors=None, state_path=None,
+                 reissue_moves=True, tolerance=None, max_corrections=2):
+        configs = [AxisConfig(**c) if isinstance(c, dict) else c
+                   for c in axes]
+        self.name = ''.join(c.name for c in configs)
+        self._velocity = None
+        self.planner = planner or motion.MotionPlanner()
+        self.predicted_arrival = None
+        self.center_pos = tuple(c.center for c in configs)
+        self._homing = set()  # names of the axes yet to report homed
+        self._center_after_home = None  # {name: absolute pos} once homed
+        self.state_path = state_path
+        self.reissue_moves = reissue_moves
+        self.tolerance = tolerance
+        self.max_corrections = max_corrections
+        self.supervisor = None
+        self._listeners = []
+        self._settled_callbacks = []
+        self._lead_callbacks = []
+        self._lock = threading.RLock()
+        self.trail = PositionTrail()
+        self.latency = LatencyTracker()
+        self.settle = SettleTracker()
+
+        if motors is None:
+            serial_numbers = [c.serial_number for c in configs]
+            motors = connection.connect(serial_numbers,
+                                        [c.port for c in configs])
+            self.supervisor = connection.Supervisor(motors, serial_numbers)
+        self.motors = list(motors)
+        self.reactor = self.motors[0].reactor
+        self._recorder = None
+        self._axes = collections.OrderedDict(
+            (c.name, _Axis(c, motor)) for c, motor in zip(configs, motors))
+        for config, axis in zip(configs, self._axes.values()):
+            motor = axis.motor
+            motor.axis = axis.name
+            motor.latency = self.latency
+            motor.travel = axis.travel
+            if (config.counts_per_mm is not None and
+                    config.counts_per_mm != motor.counts_per_mm):
+                motor.acceleration *= motor.counts_per_mm / \
+                    config.counts_per_mm
+                motor.counts_per_mm = config.counts_per_mm
+                motor.set_initial_values()
+            motor.add_listener(
+                functools.partial(self._on_motor_event, axis.name))
+            motor.start()
 
     @property
-    def x(self):
-        return self.x_motor.pos - self._zx
+    def axes(self):
+        return tuple(self._axes)
 
-    @x.setter
-    def x(self, val):
+    def add_listener(self, callback):
         """
-        Sets x coordinate of stage relative to zeroed position.
+        Calls `callback((axis, event_type, data))` for every stage event.
+        """
+        self._listeners = self._listeners + [callback]
 
-        val : float
-            position in mm
+    def remove_listener(self, callback):
+        self._listeners = [c for c in self._listeners if c != callback]
+
+    def add_settled_callback(self, callback):
+        """
+        Calls `callback(timestamp, pos)` as soon as a move() settles, before
+        its future is resolved and before any listener. It runs on the
+        reactor thread straight from the completion message, so it must
+        return quickly. `timestamp` is the time.monotonic() at which that
+        message was read.
+        """
+        self._settled_callbacks = self._settled_callbacks + [callback]
+
+    def remove_settled_callback(self, callback):
+        self._settled_callbacks = [c for c in self._settled_callbacks
+                                   if c != callback]
+
+    def add_lead_callback(self, callback, lead):
         """
-        self._x_update = True
-        self.x_motor.pos = limit(val + self._zx - 0.2, 0, 10)
+        Calls `callback(predicted_arrival, target)` on the reactor thread
+        `lead` seconds before the predicted arrival of each move(), or at
+        once if the move is predicted to take less than that. Not called if
+        the move settles or is superseded first.
+        """
+        self._lead_callbacks = self._lead_callbacks + [(callback, lead)]
+
+    def remove_lead_callback(self, callback):
+        self._lead_callbacks = [(c, lead) for c, lead in self._lead_callbacks
+                                if c != callback]
+
+    def _schedule_lead_callbacks(self, move, target):
+        def fire(callback):
+            if not move.future.done():
+                callback(move.predicted_arrival, target)
+        now = time.monotonic()
+        for callback, lead in self._lead_callbacks:
+            self.reactor.call_later(
+                max(0, move.predicted_arrival - lead - now), fire, callback)
+
+    def _notify(self, axis, event_type, data):
+        for callback in self._listeners:
+            callback((axis, event_type, data))
 
     @property
-    def y(self):
-        return self.y_motor.pos - self._zy
+    def pos(self):
+        """
+        Position of every axis in mm relative to its zero.
+        """
+        return tuple(axis.pos for axis in self._axes.values())
 
-    @y.setter
-    def y(self, val):
+    @property
+    def zero_pos(self):
         """
-        Sets y coordinate of stage relative to zeroed position.
+        Absolute position in mm of the zero of every axis.
+        """
+        return tuple(axis.zero for axis in self._axes.values())
 
-        val : float
-            position in mm
+    def position(self, axis):
+        return self._axes[axis].pos
+
+    @property
+    def moving(self):
+        return any(axis.estimator.moving for axis in self._axes.values())
+
+    def estimate(self, t=None):
+        """
+        Returns the estimated position of every axis at `t`, defaulting to
+        now. See estimator.MotionEstimator.
+        """
+        t = time.monotonic() if t is None else t
+        return tuple(axis.estimator.predict(t) - axis.zero
+                     for axis in self._axes.values())
+
+    def passing_time(self, axis, pos):
+        """
+        Returns the estimated time.monotonic() at which the current or last
+        move of `axis` passes `pos` mm, or None if it doesn't.
+        """
+        axis = self._axes[axis]
+        return axis.estimator.time_at(pos + axis.zero)
+
+    def eta(self, t=None):
+        """
+        Returns the estimated seconds from `t`, defaulting to now, until
+        every axis has arrived.
         """
-        self._y_update = True
-        self.y_motor.pos = limit(val + self._zy - 0.2, 0, 10)
+        t = time.monotonic() if t is None else t
+        with self._lock:
+            return max(axis.estimator.eta(t) + self._legs_duration(axis)
+                       for axis in self._axes.values())
+
+    def motor(self, axis):
+        return self._axes[axis].motor
+
+    @property
+    def backlash_comp(self):
+        return tuple(axis.backlash.overshoot for axis in self._axes.values())
+
+    @backlash_comp.setter
+    def backlash_comp(self, val):
+        for axis, overshoot in zip(self._axes.values(), val):
+            axis.backlash.overshoot = overshoot
 
     @property
     def velocity(self):
@@ -111,102 +358,784 @@ class XYStage:
 
     @velocity.setter
     def velocity(self, val):
-        self.x_motor.velocity = val
-        self.y_motor.velocity = val
-
-    def home(self, center=False):
-        self._zx = 0
-        self._zy = 0
-        self.x_motor.home()
-        self.y_motor.home()
+        """
+        Sets the velocity of continuous moves in mm/s. It is sent to the
+        motors when one starts.
+        """
+        self._velocity = val
+
+    def move(self, targets, synchronize=False):
+        """
+        Moves axes to positions relative to their zero. The commands of all
+        axes are sent together and run concurrently.
+
+        Parameters
+        ----------
+
+        targets : dict
+            Target position in mm by axis name. Axes that are left out or
+            None stay where they are.
+
+        synchronize : bool
+            Slow down the axes with shorter moves so that all axes arrive at
+            the same time.
+
+        Returns
+        -------
+        A concurrent.futures.Future resolved with the time.monotonic()
+        timestamp at which every moved axis has completed its final leg. It is
+        cancelled if another move, jog, stop or home of any of its axes
+        supersedes it. Moves of other axes carry on.
+        """
+        targets = {name: val for name, val in targets.items()
+                   if val is not None}
+        for name in targets:
+            if name not in self._axes:
+                raise KeyError('No axis {}.'.format(name))
+        future = concurrent.futures.Future()
+        events = []
+        with self._lock:
+            self._cancel_move(targets)
+            now = time.monotonic()
+            for name, val in targets.items():
+                axis = self._axes[name]
+                self._plan(axis, val)
+                axis.move_start = now
+                axis.corrections = 0
+                if axis.clamped:
+                    events.append((name, 'clamped', val))
+            # Axes already at their target don't move at all.
+            move = _Move(future, [name for name in targets
+                                  if self._axes[name].legs])
+            if synchronize:
+                self._synchronize([self._axes[name] for name in targets])
+            self.predicted_arrival = time.monotonic() + max(
+                (self._legs_duration(self._axes[name]) for name in targets),
+                default=0)
+            move.predicted_arrival = self.predicted_arrival
+            for name in move.axes:
+                self._axes[name].move = move
+                self._start_leg(self._axes[name])
+            done = not move.axes
+            if not done:
+                self._schedule_lead_callbacks(
+                    move, tuple(axis.target - axis.zero if name in targets
+                                  else axis.pos
+                                  for name, axis in self._axes.items()))
+        for event in events:
+            self._notify(*event)
+        if done and future.set_running_or_notify_cancel():
+            future.set_result(time.monotonic())
+        return future
+
+    def sweep(self, axis, val, velocity):
+        """
+        Moves `axis` to `val` mm relative to its zero in a single leg with a
+        cruise velocity of `velocity` mm/s, e.g. to scan at constant
+        velocity. There is no backlash overshoot or read back.
+
+        Returns
+        -------
+        A concurrent.futures.Future like move().
+        """
+        future = concurrent.futures.Future()
+        events = []
+        with self._lock:
+            self._cancel_move([axis])
+            a = self._axes[axis]
+            a.move = _Move(future, [axis], verify=False)
+            target = limit(val + a.zero, *a.limits)
+            a.target = target
+            a.clamped = target != val + a.zero
+            if a.clamped:
+                events.append((axis, 'clamped', val))
+            acceleration = self.planner.max_acceleration
+            a.legs = [(target, motion.Profile(
+                velocity, acceleration,
+                motion.move_time(target - self._start_pos(a), velocity,
+                                 acceleration)))]
+            a.move_start = time.monotonic()
+            a.corrections = 0
+            self.predicted_arrival = a.move_start + self._legs_duration(a)
+            a.move.predicted_arrival = self.predicted_arrival
+            self._start_leg(a)
+        for event in events:
+            self._notify(*event)
+        return future
+
+    def _plan(self, axis, val, limits=None):
+        """
+        Sets the legs that take `axis` to `val` mm relative to its zero,
+        clamped to `limits`, defaulting to the axis limits.
+        """
+        target = limit(val + axis.zero, *(limits or axis.limits))
+        axis.target = target
+        axis.clamped = target != val + axis.zero
+        start = self._start_pos(axis)
+        current = (axis.motor.velocity, axis.motor.acceleration)
+        axis.legs = []
+        for pos in axis.backlash.plan(start, target,
+                                      self._resolution(axis)):
+            pos = limit(pos, 0, axis.travel)
+            profile = self.planner.plan(pos - start, current)
+            axis.legs.append((pos, profile))
+            current = profile[:2]
+            start = pos
+
+    @staticmethod
+    def _start_pos(axis):
+        """
+        Returns the absolute position in mm to plan a move of `axis` from.
+        The last reported position is stale while the axis moves, so the
+        estimate is used then.
+        """
+        if axis.estimator.moving or axis.motor.moving:
+            return axis.estimator.predict()
+        return axis.motor.pos
+
+    @staticmethod
+    def _resolution(axis):
+        """
+        Returns how close in mm to its target `axis` counts as there. Never
+        while it moves, since it may not stop there.
+        """
+        if axis.estimator.moving or axis.motor.moving:
+            return 0
+        return 1 / axis.motor.counts_per_mm
+
+    def _legs_duration(self, axis):
+        return sum(profile.duration for pos, profile in axis.legs)
+
+    def predict_time(self, targets):
+        """
+        Returns the predicted time in seconds for move(targets) to settle.
+        """
+        durations = [0]
+        with self._lock:
+            for name, val in targets.items():
+                if val is None:
+                    continue
+                axis = self._axes[name]
+                target = limit(val + axis.zero, *axis.limits)
+                start = self._start_pos(axis)
+                distances = []
+                for pos in axis.backlash.plan(start, target,
+                                              self._resolution(axis)):
+                    distances.append(pos - start)
+                    start = pos
+                durations.append(self.planner.predict(distances))
+        return max(durations)
+
+    def _synchronize(self, axes):
+        """
+        Slows all but the slowest of `axes` so that every axis takes as long
+        over all its legs. The extra time goes to the longest leg.
+        """
+        axes = [axis for axis in axes if axis.legs]
+        duration = max((self._legs_duration(axis) for axis in axes),
+                       default=0)
+        for axis in axes:
+            extra = duration - self._legs_duration(axis)
+            if extra <= 0:
+                continue
+            starts = ([self._start_pos(axis)] +
+                      [pos for pos, _ in axis.legs[:-1]])
+            i = max(range(len(axis.legs)),
+                    key=lambda i: abs(axis.legs[i][0] - starts[i]))
+            pos, profile = axis.legs[i]
+            distance = pos - starts[i]
+            v = motion.velocity_for_time(
+                distance, motion.move_time(distance, profile.velocity,
+                                           profile.acceleration) + extra,
+                profile.acceleration)
+            if v is not None and v < profile.velocity:
+                axis.legs[i] = (pos, profile._replace(
+                    velocity=v, duration=profile.duration + extra))
+
+    def _start_leg(self, axis, leg=None):
+        pos, profile = axis.leg = leg or axis.legs.pop(0)
+        axis.motor.set_velocity_params(profile.velocity, profile.acceleration)
+        axis.backlash.moved(self._start_pos(axis), pos)
+        axis.motor.move_absolute(pos, 'overshoot' if axis.legs else 'move')
+        axis.estimator.command(time.monotonic(), pos, profile.velocity,
+                               profile.acceleration)
+
+    def _fail_move(self, error, axes):
+        """
+        Fails the move futures of `axes` with `error`, dropping the
+        remaining legs of every axis of those moves.
+        """
+        moves = {self._axes[name].move for name in axes} - {None}
+        now = time.monotonic()
+        for axis in self._axes.values():
+            if axis.move in moves:
+                axis.legs = []
+                axis.verifying = False
+                axis.move = None
+                axis.estimator.stop(now)
+        for move in moves:
+            if move.future.set_running_or_notify_cancel():
+                move.future.set_exception(error)
+
+    def _cancel_move(self, axes=None):
+        """
+        Drops the remaining legs of `axes`, defaulting to all, and cancels
+        the moves they are part of, including centering after homing.
+        """
+        axes = list(self._axes if axes is None else axes)
+        if (self._center_after_home is not None and
+                set(axes) & set(self._center_after_home)):
+            self._center_after_home = None
+        for name in axes:
+            axis = self._axes[name]
+            axis.legs = []
+            axis.verifying = False
+            if axis.move is not None:
+                axis.move.future.cancel()
+                axis.move = None
+
+    @property
+    def homed(self):
+        return all(motor.homed for motor in self.motors)
+
+    def home(self, center=False, center_pos=None, force=True):
+        """
+        Homes all axes. With `center`, then moves to `center_pos` (absolute
+        mm of each axis, None to stay), defaulting to the `center_pos`
+        attribute, once every axis has reported homed. Unless `force`, a
+        stage that is already homed, e.g. after restore_state(), only
+        centers.
+        """
+        targets = None
         if center:
-            self.x_motor.pos = self.parent.saved_zero_pos[0]
-            self.y_motor.pos = self.parent.saved_zero_pos[1]
+            if center_pos is None:
+                center_pos = self.center_pos
+            targets = {name: pos for name, pos in zip(self._axes, center_pos)
+                       if pos is not None}
+        if force or not self.homed:
+            with self._lock:
+                self._cancel_move()
+                for axis in self._axes.values():
+                    axis.zero = 0
+                    axis.backlash.reset()
+                    axis.estimator.stop(time.monotonic())
+                # Any move sent before both axes report homed aborts homing.
+                self._homing = set(self._axes)
+                self._center_after_home = targets
+            for motor in self.motors:
+                motor.home()
+        elif targets:
+            self._center(targets)
+
+    def _center(self, targets):
+        """
+        Moves to `targets`, absolute positions in mm by axis name.
+        """
+        self.move({name: pos - self._axes[name].zero
+                   for name, pos in targets.items()})
 
-    def on_xMotor_event(self, event):
-        event_type, data = event
-        if event_type == 'homed':
-            self.zero()
-        elif event_type == 'move_completed':
-            if self._x_update:
-                self._x_update = False
-                self.x_motor.pos += 0.2
-        self.parent.on_xPos_changed(self.x)
-
-    def on_yMotor_event(self, event):
+    def save_state(self, path=None):
+        """
+        Saves the absolute position, homed state and zero of each axis to
+        `path`, defaulting to `state_path`.
+        """
+        entries = {}
+        for axis in self._axes.values():
+            if axis.motor.info is not None:
+                entries[str(axis.motor.info['serial_number'])] = {
+                    'pos': axis.motor.pos, 'homed': axis.motor.homed,
+                    'zero': axis.zero, 'saved': time.time()}
+        if entries:
+            stage_state.save(entries, path or self.state_path)
+
+    def restore_state(self, path=None, tolerance=0.005, timeout=2.0):
+        """
+        Resumes from the state saved by save_state() without homing.
+
+        The saved state is only trusted if both axes were homed, each
+        controller still reports itself homed, so it has stayed powered, and
+        reads back its saved position within `tolerance` mm.
+
+        Returns
+        -------
+        True if the state was restored, otherwise the stage needs homing.
+        """
+        saved = stage_state.load(path or self.state_path)
+        entries = {}
+        for name, axis in self._axes.items():
+            info = axis.motor.info
+            entry = info and saved.get(str(info['serial_number']))
+            if not entry or not entry.get('homed'):
+                return False
+            entries[name] = entry
+
+        replies = {name: threading.Event() for name in self._axes}
+        listeners = {}
+        for name, axis in self._axes.items():
+            def on_event(event, done=replies[name]):
+                if event[0] == 'status':
+                    done.set()
+            listeners[name] = on_event
+            axis.motor.add_listener(on_event)
+            axis.motor.request_status()
+        try:
+            deadline = time.monotonic() + timeout
+            for done in replies.values():
+                if not done.wait(max(0, deadline - time.monotonic())):
+                    return False
+        finally:
+            for name, axis in self._axes.items():
+                axis.motor.remove_listener(listeners[name])
+
+        for name, axis in self._axes.items():
+            if not axis.motor.status_bits & apt.STATUS_HOMED:
+                return False
+            if abs(axis.motor.pos - entries[name]['pos']) > tolerance:
+                return False
+        with self._lock:
+            for name, axis in self._axes.items():
+                axis.motor.homed = True
+                axis.zero = entries[name]['zero']
+                axis.backlash.reset()
+        return True
+
+    def _on_link_event(self, axis, event_type, data):
+        """
+        Handles the link of `axis` dropping and being restored. Once the
+        controller has reconnected and reported its status, a move in
+        progress is sent again, unless the controller lost its position by
+        being power cycled.
+        """
+        error = None
+        events = []
+        with self._lock:
+            moving = axis.move is not None
+            if event_type == 'disconnected':
+                events.append((axis.name, event_type, data))
+                if moving and not self.reissue_moves:
+                    error = IOError('{} motor disconnected: {}'.format(
+                        axis.name.upper(), data))
+            elif event_type == 'reconnected':
+                events.append((axis.name, event_type, data))
+                axis.reconnecting = True
+                axis.motor.request_status()
+            else:
+                axis.reconnecting = False
+                if (axis.motor.homed and
+                        not axis.motor.status_bits & apt.STATUS_HOMED):
+                    axis.motor.homed = False
+                    events.append((axis.name, 'position_lost', axis.pos))
+                    if moving:
+                        error = IOError(
+                            '{} motor lost its position while disconnected; '
+                            'home the stage.'.format(axis.name.upper()))
+                elif moving and axis.leg is not None:
+                    self._start_leg(axis, axis.leg)
+                    events.append((axis.name, 'move_reissued',
+                                   axis.leg[0] - axis.zero))
+            if error is not None:
+                self._fail_move(error, [axis.name])
+                events.append((self.name, 'move_failed', str(error)))
+        for event in events:
+            self._notify(*event)
+
+    def _on_motor_event(self, name, event):
         event_type, data = event
-        if event_type == 'homed':
-            self.zero()
-        elif event_type == 'move_completed':
-            if self._y_update:
-                self._y_update = False
-                self.y_motor.pos += 0.2
-        self.parent.on_yPos_changed(self.y)
+        now = time.monotonic()
+        axis = self._axes[name]
+        if event_type in ('disconnected', 'reconnected'):
+            self._on_link_event(axis, event_type, data)
+            return
+        if event_type == 'status' and axis.reconnecting:
+            self._on_link_event(axis, event_type, data)
+        arrived = False
+        settled = None
+        events = []
+        with self._lock:
+            if event_type in ('move_completed', 'homed', 'stop'):
+                axis.estimator.stopped(axis.motor.read_time, axis.motor.pos)
+            elif event_type in ('pos', 'status'):
+                axis.estimator.sample(axis.motor.read_time, axis.motor.pos)
+            center = None
+            if event_type == 'homed':
+                axis.zero = axis.motor.pos
+                self._homing.discard(name)
+                if not self._homing:
+                    center = self._center_after_home
+                    self._center_after_home = None
+            elif event_type == 'move_completed':
+                if axis.legs:
+                    self._start_leg(axis)
+                elif (axis.move is not None and axis.move.verify and
+                      self.tolerance is not None):
+                    axis.verifying = True
+                    axis.motor.request_pos()
+                else:
+                    arrived = True
+                    settled = self._arrived(axis, events)
+            elif event_type == 'pos' and axis.verifying:
+                axis.verifying = False
+                error = self._error(axis)
+                if (abs(error) > self.tolerance and
+                        axis.corrections < self.max_corrections and
+                        self._correct(axis, error)):
+                    events.append((name, 'correcting', error))
+                else:
+                    arrived = True
+                    settled = self._arrived(axis, events)
+        pos = axis.pos
+        stage_pos = self.pos
+        if settled is not None:
+            now = axis.motor.read_time
+            for callback in self._settled_callbacks:
+                callback(now, stage_pos)
+        self.trail.append(now, *(stage_pos + (0,))[:2])
+        self._notify(name, event_type, pos)
+        for event in events:
+            self._notify(*event)
+        if arrived:
+            self._notify(name, 'arrived', pos)
+        if settled is not None and settled.set_running_or_notify_cancel():
+            settled.set_result(now)
+            self._notify(self.name, 'settled', now)
+        if center:
+            self._center(center)
+
+    def _error(self, axis):
+        """
+        Returns how many encoder counts `axis` is past its target.
+        """
+        counts_per_mm = axis.motor.counts_per_mm
+        return (round(axis.motor.pos * counts_per_mm) -
+                int(axis.target * counts_per_mm))
+
+    def _correct(self, axis, error):
+        """
+        Moves `axis` `error` counts short of where its last leg went, keeping
+        the target it is checked against. Only the travel limits the
+        correction, since a target at the axis limits may need it. Returns
+        False if there is nothing to move.
+        """
+        target, clamped = axis.target, axis.clamped
+        self._plan(axis, axis.leg[0] - axis.zero -
+                   error / axis.motor.counts_per_mm, (0, axis.travel))
+        axis.target, axis.clamped = target, clamped
+        if not axis.legs:
+            return False
+        axis.corrections += 1
+        self._start_leg(axis)
+        return True
+
+    def _arrived(self, axis, events):
+        """
+        Records the end of the move of `axis`. Returns the move future once
+        every axis of the move has arrived.
+        """
+        move = axis.move
+        if move is None:
+            return None
+        now = axis.motor.read_time
+        error = self._error(axis)
+        on_target = self.tolerance is None or abs(error) <= self.tolerance
+        self.settle.add(SettleRecord(axis.name, now, now - axis.move_start,
+                                     error, axis.corrections, on_target,
+                                     axis.clamped))
+        if not on_target:
+            events.append((axis.name, 'off_target', error))
+        axis.move = None
+        move.axes.discard(axis.name)
+        if move.axes:
+            return None
+        return move.future
 
     def start_move(self, axis, direction):
-        if axis == 'x':
-            self.x_motor.start_move(direction)
-        elif axis == 'y':
-            self.y_motor.start_move(direction)
+        with self._lock:
+            self._cancel_move([axis])
+            self._axes[axis].backlash.moving(
+                -1 if direction == 'backward' else 1)
+            motor = self._axes[axis].motor
+            if self._velocity is not None:
+                motor.set_velocity_params(self._velocity, motor.acceleration)
+            self._axes[axis].estimator.command(
+                time.monotonic(),
+                0 if direction == 'backward' else self._axes[axis].travel,
+                motor.velocity, motor.acceleration)
+        motor.start_move(direction)
 
     def stop_move(self, axis):
-        if axis == 'x':
-            self.x_motor.stop_move()
-        if axis == 'y':
-            self.y_motor.stop_move()
+        with self._lock:
+            self._cancel_move([axis])
+            self._axes[axis].estimator.stop(time.monotonic())
+        self._axes[axis].motor.stop_move()
 
     def update(self):
-        self.x_motor.update()
-        self.y_motor.update()
+        """
+        Polls the motors that need it. Returns seconds until the next call.
+        """
+        return min(motor.update() for motor in self.motors)
 
-    def zero(self):
+    def zero(self, position=None):
         """
-        Zero stage relative to current absolute position.
+        Zero stage relative to current absolute position, or to `position`,
+        the absolute position in mm of each axis.
 
         Returns
         -------
         The absolute position offset.
         """
-        self._zx = self.x_motor.pos
-        self._zy = self.y_motor.pos
-        return (self._zx, self._zy)
+        with self._lock:
+            for i, axis in enumerate(self._axes.values()):
+                if position is None:
+                    axis.zero = axis.motor.pos
+                else:
+                    axis.zero = position[i]
+        return tuple(axis.zero for axis in self._axes.values())
+
+    def calibrate_backlash(self, axis, position=None, margin=0.05, **kwargs):
+        """
+        Measures the backlash of `axis` and sets its overshoot to the
+        measurement plus `margin` mm. Blocks until done; see
+        backlash.calibrate() for the other arguments.
 
-    def retract_y(self):
-        self._old_y = self.y_motor.pos
-        self.y_motor.pos = 12
+        Returns
+        -------
+        The measured backlash in mm.
+        """
+        motor = self._axes[axis].motor
+        if position is None:
+            position = motor.pos
+        measured = backlash.calibrate(motor, position, **kwargs)
+        self._axes[axis].backlash.overshoot = measured + margin
+        return measured
+
+    def _retract_axes(self, axis):
+        if axis is not None:
+            return [self._axes[axis]]
+        return [a for a in self._axes.values() if a.retract is not None]
+
+    def retract(self, axis=None):
+        """
+        Moves `axis`, or every axis configured to retract, to its retract
+        position, remembering where it was for unretract().
+        """
+        for a in self._retract_axes(axis):
+            a.retracted_from = a.motor.pos
+            a.motor.pos = a.travel if a.retract is None else a.retract
 
-    def return_y(self):
-        if self._old_y is not None:
-            self.y_motor.pos = self._old_y
+    def unretract(self, axis=None):
+        """
+        Moves retracted axes back to where they were before retract().
+        """
+        for a in self._retract_axes(axis):
+            if a.retracted_from is not None:
+                a.motor.pos = a.retracted_from
+                a.retracted_from = None
+
+    def record(self, path):
+        """
+        Starts appending the traffic of all motors to the log at `path`, as
+        streams numbered in axis order. See recorder.replay().
+        """
+        self.stop_recording()
+        self._recorder = recorder.Recorder(path)
+        for stream, motor in enumerate(self.motors):
+            motor.record(self._recorder, stream)
+
+    def stop_recording(self):
+        if self._recorder is not None:
+            for motor in self.motors:
+                motor.record(None)
+            self._recorder.close()
+            self._recorder = None
 
     def stop(self):
-        try:
-            self.x_motor.stop()
-            self.y_motor.stop()
-        except:
-            pass
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        if self.state_path is not None:
+            self.save_state()
+        for motor in self.motors:
+            try:
+                motor.stop()
+            except:
+                pass
+        self.stop_recording()
+
+
+class XYStage(MultiAxisStage):
+    """
+    Implements interface to two Thor motors creating an x-y stage.
+
+    A MultiAxisStage of axes 'x' and 'y', where y retracts to 12 mm, with
+    coordinate arguments in place of target dicts. Settled events come from
+    'xy'.
+
+    Parameters
+    ----------
+
+    x_motor_sn : str
+        Serial number identifier to use to find correct x motor com port.
+
+    y_motor_sn : str
+        Serial number identifier to use to find correct y motor com port.
+
+    backlash_comp : tuple
+        (x, y) overshoot in mm used when a move has to reverse to approach
+        its target from below. 0 disables compensation for that axis.
 
+    ports : tuple
+        (x port, y port) device paths to use instead of searching for the
+        serial numbers.
 
-class ThorStepper(QtCore.QThread):
+    motors : tuple
+        (x motor, y motor) ThorSteppers to use instead of opening ports.
+
+    See MultiAxisStage for the other parameters.
     """
-    Implements interface to Thor APT TDC001 stepper motor.
+
+    def __init__(self, x_motor_sn, y_motor_sn, backlash_comp=(0.2, 0.2),
+                 ports=None, planner=None, motors=None, state_path=None,
+                 reissue_moves=True, tolerance=None, max_corrections=2):
+        ports = ports or (None, None)
+        super().__init__(
+            [AxisConfig('x', x_motor_sn, ports[0], backlash_comp[0],
+                        center=4),
+             AxisConfig('y', y_motor_sn, ports[1], backlash_comp[1],
+                        center=4, retract=12)],
+            planner=planner, motors=motors, state_path=state_path,
+            reissue_moves=reissue_moves, tolerance=tolerance,
+            max_corrections=max_corrections)
+        self.x_motor, self.y_motor = self.motors
+
+    @property
+    def x(self):
+        return self._axes['x'].pos
+
+    @x.setter
+    def x(self, val):
+        """
+        Sets x coordinate of stage relative to zeroed position.
+
+        val : float
+            position in mm
+        """
+        self.move_to(x=val)
+
+    @property
+    def y(self):
+        return self._axes['y'].pos
+
+    @y.setter
+    def y(self, val):
+        """
+        Sets y coordinate of stage relative to zeroed position.
+
+        val : float
+            position in mm
+        """
+        self.move_to(y=val)
+
+    def move_to(self, x=None, y=None, synchronize=False):
+        """
+        Moves to (x, y) relative to the zeroed position. Either coordinate
+        may be None to leave that axis where it is. See move().
+        """
+        return self.move({'x': x, 'y': y}, synchronize)
+
+    def predict_move_time(self, x=None, y=None):
+        """
+        Returns the predicted time in seconds for move_to(x, y) to settle.
+        """
+        return self.predict_time({'x': x, 'y': y})
+
+    def retract_y(self):
+        self.retract('y')
+
+    def return_y(self):
+        self.unretract('y')
+
+
+class ThorStepper:
     """
+    Implements interface to Thor APT TDC001 stepper motor.
 
-    MSG_HOMED = b'\x04\x44'
-    MSG_MOVE_COMPLETED = b'\x04\x64'
-    MSG_MOVE_STOP = b'\x04\x66'
-    MSG_GET_POS = b'\x04\x12'
-    MSG_GET_STEP_SIZE = b'\x04\x47'
+    Received data is handled on the shared reactor thread, which serves every
+    motor in the process; listeners are called from that thread. Commands
+    are queued and written by the same thread, collapsing superseded ones.
 
-    event = QtCore.pyqtSignal(object)
+    While a move is in progress the controller is asked to push status
+    updates, which are emitted as 'status' events. Controllers that don't push
+    fall back to position requests sent from update().
 
-    def __init__(self, parent=None, port=None):
-        super().__init__(parent)
+    If `latency` is set to a LatencyTracker, every move, home and position
+    request is timed from when it is written to when its reply arrives,
+    under the name `axis`. See record() for logging the raw traffic.
+
+    With `connect` False no port is opened and the motor only handles data
+    passed to feed().
+
+    If the link fails, the port is closed and a ('disconnected', reason)
+    event is emitted. reopen() restores it, e.g. from a
+    connection.Supervisor.
+    """
+
+    # Seconds to wait for the first pushed status update before polling.
+    STATUS_TIMEOUT = 0.5
+    # Status updates stop unless acknowledged at least this often.
+    STATUS_ACK_INTERVAL = 1.0
+    # Poll intervals returned by update().
+    POLL_MOVING = 0.05
+    POLL_PUSHING = 0.25
+    POLL_IDLE = 1.0
+
+    # Reply that completes each kind of timed command.
+    TIMED_REPLIES = {'move': 'move_completed', 'overshoot': 'move_completed',
+                     'step': 'move_completed', 'jog': 'move_completed',
+                     'home': 'homed', 'pos': 'pos'}
+
+    def __init__(self, port=None, reactor=None, connect=True):
+        self.reactor = reactor or get_reactor()
+        self.latency = None
+        self.recorder = None
+        self.record_stream = 0
+        self.axis = port
+        self._listeners = []
         self.counts_per_mm = 34304
+        self.travel = 12
         self.homed = False
         self._pos = 0
         self._step_size = 0
         self._velocity = 0
+        self.acceleration = 180000 / self.counts_per_mm
+        self._sent_velocity_params = None
+        self.push_status = True
+        self.status_bits = 0
+        self.moving = False
+        self._status_on = False
+        self._status_requested = 0
+        self._status_time = 0
+        self._status_ack_time = 0
+        self._parser = apt.FrameParser()
+        self._commands = CommandQueue()
+        self._flush_timer = None
+        self._started = False
+        self.read_time = None
+        self.info = None
+        self._ready = threading.Event()
+        self._handlers = {
+            apt.MOT_MOVE_HOMED: self._on_homed,
+            apt.MOT_MOVE_COMPLETED: self._on_move_completed,
+            apt.MOT_GET_POSCOUNTER: self._on_pos,
+            apt.MOT_MOVE_STOPPED: self._on_stopped,
+            apt.MOT_GET_MOVERELPARAMS: self._on_step_size,
+            apt.MOT_GET_STATUSUPDATE: self._on_status,
+            apt.MOT_GET_DCSTATUSUPDATE: self._on_status,
+            apt.HW_GET_INFO: self._on_info,
+        }
+
+        if not connect:
+            # Offline, e.g. to replay recorded traffic into feed().
+            self.connected = False
+            return
 
         if port is None:
             # Try to find right port.
@@ -230,60 +1159,248 @@ class ThorStepper(QtCore.QThread):
             raise
             self.connected = False
 
-        self._running = False
-        time.sleep(0.1)
-
-    def set_initial_values(self):
-        step = 0.001
+    def set_initial_values(self, step=0.001, velocity=30):
         counts = limit(int(step * self.counts_per_mm),
                        -self.counts_per_mm, self.counts_per_mm)
-        self.serial.write(b'\x45\x04\x06\x00\x91\x01\x01\x00' +
-                          struct.pack('<i', counts))
+        self._send(apt.pack_data(apt.MOT_SET_MOVERELPARAMS,
+                                 struct.pack('<Hi', 1, counts)),
+                   key='step_size')
         self._step_size = step
-        self.velocity = 30
-
-    def run(self):
-        self._running = True
-        while self._running:
-            event_type = None
-            data = None
-            if not self.connected:
-                time.sleep(0.1)
-                continue
-            packet = self.serial.read(6)
-            if len(packet) != 6:
-                continue
-            msg = packet[1::-1]  # first 2 bytes reversed
-
-            if msg == self.MSG_HOMED:
-                event_type = 'homed'
-                self.homed = True
-                data = True
-            elif msg == self.MSG_MOVE_COMPLETED:
-                event_type = 'move_completed'
-                response = self.serial.read(14)
-                data = struct.unpack('<i',
-                                     response[2:6])[0] / self.counts_per_mm
-                self._pos = data
-            elif msg == self.MSG_GET_POS:
-                event_type = 'pos'
-                response = self.serial.read(6)
-                data = struct.unpack('<i',
-                                     response[-4:])[0] / self.counts_per_mm
-                self._pos = data
-            elif msg == self.MSG_MOVE_STOP:
-                event_type = 'stop'
-                response = self.serial.read(14)
-                data = struct.unpack('<i',
-                                     response[2:6])[0] / self.counts_per_mm
-                self._pos = data
-            elif msg == self.MSG_GET_STEP_SIZE:
-                event_type = 'step_size'
-                data = struct.unpack('<i',
-                                     response[-4:])[0] / self.counts_per_mm
-                self._step_size = data
-
-            self.event.emit((event_type, data))
+        self.velocity = velocity
+        self.request_pos()
+        self._send(apt.pack(apt.HW_REQ_INFO))
+
+    def start(self):
+        """
+        Starts handling data received from the controller.
+        """
+        if not self.connected or self._started:
+            return
+        self._started = True
+        self.reactor.add_reader(self.serial.fileno(), self._on_readable)
+
+    def wait_ready(self, timeout=2.0):
+        """
+        Waits for the controller to answer the hardware info request sent on
+        connecting, which it does after the configuration sent before it.
+        Must be started.
+
+        Returns
+        -------
+        The controller's info, a dict from apt.unpack_info().
+        """
+        if not self._ready.wait(timeout if self.connected else 0):
+            raise IOError('No answer from controller on {}.'.format(
+                getattr(self.serial, 'port', None)
+                if self.connected else None))
+        return self.info
+
+    def reopen(self, port, timeout=2.0, serial_number=None):
+        """
+        Reopens a lost link on `port`, re-applies the step size and velocity
+        and waits for the controller to answer. A ('reconnected', info) event
+        follows the position reported on reconnecting. Blocks, so it must not
+        be called from the reactor thread.
+
+        Raises IOError if the port can't be opened, the controller doesn't
+        answer within `timeout` seconds, or it doesn't report
+        `serial_number`.
+        """
+        if self.connected:
+            return
+        self._ready.clear()
+        self._sent_velocity_params = None
+        try:
+            self.serial = serial.Serial(port, baudrate=115200, timeout=1)
+        except serial.SerialException as e:
+            raise IOError(str(e))
+        self.connected = True
+        self.set_initial_values(self._step_size or 0.001,
+                                self._velocity or 30)
+        self.start()
+        try:
+            info = self.wait_ready(timeout)
+            if (serial_number is not None and
+                    info['serial_number'] != serial_number):
+                raise IOError('Controller on {} is {}, not {}.'.format(
+                    port, info['serial_number'], serial_number))
+        except IOError:
+            self.reactor.call_blocking(self._drop)
+            raise
+        self.reactor.call_soon(self._emit, ('reconnected', info))
+
+    def _link_lost(self, reason):
+        if not self.connected:
+            return
+        self._drop()
+        self._emit(('disconnected', str(reason)))
+
+    def _drop(self):
+        """
+        Closes a failed link. Runs on the reactor thread.
+        """
+        self.connected = False
+        self._started = False
+        self._commands.clear()
+        self.moving = False
+        self._status_on = False
+        try:
+            self.reactor.remove_reader(self.serial.fileno())
+        except (OSError, serial.SerialException):
+            pass
+        try:
+            self.serial.close()
+        except (OSError, serial.SerialException):
+            pass
+
+    def _send(self, data, key=None, motion=False, urgent=False,
+              throttle=False, timing=None):
+        """
+        Queues an encoded command for the reactor thread to write. See
+        CommandQueue.put() for the arguments; `timing` is a TIMED_REPLIES
+        kind.
+        """
+        if not self.connected:
+            return
+        self._commands.put(data, key, motion, urgent, throttle, timing)
+        self.reactor.call_soon(self._flush)
+
+    def _flush(self):
+        """
+        Writes queued commands. Runs on the reactor thread.
+        """
+        if self._flush_timer is not None:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+        while self.connected:
+            command, delay = self._commands.pop()
+            if command is None:
+                if delay is not None:
+                    self._flush_timer = self.reactor.call_later(delay,
+                                                                self._flush)
+                return
+            self._write(command)
+
+    def _write(self, command):
+        try:
+            self.serial.write(command.data)
+        except (OSError, serial.SerialException) as e:
+            self._link_lost(e)
+            return
+        if self.recorder is not None:
+            self.recorder.record(self.record_stream, recorder.WRITE,
+                                 command.data)
+        if command.timing is not None and self.latency is not None:
+            reply = self.TIMED_REPLIES[command.timing]
+            self.latency.sent(self.axis, command.timing, reply,
+                              replace=reply != 'pos')
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.serial.fileno(), 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self._link_lost(e)
+            return
+        if not data:
+            # Readable but empty means the device has gone.
+            self._link_lost('device disconnected')
+            return
+        if self.recorder is not None:
+            self.recorder.record(self.record_stream, recorder.READ, data)
+        self.feed(data)
+
+    def record(self, log, stream=0):
+        """
+        Appends all traffic to `log`, a recorder.Recorder, as `stream`. None
+        stops recording.
+        """
+        self.recorder = log
+        self.record_stream = stream
+
+    def add_listener(self, callback):
+        """
+        Calls `callback((event_type, data))` for every event, on the thread
+        that received it.
+        """
+        self._listeners = self._listeners + [callback]
+
+    def remove_listener(self, callback):
+        self._listeners = [c for c in self._listeners if c != callback]
+
+    def feed(self, data):
+        """
+        Parses received bytes and emits an event for every complete message.
+        Unknown messages are skipped.
+        """
+        now = self.read_time = time.monotonic()
+        for frame in self._parser.feed(data):
+            handler = self._handlers.get(frame.msg_id)
+            if handler is not None:
+                event = handler(frame)
+                if self.latency is not None:
+                    if event[0] == 'stop':
+                        self.latency.discard(self.axis, 'move_completed')
+                    else:
+                        self.latency.received(self.axis, event[0], now)
+                self._emit(event)
+
+    def _emit(self, event):
+        for callback in self._listeners:
+            callback(event)
+
+    def _on_homed(self, frame):
+        # Homing resets the position counter, but the reply doesn't carry it.
+        self._pos = 0
+        self.homed = True
+        self._motion_finished()
+        return ('homed', True)
+
+    def _on_move_completed(self, frame):
+        self._pos = apt.unpack_position(frame.data)[1] / self.counts_per_mm
+        self._motion_finished()
+        return ('move_completed', self._pos)
+
+    def _on_pos(self, frame):
+        self._pos = apt.unpack_position(frame.data)[1] / self.counts_per_mm
+        return ('pos', self._pos)
+
+    def _on_stopped(self, frame):
+        self._pos = apt.unpack_position(frame.data)[1] / self.counts_per_mm
+        self._motion_finished()
+        return ('stop', self._pos)
+
+    def _on_info(self, frame):
+        self.info = apt.unpack_info(frame.data)
+        self._ready.set()
+        return ('info', self.info)
+
+    def _on_status(self, frame):
+        chan, counts, velocity, _, bits = struct.unpack('<HiHHI', frame.data)
+        self._pos = counts / self.counts_per_mm
+        self.status_bits = bits
+        now = time.monotonic()
+        self._status_time = now
+        if now - self._status_ack_time > self.STATUS_ACK_INTERVAL:
+            self._status_ack_time = now
+            self._send(apt.pack(apt.MOT_ACK_DCSTATUSUPDATE), key='ack')
+        return ('status', self._pos)
+
+    def _motion_started(self):
+        self.moving = True
+        if self.push_status and not self._status_on:
+            self.start_status()
+
+    def _motion_finished(self):
+        self.moving = False
+        if self._status_on:
+            self.stop_status()
+
+    def _on_step_size(self, frame):
+        counts = apt.unpack_position(frame.data)[1]
+        self._step_size = counts / self.counts_per_mm
+        return ('step_size', self._step_size)
 
     def home(self):
         """
@@ -291,49 +1408,118 @@ class ThorStepper(QtCore.QThread):
         """
         if not self.connected:
             return
-        self.serial.write(b'\x43\x04\x00\x00\x11\x01')
+        self.homed = False
+        self._send(apt.pack(apt.MOT_MOVE_HOME), motion=True, timing='home')
+        self._motion_started()
 
     def identify(self):
         if not self.connected:
             return
-        self.serial.write(b'\x23\x02\x00\x00\x11\x01')
+        self._send(apt.pack(apt.MOD_IDENTIFY))
 
     def step(self):
         if not self.connected:
             return
-        self.serial.write(b'\x48\x04\x01\x00\x11\x01')
+        self._send(apt.pack(apt.MOT_MOVE_RELATIVE, 1), motion=True,
+                   timing='step')
+        self._motion_started()
 
     def jog(self, direction):
         if not self.connected:
             return
         if direction == 'backward':
-            self.serial.write(b'\x6a\x04\x01\x01\x11\x01')
+            self._send(apt.pack(apt.MOT_MOVE_JOG, 1, 1), motion=True,
+                       timing='jog')
         else:
-            self.serial.write(b'\x6a\x04\x01\x02\x11\x01')
+            self._send(apt.pack(apt.MOT_MOVE_JOG, 1, 2), motion=True,
+                       timing='jog')
+        self._motion_started()
 
     def stop_move(self):
+        """
+        Decelerates to a stop. Sent ahead of, and drops, queued moves.
+        """
+        if not self.connected:
+            return
+        self._send(apt.pack(apt.MOT_MOVE_STOP, 1, 2), urgent=True)
+
+    def emergency_stop(self):
+        """
+        Stops immediately. Sent ahead of, and drops, queued moves.
+        """
         if not self.connected:
             return
-        self.serial.write(b'\x65\x04\x01\x02\x11\x01')
+        self._send(apt.pack(apt.MOT_MOVE_STOP, 1, 1), urgent=True)
 
     def start_move(self, direction):
         if not self.connected:
             return
         if direction == 'backward':
-            self.serial.write(b'\x57\x04\x01\x01\x11\x01')
+            self._send(apt.pack(apt.MOT_MOVE_VELOCITY, 1, 1), motion=True)
         else:
-            self.serial.write(b'\x57\x04\x01\x02\x11\x01')
+            self._send(apt.pack(apt.MOT_MOVE_VELOCITY, 1, 2), motion=True)
+        self._motion_started()
 
     def start_status(self):
-        self.serial.write(b'\x11\x00\x01\x00\x11\x01')
+        """
+        Asks the controller to push status updates.
+        """
+        if not self.connected:
+            return
+        self._status_on = True
+        self._status_requested = time.monotonic()
+        self._send(apt.pack(apt.HW_START_UPDATEMSGS, 1))
 
     def stop_status(self):
-        self.serial.write(b'\x12\x00\x00\x00\x11\x01')
+        if not self.connected:
+            return
+        self._status_on = False
+        self._send(apt.pack(apt.HW_STOP_UPDATEMSGS))
 
     def update(self):
+        """
+        Requests the position if the controller isn't pushing status updates
+        while moving. Controllers that don't push are also polled slowly when
+        idle.
+
+        Returns
+        -------
+        Seconds until update() should be called again.
+        """
+        if not self.connected:
+            return self.POLL_IDLE
+        if self._status_on:
+            now = time.monotonic()
+            if now - self._status_time < self.STATUS_TIMEOUT:
+                return self.POLL_PUSHING
+            if self._status_time < self._status_requested:
+                if now - self._status_requested < self.STATUS_TIMEOUT:
+                    return self.STATUS_TIMEOUT
+                # No update since the request: the controller doesn't push.
+                self.push_status = False
+                self.stop_status()
+        elif self.push_status and not self.moving:
+            return self.POLL_IDLE
+        self.request_pos()
+        return self.POLL_MOVING if self.moving else self.POLL_IDLE
+
+    def request_status(self):
+        """
+        Asks the controller for its status, reported as a 'status' event.
+        """
+        if not self.connected:
+            return
+        self._send(apt.pack(apt.MOT_REQ_DCSTATUSUPDATE, 1),
+                   key='request_status')
+
+    def request_pos(self):
+        """
+        Asks the controller for the position, reported as a 'pos' event.
+        """
         if not self.connected:
             return
-        self.serial.write(b'\x11\x04\x01\x00\x11\x01')  # request pos
+        self._send(apt.pack(apt.MOT_REQ_POSCOUNTER, 1), key='request_pos',
+                   timing='pos')
 
     @property
     def pos(self):
@@ -347,13 +1533,21 @@ class ThorStepper(QtCore.QThread):
         """
         Moves stage to a new position given in mm.
         """
+        self.move_absolute(new_pos)
+
+    def move_absolute(self, new_pos, timing='move'):
+        """
+        Moves stage to a new position given in mm. `timing` is the kind the
+        move's latency is recorded under.
+        """
         if not self.connected:
             return None
-        self.serial.flushInput()
         counts = int(limit(new_pos*self.counts_per_mm,
-                           0, 12*self.counts_per_mm))
-        self.serial.write(b'\x53\x04\x06\x00\x91\x01\x01\x00' +
-                          struct.pack('<i', counts))
+                           0, self.travel*self.counts_per_mm))
+        self._send(apt.pack_data(apt.MOT_MOVE_ABSOLUTE,
+                                 struct.pack('<Hi', 1, counts)),
+                   key='target', motion=True, timing=timing)
+        self._motion_started()
 
     @property
     def step_size(self):
@@ -374,12 +1568,13 @@ class ThorStepper(QtCore.QThread):
         self._step_size = step
         counts = limit(int(step * self.counts_per_mm),
                        -self.counts_per_mm, self.counts_per_mm)
-        self.serial.write(b'\x45\x04\x06\x00\x91\x01\x01\x00' +
-                          struct.pack('<i', counts))
+        self._send(apt.pack_data(apt.MOT_SET_MOVERELPARAMS,
+                                 struct.pack('<Hi', 1, counts)),
+                   key='step_size', throttle=True)
 
     @property
     def velocity(self):
-        return self._v
+        return self._velocity
 
     @velocity.setter
     def velocity(self, val):
@@ -387,18 +1582,45 @@ class ThorStepper(QtCore.QThread):
         val : float
             Velocity in mm/s
         """
+        self.set_velocity_params(val, self.acceleration)
+
+    def set_velocity_params(self, velocity, acceleration):
+        """
+        Sets the maximum velocity in mm/s and acceleration in mm/s^2. Nothing
+        is sent if they are unchanged.
+        """
         if not self.connected:
             return None
-        v = struct.pack('<L', int(val * self.counts_per_mm))
-        self.serial.write(b'\x13\x04\x0E\x00\x91\x01\x01\x00' +
-                          struct.pack('<L', 0) + struct.pack('<L', 180000) + v)
+        self._velocity = velocity
+        self.acceleration = acceleration
+        v = int(velocity * self.counts_per_mm)
+        a = round(acceleration * self.counts_per_mm)
+        if (v, a) == self._sent_velocity_params:
+            return
+        self._sent_velocity_params = (v, a)
+        self._send(apt.pack_data(apt.MOT_SET_VELPARAMS,
+                                 struct.pack('<HLLL', 1, 0, a, v)),
+                   key='velocity', throttle=True)
 
     def stop(self, wait=False):
-        self._running = False
+        """
+        Writes any queued commands, stops handling received data and closes
+        the port. No events are emitted once this returns; `wait` is accepted
+        for compatibility.
+        """
+        if hasattr(self, 'serial'):
+            self.reactor.call_blocking(self._close)
+        self.connected = False
+
+    def _close(self):
+        while self.connected:
+            command, delay = self._commands.pop(now=float('inf'))
+            if command is None:
+                break
+            self._write(command)
         self.connected = False
         try:
+            self.reactor.remove_reader(self.serial.fileno())
             self.serial.close()
-        except AttributeError:
+        except serial.SerialException:
             pass
-        if wait:
-            self.wait()
@@ -0,0 +1,136 @@
+"""
+Fixtures running the stage against simulated controllers.
+"""
+
+import os
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import connection  # noqa: E402
+from simulator import TDC001Simulator  # noqa: E402
+from stepper import XYStage  # noqa: E402
+
+COUNTS_PER_MM = 34304
+# Positions within one encoder count are the same.
+COUNT = 1 / COUNTS_PER_MM
+
+
+@pytest.fixture
+def make_sim():
+    """
+    Returns a function that starts a TDC001Simulator, with the position in mm
+    and otherwise the same arguments, stopped after the test.
+    """
+    sims = []
+
+    def make(position=0, **kwargs):
+        sim = TDC001Simulator(position=int(position * COUNTS_PER_MM),
+                              **kwargs)
+        sim.start()
+        sims.append(sim)
+        return sim
+
+    yield make
+    for sim in sims:
+        sim.stop()
+
+
+@pytest.fixture
+def make_motor(make_sim):
+    """
+    Returns a function that makes a started ThorStepper on a new simulator,
+    as (motor, simulator).
+    """
+    motors = []
+
+    def make(**kwargs):
+        sim = make_sim(**kwargs)
+        motor = connection.open_motor(sim.port)
+        motors.append(motor)
+        return motor, sim
+
+    yield make
+    for motor in motors:
+        motor.stop()
+
+
+@pytest.fixture
+def make_stage(make_sim):
+    """
+    Returns a function that makes an XYStage on two new simulators, as
+    (stage, x simulator, y simulator). `position` is the (x, y) start in mm,
+    and `latency`, `backlash`, `noise_rate` and `status_updates` go to both
+    simulators. Other keyword arguments go to the stage.
+    """
+    stages = []
+
+    def make(position=(0, 0), latency=0.0, backlash=0, noise_rate=0.0,
+             status_updates=True, **kwargs):
+        sims = [make_sim(position=p, serial_number=n, latency=latency,
+                         backlash=backlash, noise_rate=noise_rate, seed=n,
+                         status_updates=status_updates)
+                for n, p in zip((1, 2), position)]
+        stage = XYStage('1', '2', ports=[sim.port for sim in sims], **kwargs)
+        stages.append(stage)
+        return (stage,) + tuple(sims)
+
+    yield make
+    for stage in stages:
+        stage.stop()
+
+
+def wait_for(source, match, action=None, timeout=10):
+    """
+    Calls `action` and waits until `source`, a motor or stage, emits an
+    event for which `match(event)` is true. Returns the event.
+    """
+    done = threading.Event()
+    found = []
+
+    def on_event(event):
+        if not done.is_set() and match(event):
+            found.append(event)
+            done.set()
+
+    source.add_listener(on_event)
+    try:
+        if action is not None:
+            action()
+        if not done.wait(timeout):
+            raise TimeoutError('No matching event.')
+    finally:
+        source.remove_listener(on_event)
+    return found[0]
+
+
+def record_commands(motor):
+    """
+    Records the moves sent to `motor` as (target, velocity, acceleration)
+    tuples in the returned list.
+    """
+    commands = []
+    move_absolute = motor.move_absolute
+
+    def record(pos, *args, **kwargs):
+        commands.append((pos, motor.velocity, motor.acceleration))
+        return move_absolute(pos, *args, **kwargs)
+
+    motor.move_absolute = record
+    return commands
+
+
+def wait_until(predicate, timeout=10):
+    """
+    Waits until `predicate()` is true.
+    """
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise TimeoutError('Condition not met.')
+        time.sleep(0.01)
@@ -0,0 +1,56 @@
+"""
+Tests of APT frame parsing.
+"""
+
+import struct
+
+import pytest
+
+import apt
+from conftest import COUNT
+
+
+def host_frame(msg_id, data=None):
+    if data is None:
+        return apt.pack(msg_id, dest=apt.HOST, source=apt.USB_UNIT)
+    return apt.pack_data(msg_id, data, dest=apt.HOST, source=apt.USB_UNIT)
+
+
+FRAMES = [host_frame(apt.MOT_MOVE_HOMED),
+          host_frame(apt.MOT_GET_POSCOUNTER, struct.pack('<Hi', 1, 1234)),
+          host_frame(apt.MOT_MOVE_STOPPED, bytes(14))]
+
+
+@pytest.mark.parametrize('chunk', [1, 5, 1000])
+def test_parser_splits_frames_across_chunks(chunk):
+    data = b''.join(FRAMES)
+    parser = apt.FrameParser()
+    received = []
+    for i in range(0, len(data), chunk):
+        received += parser.feed(data[i:i + chunk])
+    assert [f.msg_id for f in received] == [apt.MOT_MOVE_HOMED,
+                                            apt.MOT_GET_POSCOUNTER,
+                                            apt.MOT_MOVE_STOPPED]
+    assert apt.unpack_position(received[1].data)[1] == 1234
+    assert parser.discarded == 0
+
+
+def test_parser_resyncs_after_noise():
+    noise = b'\xff\xfe\x00\x00\xaa'
+    data = (noise + FRAMES[0] + noise + FRAMES[1] + noise[:3] + FRAMES[2])
+    parser = apt.FrameParser()
+    received = []
+    for i in range(len(data)):
+        received += parser.feed(data[i:i + 1])
+    assert [f.msg_id for f in received] == [apt.MOT_MOVE_HOMED,
+                                            apt.MOT_GET_POSCOUNTER,
+                                            apt.MOT_MOVE_STOPPED]
+    assert parser.discarded == 2 * len(noise) + 3
+
+
+def test_moves_through_line_noise(make_stage):
+    stage, x, y = make_stage(noise_rate=0.3)
+    for target in [(1, 2), (3, 0.5), (0.5, 1.5)]:
+        stage.move_to(*target).result(10)
+        assert stage.pos == pytest.approx(target, abs=COUNT)
+    assert stage.x_motor._parser.discarded > 0
@@ -0,0 +1,58 @@
+"""
+Tests of the settled and lead callbacks.
+"""
+
+import pytest
+
+from conftest import COUNT
+
+
+def test_settled_callback_runs_first(make_stage):
+    stage, x, y = make_stage()
+    calls = []
+    stage.add_listener(lambda e: e[1] == 'settled' and
+                       calls.append(('listener', e[2])))
+    stage.add_settled_callback(
+        lambda t, pos: calls.append(('callback', t, pos)))
+    t = stage.move_to(1, 0.5).result(10)
+    assert calls[0] == ('callback', t, pytest.approx((1, 0.5), abs=COUNT))
+    assert calls[1] == ('listener', t)
+
+
+def test_lead_callback_before_arrival(make_stage):
+    stage, x, y = make_stage()
+    calls = []
+    stage.add_settled_callback(lambda t, pos: calls.append(('settled', t)))
+    stage.add_lead_callback(
+        lambda arrival, target: calls.append(('lead', arrival, target)),
+        0.1)
+    future = stage.move_to(2, 1)
+    predicted = stage.predicted_arrival
+    future.result(10)
+    assert calls[0] == ('lead', predicted, (2, 1))
+    assert calls[1][0] == 'settled'
+
+
+def test_lead_callback_skips_superseded_move(make_stage):
+    stage, x, y = make_stage()
+    targets = []
+    stage.add_lead_callback(lambda arrival, target: targets.append(target),
+                            0.1)
+    stage.move_to(2, 1)
+    stage.move_to(1, 2).result(10)
+    assert targets == [(1, 2)]
+
+
+def test_removed_callbacks_arent_called(make_stage):
+    stage, x, y = make_stage()
+    calls = []
+
+    def callback(*args):
+        calls.append(args)
+
+    stage.add_settled_callback(callback)
+    stage.add_lead_callback(callback, 0.1)
+    stage.remove_settled_callback(callback)
+    stage.remove_lead_callback(callback)
+    stage.move_to(1, 1).result(10)
+    assert calls == []
@@ -0,0 +1,51 @@
+"""
+Tests of the outbound command queue.
+"""
+
+from commands import CommandQueue
+
+
+def drain(queue, now=0):
+    """
+    Returns the data of every command the queue writes at `now`.
+    """
+    written = []
+    while True:
+        command, delay = queue.pop(now)
+        if command is None:
+            return written
+        written.append(command.data)
+
+
+def test_keyed_command_replaces_queued_one():
+    queue = CommandQueue()
+    queue.put(b'velocity 1', key='velocity')
+    queue.put(b'home')
+    queue.put(b'velocity 2', key='velocity')
+    queue.put(b'move 1', key='move', motion=True)
+    queue.put(b'move 2', key='move', motion=True)
+    assert drain(queue) == [b'home', b'velocity 2', b'move 2']
+
+
+def test_urgent_command_goes_first_and_drops_motion():
+    queue = CommandQueue()
+    queue.put(b'velocity', key='velocity')
+    queue.put(b'move', key='move', motion=True)
+    queue.put(b'jog', motion=True)
+    queue.put(b'stop', urgent=True)
+    assert drain(queue) == [b'stop', b'velocity']
+
+
+def test_throttled_command_waits_only_while_last():
+    queue = CommandQueue(min_interval=0.05)
+    queue.put(b'velocity 1', key='velocity', throttle=True)
+    assert drain(queue, now=1) == [b'velocity 1']
+    queue.put(b'velocity 2', key='velocity', throttle=True)
+    command, delay = queue.pop(now=1.02)
+    assert command is None and abs(delay - 0.03) < 1e-9
+    # A command queued behind it isn't held up.
+    queue.put(b'move', key='move')
+    assert drain(queue, now=1.02) == [b'velocity 2', b'move']
+    queue.put(b'velocity 3', key='velocity', throttle=True)
+    assert drain(queue, now=1.07) == [b'velocity 3']
+    assert queue.pop(now=2) == (None, None)
@@ -0,0 +1,61 @@
+"""
+Tests of finding controllers by serial number.
+"""
+
+import connection
+
+
+def make_cache(tmp_path, monkeypatch, by_id=False, comports=()):
+    """
+    Returns a PortCache saved under `tmp_path`, where udev links give
+    `by_id` and serial ports are the (port, description, hwid) `comports`.
+    """
+    monkeypatch.setattr(connection.list_ports, 'comports',
+                        lambda: list(comports))
+    cache = connection.PortCache(str(tmp_path / 'cache' / 'ports.json'))
+    monkeypatch.setattr(cache, '_by_id', lambda serial_number: by_id)
+    return cache
+
+
+def test_find_scans_ports_and_saves(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, comports=[
+        ('/dev/ttyUSB0', 'APT', 'USB VID:PID=0403:FAF0 SER=83000001'),
+        ('/dev/ttyUSB1', 'APT', 'USB VID:PID=0403:FAF0 SER=83000002')])
+    assert cache.find('83000002') == '/dev/ttyUSB1'
+    assert cache.find('83000003') is None
+    reloaded = connection.PortCache(cache.path)
+    assert reloaded.ports == {'83000002': '/dev/ttyUSB1'}
+
+
+def test_find_prefers_udev_link(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, by_id='/dev/ttyUSB3', comports=[
+        ('/dev/ttyUSB0', 'APT', 'SER=83000001')])
+    assert cache.find('83000001') == '/dev/ttyUSB3'
+    assert cache.ports == {'83000001': '/dev/ttyUSB3'}
+
+
+def test_find_uses_cached_port_that_exists(tmp_path, monkeypatch):
+    port = tmp_path / 'ttyUSB5'
+    port.touch()
+    cache = make_cache(tmp_path, monkeypatch, comports=[
+        ('/dev/ttyUSB0', 'APT', 'SER=83000001')])
+    cache.ports['83000001'] = str(port)
+    assert cache.find('83000001') == str(port)
+    assert cache.find('83000001', rescan=True) == '/dev/ttyUSB0'
+    port.unlink()
+    cache.ports['83000001'] = str(port)
+    assert cache.find('83000001') == '/dev/ttyUSB0'
+
+
+def test_forget_drops_unplugged_controller(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch)
+    cache.ports['83000001'] = '/dev/ttyUSB0'
+    cache.save()
+    assert cache.find('83000001') is None
+    assert connection.PortCache(cache.path).ports == {}
+
+
+def test_unreadable_cache_starts_empty(tmp_path):
+    path = tmp_path / 'ports.json'
+    path.write_text('{not json')
+    assert connection.PortCache(str(path)).ports == {}
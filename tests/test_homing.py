@@ -0,0 +1,56 @@
+"""
+Tests of homing and resuming from saved state.
+"""
+
+import pytest
+
+from conftest import COUNT, COUNTS_PER_MM, record_commands, wait_for
+from stepper import XYStage
+
+
+def home(stage, **kwargs):
+    """
+    Homes `stage` and waits until it has settled at the center.
+    """
+    wait_for(stage, lambda e: e[1] == 'settled',
+             lambda: stage.home(center=True, **kwargs), timeout=20)
+
+
+def test_home_centers_once_homed(make_stage):
+    stage, x, y = make_stage(position=(3, 5), backlash_comp=(0.1, 0.1))
+    x_commands = record_commands(stage.x_motor)
+    home(stage, center_pos=(2, None))
+    assert x.homed and y.homed and stage.homed
+    assert stage.pos == pytest.approx((2, 0), abs=COUNT)
+    assert (x.position, y.position) == (2 * COUNTS_PER_MM, 0)
+    # The center move is planned like any other.
+    assert [pos for pos, _, _ in x_commands] == [2]
+
+
+def test_restore_state(make_stage, tmp_path):
+    path = str(tmp_path / 'state.json')
+    stage, x, y = make_stage(position=(3, 5), state_path=path)
+    home(stage)
+    stage.move_to(1.5, 2.5).result(10)
+    stage.zero()
+    stage.stop()
+
+    def reopen():
+        return XYStage('1', '2', ports=(x.port, y.port), state_path=path)
+
+    stage = reopen()
+    try:
+        assert stage.restore_state()
+        assert stage.homed
+        assert stage.pos == pytest.approx((0, 0), abs=COUNT)
+        assert stage.zero_pos == pytest.approx((1.5, 2.5), abs=COUNT)
+    finally:
+        stage.stop()
+
+    # Power cycling loses the home position.
+    x.homed = False
+    stage = reopen()
+    try:
+        assert not stage.restore_state()
+    finally:
+        stage.stop()
@@ -0,0 +1,54 @@
+"""
+Tests of latency and settle measurement.
+"""
+
+import pytest
+
+from latency import LatencyHistogram, LatencyTracker
+
+
+def test_histogram_percentiles():
+    histogram = LatencyHistogram()
+    for i in range(1, 101):
+        histogram.add(i / 1000)
+    assert histogram.count == 100
+    assert histogram.mean == pytest.approx(0.0505)
+    assert (histogram.min, histogram.max) == (0.001, 0.1)
+    assert histogram.percentile(50) == pytest.approx(0.05, rel=0.12)
+    assert histogram.percentile(90) == pytest.approx(0.09, rel=0.12)
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_replies_match_oldest_request():
+    tracker = LatencyTracker()
+    tracker.sent('x', 'pos', 'pos', t=0)
+    tracker.sent('x', 'pos', 'pos', t=1)
+    assert tracker.received('x', 'pos', t=1.5) == 1.5
+    assert tracker.received('x', 'pos', t=1.5) == 0.5
+    assert tracker.received('x', 'pos', t=2) is None
+
+
+def test_new_move_replaces_outstanding_one():
+    tracker = LatencyTracker()
+    tracker.sent('x', 'move', 'move_completed', t=0, replace=True)
+    tracker.sent('x', 'move', 'move_completed', t=1, replace=True)
+    assert tracker.received('x', 'move_completed', t=3) == 2
+    assert tracker.histogram('x', 'move').count == 1
+
+
+def test_lost_reply_is_dropped():
+    tracker = LatencyTracker(timeout=1)
+    tracker.sent('x', 'pos', 'pos', t=0)
+    # The reply to the first request never comes.
+    tracker.sent('x', 'pos', 'pos', t=10)
+    assert tracker.received('x', 'pos', t=10.02) == pytest.approx(0.02)
+    tracker.sent('x', 'pos', 'pos', t=20)
+    assert tracker.received('x', 'pos', t=21.5) is None
+    assert tracker.lost[('x', 'pos')] == 2
+    assert tracker.histogram('x', 'pos').max == pytest.approx(0.02)
+
+
+def test_long_move_isnt_dropped():
+    tracker = LatencyTracker(timeout=1)
+    tracker.sent('x', 'home', 'homed', t=0, replace=True)
+    assert tracker.received('x', 'homed', t=30) == 30
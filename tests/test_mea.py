@@ -0,0 +1,45 @@
+"""
+Tests of MEA layouts.
+"""
+
+import random
+
+import numpy as np
+import pytest
+
+import mea
+
+
+@pytest.mark.parametrize('layout', [
+    mea.MEA_120, mea.grid_layout('4096', 64, 64, 42),
+    mea.grid_layout('sparse', 16, 16, 200, skip=('a1', 'h8', 'r16'))])
+def test_layout_nearest_matches_brute_force(layout):
+    rng = random.Random(1)
+    left, top, right, bottom = layout.bounds
+    for margin, n in ((3, 500), (30, 500), (3000, 50)):
+        margin *= layout.pitch
+        for _ in range(n):
+            p = (rng.uniform(left - margin, right + margin),
+                 rng.uniform(top - margin, bottom + margin))
+            distances = ((layout.positions - p)**2).sum(axis=1)
+            nearest = layout.nearest(p)
+            assert distances[layout.tags.index(nearest)] == distances.min()
+
+
+def test_layout_nearest_far_outside():
+    layout = mea.MEA_120
+    left, top, right, bottom = layout.bounds
+    assert layout.nearest((left - 1000, (top + bottom) / 2)) is not None
+    assert layout.nearest((right + 1e7, bottom + 1e7)) == layout.nearest(
+        (right, bottom))
+
+
+def test_layout_stage_transform():
+    layout = mea.MEA_120
+    assert layout.stage_position(layout.position('a4')) == (0, 0)
+    assert layout.stage_position((100, 500)) == pytest.approx((-0.1, -0.2))
+    for p in [(0, 0), (350, 1100)]:
+        assert layout.stage_layout_position(
+            layout.stage_position(p)) == pytest.approx(p)
+    assert np.allclose(layout.positions[layout.tags.index('m9')],
+                       (1100, 800))
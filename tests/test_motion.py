@@ -0,0 +1,72 @@
+"""
+Tests of move timing and the motion planner.
+"""
+
+import pytest
+
+import motion
+
+
+def test_move_position_inverts_move_elapsed():
+    for distance in (-3, 0.01, 0.5, 12):
+        total = motion.move_time(distance, 30, 5)
+        for i in range(11):
+            t = total * i / 10
+            covered = motion.move_position(distance, 30, 5, t)
+            assert motion.move_elapsed(distance, 30, 5, covered) == \
+                pytest.approx(t, abs=1e-9)
+        assert motion.move_position(distance, 30, 5, total) == distance
+
+
+def test_plan_uses_the_limits_without_a_penalty():
+    planner = motion.MotionPlanner(max_velocity=2, max_acceleration=4,
+                                   settle_time=0.1)
+    profile = planner.plan(-3)
+    assert profile == (2, 4, motion.move_time(3, 2, 4) + 0.1)
+
+
+def test_plan_minimises_time_to_settle():
+    planner = motion.MotionPlanner(max_velocity=2, max_acceleration=8,
+                                   min_acceleration=0.5,
+                                   settle_per_acceleration=0.05)
+    for distance in (0.01, 0.2, 1, 6):
+        profile = planner.plan(distance)
+        best = min(planner._time(distance, 0.5 + i * 7.5 / 1000)
+                   for i in range(1001))
+        assert 0.5 <= profile.acceleration < 8
+        assert profile.duration == pytest.approx(best, abs=1e-4)
+        assert profile.duration <= best
+
+
+def test_plan_keeps_current_params_when_cruise_isnt_reached():
+    planner = motion.MotionPlanner(max_velocity=30, max_acceleration=5)
+    # Peak velocity over 0.2 mm is 1 mm/s.
+    assert planner.plan(0.2, current=(10, 5)).velocity == 10
+    assert planner.plan(0.2, current=(0.5, 5)).velocity == 30
+    assert planner.plan(0.2, current=(10, 4)).velocity == 30
+    assert planner.plan(0.2, current=(10, 5)).duration == \
+        planner.plan(0.2).duration
+
+
+def test_predict_sums_the_moves():
+    planner = motion.MotionPlanner(settle_time=0.1)
+    assert planner.predict([]) == 0
+    assert planner.predict([1, -0.2]) == pytest.approx(
+        planner.plan(1).duration + planner.plan(0.2).duration)
+
+
+def test_velocity_params_sent_only_when_changed(make_motor):
+    motor, sim = make_motor()
+    keys = []
+    send = motor._send
+
+    def record(data, key=None, *args, **kwargs):
+        keys.append(key)
+        return send(data, key, *args, **kwargs)
+
+    motor._send = record
+    motor.set_velocity_params(2, 3)
+    motor.set_velocity_params(2, 3)
+    assert keys == ['velocity']
+    motor.set_velocity_params(2, 4)
+    assert keys == ['velocity', 'velocity']
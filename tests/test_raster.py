@@ -0,0 +1,24 @@
+"""
+Tests of continuous raster scans.
+"""
+
+import pytest
+
+from raster import Raster
+
+
+def test_raster_reports_every_crossing(make_stage):
+    stage, x, y = make_stage(position=(0.5, 0.5))
+    reported = []
+    scan = Raster(stage, [1.5, 1, 2], [1, 1.5], velocity=2,
+                  on_crossing=lambda *crossing: reported.append(crossing))
+    crossed = scan.run()
+    assert crossed == reported
+    assert [(row, pos) for row, pos, t in crossed] == [
+        (0, 1), (0, 1.5), (0, 2), (1, 2), (1, 1.5), (1, 1)]
+    # Crossings 0.5 mm apart at 2 mm/s.
+    for row in (crossed[:3], crossed[3:]):
+        times = [t for _, _, t in row]
+        assert [b - a for a, b in zip(times, times[1:])] == pytest.approx(
+            [0.25, 0.25], abs=0.02)
+    assert crossed[3][2] > crossed[2][2]
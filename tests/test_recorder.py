@@ -0,0 +1,33 @@
+"""
+Tests of serial traffic recording and replay.
+"""
+
+import pytest
+
+import recorder
+from conftest import COUNT
+from stepper import ThorStepper
+
+
+def test_recorder_round_trip(make_stage, tmp_path):
+    path = str(tmp_path / 'traffic.log')
+    stage, x, y = make_stage()
+    stage.record(path)
+    stage.move_to(2, 1).result(10)
+    stage.move_to(0.5, 3).result(10)
+    stage.stop_recording()
+
+    writes = []
+    motors = {0: ThorStepper(connect=False), 1: ThorStepper(connect=False)}
+    stats = recorder.replay(path, motors,
+                            on_write=lambda s, data: writes.append(s))
+    assert stats['records'] > 0
+    assert {0, 1} <= set(writes)
+    assert (motors[0].pos, motors[1].pos) == pytest.approx((0.5, 3),
+                                                           abs=COUNT)
+
+    # A record cut short is dropped, the ones before it are kept.
+    records = list(recorder.read_log(path))
+    with open(path, 'ab') as f:
+        f.write(recorder.RECORD.pack(0, 0, recorder.READ, 10) + b'abc')
+    assert list(recorder.read_log(path)) == records
@@ -0,0 +1,43 @@
+"""
+Tests of recovering from a controller's link dropping.
+"""
+
+import pytest
+
+from conftest import COUNT, wait_for
+
+
+def supervise(stage, x, y):
+    """
+    Lets the stage's supervisor find the simulators and retry quickly.
+    """
+    sims = {'1': x, '2': y}
+    # A replugged simulator has a new port.
+    stage.supervisor.find_port = lambda serial_number: sims[serial_number].port
+    stage.supervisor.retry_interval = 0.05
+
+
+def test_replug_reissues_move(make_stage):
+    stage, x, y = make_stage()
+    supervise(stage, x, y)
+    events = []
+    stage.add_listener(lambda e: events.append(e[1]))
+    future = stage.move_to(5, 3)
+    wait_for(stage, lambda e: e[:2] == ('x', 'status'))
+    x.replug()
+    future.result(10)
+    assert stage.pos == pytest.approx((5, 3), abs=COUNT)
+    for event_type in ('disconnected', 'reconnected', 'move_reissued'):
+        assert event_type in events
+
+
+def test_replug_after_power_loss_fails_move(make_stage):
+    stage, x, y = make_stage()
+    supervise(stage, x, y)
+    stage.x_motor.homed = True
+    future = stage.move_to(1, 1)
+    wait_for(stage, lambda e: e[:2] == ('x', 'status'))
+    x.homed = False
+    x.replug()
+    with pytest.raises(IOError):
+        future.result(10)
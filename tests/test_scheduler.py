@@ -0,0 +1,73 @@
+"""
+Tests of visit order planning.
+"""
+
+import itertools
+import math
+import random
+
+import pytest
+
+import motion
+import scheduler
+
+
+def distance(a, b):
+    return math.hypot(b[0] - a[0], b[1] - a[1])
+
+
+def test_travel_time_charges_overshoot_against_direction():
+    planner = motion.MotionPlanner()
+    cost = scheduler.travel_time(planner, overshoot=(0.2, 0.3))
+    assert cost((0, 0), (1, 0)) == planner.plan(1).duration
+    assert cost((1, 0), (0, 0)) == pytest.approx(
+        planner.plan(1.2).duration + planner.plan(0.2).duration)
+    # The slower axis sets the cost.
+    assert cost((0, 1), (1, 0)) == pytest.approx(
+        planner.plan(1.3).duration + planner.plan(0.3).duration)
+    assert cost((0, 0), (0, 0)) == 0
+
+
+def test_order_visits_every_target_once():
+    rng = random.Random(1)
+    targets = [(rng.uniform(0, 5), rng.uniform(0, 5)) for _ in range(40)]
+    order = scheduler.plan_visit_order(targets, distance, start=(0, 0))
+    assert sorted(order) == list(range(40))
+    assert scheduler.plan_visit_order([], distance) == []
+    assert scheduler.plan_visit_order([(1, 1)], distance) == [0]
+
+
+def test_order_on_a_line_is_sorted():
+    targets = [(x, 0) for x in (3, 0, 5, 1, 4, 2)]
+    order = scheduler.plan_visit_order(targets, distance, start=(-1, 0))
+    assert [targets[i][0] for i in order] == [0, 1, 2, 3, 4, 5]
+
+
+def test_order_leaves_no_improving_reversal():
+    rng = random.Random(2)
+    targets = [(rng.uniform(0, 5), rng.uniform(0, 5)) for _ in range(30)]
+    cost = scheduler.travel_time(overshoot=(0.2, 0.2))
+    start = (0, 0)
+    order = scheduler.plan_visit_order(targets, cost, start=start)
+    total = scheduler.order_cost(targets, order, cost, start)
+    for i, j in itertools.combinations(range(len(order) + 1), 2):
+        reversed_order = order[:i] + order[i:j][::-1] + order[j:]
+        assert scheduler.order_cost(targets, reversed_order, cost,
+                                    start) >= total - 1e-9
+
+
+def test_order_improves_on_nearest_neighbour():
+    rng = random.Random(3)
+    targets = [(rng.uniform(0, 5), rng.uniform(0, 5)) for _ in range(40)]
+    start = (0, 0)
+    nearest = []
+    position = start
+    remaining = set(range(len(targets)))
+    while remaining:
+        i = min(remaining, key=lambda i: distance(position, targets[i]))
+        nearest.append(i)
+        remaining.remove(i)
+        position = targets[i]
+    order = scheduler.plan_visit_order(targets, distance, start=start)
+    assert scheduler.order_cost(targets, order, distance, start) < \
+        scheduler.order_cost(targets, nearest, distance, start)
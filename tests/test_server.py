@@ -0,0 +1,56 @@
+"""
+Tests of the control server and client.
+"""
+
+import socket
+import time
+
+import pytest
+
+import server
+
+
+@pytest.fixture
+def control(make_stage):
+    """
+    Returns (stage, server) with the server listening on a free port.
+    """
+    stage, x, y = make_stage()
+    srv = server.ControlServer(stage, ('127.0.0.1', 0))
+    yield stage, srv
+    srv.close()
+
+
+def test_client_pipelining(control):
+    stage, srv = control
+    client = server.ControlClient(srv.address)
+    try:
+        stage.move_to(1, 2).result(10)
+        futures = [client.submit('pos') for _ in range(200)]
+        futures.append(client.submit('ping'))
+        results = [f.result(5) for f in futures]
+        assert results[:-1] == [pytest.approx([1, 2], abs=1e-4)] * 200
+        assert results[-1] is None
+        t, pos = client.move_to(0.5, 0.5)
+        assert t <= time.monotonic()
+        assert pos == pytest.approx((0.5, 0.5), abs=1e-4)
+        with pytest.raises(IOError):
+            client.call('bogus')
+    finally:
+        client.close()
+
+
+def test_server_answers_every_line(control):
+    stage, srv = control
+    sock = socket.create_connection(srv.address)
+    try:
+        sock.sendall(b'"x"\n[1]\nnot json\n{"id": 99, "op": "ping"}\n')
+        sock.settimeout(5)
+        received = b''
+        while received.count(b'\n') < 4:
+            received += sock.recv(65536)
+        replies = received.decode().splitlines()
+        assert all('"error"' in line for line in replies[:3])
+        assert replies[3] == '{"id":99,"result":null}'
+    finally:
+        sock.close()
@@ -0,0 +1,47 @@
+"""
+Tests of the simulated controller.
+"""
+
+import pytest
+
+from conftest import COUNT, COUNTS_PER_MM, wait_for
+
+
+def test_reports_hardware_info(make_motor):
+    motor, sim = make_motor(serial_number=83812345)
+    assert motor.info['serial_number'] == 83812345
+
+
+def test_moves_to_commanded_position(make_motor):
+    motor, sim = make_motor(position=1)
+    event = wait_for(motor, lambda e: e[0] == 'move_completed',
+                     lambda: motor.move_absolute(2.5))
+    assert event[1] == pytest.approx(2.5, abs=COUNT)
+    assert sim.position == int(2.5 * COUNTS_PER_MM)
+
+
+def test_replug_keeps_position(make_motor):
+    motor, sim = make_motor(position=3)
+    wait_for(motor, lambda e: e[0] == 'disconnected', sim.replug)
+    motor.reopen(sim.port)
+    event = wait_for(motor, lambda e: e[0] == 'pos', motor.request_pos)
+    assert event[1] == pytest.approx(3, abs=COUNT)
+
+
+def test_backlash_trails_the_motor(make_motor):
+    motor, sim = make_motor(position=2, backlash=0.01)
+    wait_for(motor, lambda e: e[0] == 'move_completed',
+             lambda: motor.move_absolute(3))
+    up = sim.position
+    wait_for(motor, lambda e: e[0] == 'move_completed',
+             lambda: motor.move_absolute(2))
+    wait_for(motor, lambda e: e[0] == 'move_completed',
+             lambda: motor.move_absolute(3))
+    assert sim.position == up
+    wait_for(motor, lambda e: e[0] == 'move_completed',
+             lambda: motor.move_absolute(4))
+    wait_for(motor, lambda e: e[0] == 'move_completed',
+             lambda: motor.move_absolute(3))
+    # Approached from above, so the report trails by the whole lost
+    # motion the other way.
+    assert sim.position - up == pytest.approx(0.01 * COUNTS_PER_MM, abs=2)
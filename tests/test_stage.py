@@ -0,0 +1,116 @@
+"""
+Tests of coordinated stage moves.
+"""
+
+import concurrent.futures
+import time
+
+import pytest
+
+import motion
+from conftest import (COUNT, COUNTS_PER_MM, record_commands, wait_for,
+                      wait_until)
+
+
+def arrivals(stage):
+    """
+    Returns the list of axes that arrive from now on.
+    """
+    arrived = []
+    stage.add_listener(lambda e: e[1] == 'arrived' and arrived.append(e[0]))
+    return arrived
+
+
+def test_move_settles_at_target(make_stage):
+    stage, x, y = make_stage()
+    t = stage.move_to(1.5, 2.5).result(10)
+    assert t <= time.monotonic()
+    assert stage.pos == pytest.approx((1.5, 2.5), abs=COUNT)
+    assert (x.position, y.position) == (int(1.5 * COUNTS_PER_MM),
+                                        int(2.5 * COUNTS_PER_MM))
+
+
+def moves_time(start, commands):
+    """
+    Returns the time in seconds the recorded `commands` take from `start`.
+    """
+    total = 0
+    for pos, velocity, acceleration in commands:
+        total += motion.move_time(pos - start, velocity, acceleration)
+        start = pos
+    return total
+
+
+def test_unchanged_axis_stays_put(make_stage):
+    stage, x, y = make_stage(position=(4, 4))
+    y_commands = record_commands(stage.y_motor)
+    stage.move_to(4, 4).result(10)
+    stage.move_to(4.1, 4).result(10)
+    assert y_commands == []
+    assert stage.predict_move_time(4.1, 4) == 0
+    # A move to where the stage already is settles straight away.
+    assert stage.move_to(4.1, 4).done()
+
+
+def test_synchronized_axes_arrive_together(make_stage):
+    stage, x, y = make_stage(position=(1, 1))
+    x_commands = record_commands(stage.x_motor)
+    y_commands = record_commands(stage.y_motor)
+    # x moves forward in one leg, y back with an overshoot leg.
+    stage.move_to(2.1, 0.6, synchronize=True).result(10)
+    assert len(x_commands) == 1
+    assert len(y_commands) == 2
+    assert moves_time(1, x_commands) == pytest.approx(
+        moves_time(1, y_commands), abs=1e-3)
+
+
+def test_move_from_a_moving_axis_goes_to_new_target(make_stage):
+    stage, x, y = make_stage(position=(4, 4))
+    arrived = arrivals(stage)
+    stage.move_to(6, 4)
+    time.sleep(0.01)
+    # The last reported position is still (4, 4).
+    stage.move_to(4, 4).result(10)
+    wait_until(lambda: 'x' in arrived)
+    assert stage.pos == pytest.approx((4, 4), abs=COUNT)
+    assert x.position == 4 * COUNTS_PER_MM
+
+
+def test_single_axis_moves_run_side_by_side(make_stage):
+    # Both moves go down, so both have an overshoot leg.
+    stage, x, y = make_stage(position=(3, 3))
+    x_move = stage.move_to(x=1)
+    y_move = stage.move_to(y=1)
+    x_move.result(10)
+    y_move.result(10)
+    assert stage.pos == pytest.approx((1, 1), abs=COUNT)
+
+
+def test_setters_move_each_axis(make_stage):
+    stage, x, y = make_stage(position=(3, 3))
+    arrived = arrivals(stage)
+    stage.x = 1
+    stage.y = 1
+    wait_until(lambda: {'x', 'y'} <= set(arrived))
+    assert stage.pos == pytest.approx((1, 1), abs=COUNT)
+
+
+def test_stopping_one_axis_leaves_the_other(make_stage):
+    stage, x, y = make_stage(position=(3, 3))
+    future = stage.move_to(1, 1)
+    event = wait_for(stage, lambda e: e[:2] == ('x', 'arrived'),
+                     lambda: stage.stop_move('y'))
+    assert event[2] == pytest.approx(1, abs=COUNT)
+    with pytest.raises(concurrent.futures.CancelledError):
+        future.result(0)
+
+
+def test_superseding_one_axis_cancels_its_move(make_stage):
+    stage, x, y = make_stage(position=(3, 3))
+    arrived = arrivals(stage)
+    first = stage.move_to(1, 1)
+    second = stage.move_to(x=2)
+    assert first.cancelled()
+    second.result(10)
+    wait_until(lambda: 'y' in arrived)
+    assert stage.pos == pytest.approx((2, 1), abs=COUNT)
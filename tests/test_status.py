@@ -0,0 +1,51 @@
+"""
+Tests of controller-pushed status updates and the polling fallback.
+"""
+
+import threading
+
+
+def move_polling(motor, target, timeout=10):
+    """
+    Moves `motor` to `target`, calling update() as it asks, like the GUI
+    and CLI do. Returns the positions reported on the way.
+    """
+    done = threading.Event()
+    reported = []
+
+    def on_event(event):
+        if event[0] in ('status', 'pos'):
+            reported.append(event)
+        elif event[0] == 'move_completed':
+            done.set()
+
+    motor.add_listener(on_event)
+    try:
+        motor.move_absolute(target)
+        while not done.wait(motor.update()):
+            pass
+    finally:
+        motor.remove_listener(on_event)
+    return reported
+
+
+def test_status_pushed_while_moving(make_motor):
+    motor, sim = make_motor()
+    reported = move_polling(motor, 3)
+    assert motor.push_status
+    statuses = [pos for kind, pos in reported if kind == 'status']
+    assert len(statuses) >= 5
+    assert statuses == sorted(statuses)
+    assert not [kind for kind, pos in reported if kind == 'pos']
+
+
+def test_polls_when_status_isnt_pushed(make_motor):
+    motor, sim = make_motor(status_updates=False)
+    reported = move_polling(motor, 3)
+    assert not motor.push_status
+    polled = [pos for kind, pos in reported if kind == 'pos']
+    assert len(polled) >= 5
+    assert polled == sorted(polled)
+    # Stays with polling for the next move.
+    reported = move_polling(motor, 1)
+    assert reported[0][0] == 'pos'
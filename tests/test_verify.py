@@ -0,0 +1,32 @@
+"""
+Tests of verifying moves against their target.
+"""
+
+
+def test_verify_corrects_lost_motion(make_stage):
+    # Without compensation, backlash leaves moves short of their target.
+    stage, x, y = make_stage(backlash=0.01, backlash_comp=(0, 0),
+                             tolerance=5)
+    events = []
+    stage.add_listener(lambda e: e[1] in ('correcting', 'off_target') and
+                       events.append(e[1]))
+    for target in [(3, 2), (1, 1), (2, 0.5)]:
+        stage.move_to(*target).result(10)
+    assert 'correcting' in events
+    assert 'off_target' not in events
+    summary = stage.settle.summary()
+    for axis in ('x', 'y'):
+        assert summary[axis]['count'] == 3
+        assert summary[axis]['off_target'] == 0
+        assert summary[axis]['error_max'] <= 5
+        assert summary[axis]['corrections'] > 0
+
+
+def test_without_tolerance_moves_arent_verified(make_stage):
+    stage, x, y = make_stage(backlash=0.01, backlash_comp=(0, 0))
+    events = []
+    stage.add_listener(lambda e: e[1] == 'correcting' and events.append(e))
+    stage.move_to(3, 2).result(10)
+    stage.move_to(1, 1).result(10)
+    assert events == []
+    assert stage.settle.summary()['x']['corrections'] == 0
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Fixed size history of timestamped stage positions.
+"""
+
+import threading
+from array import array
+
+
+class PositionTrail:
+    """
+    Ring buffer of (timestamp, x, y) samples backed by flat arrays, so
+    appending never allocates. The oldest samples are overwritten once
+    `size` have been recorded. Safe to append from one thread and read from
+    another.
+
+    Parameters
+    ----------
+
+    size : int
+        Number of samples kept.
+    """
+
+    def __init__(self, size=1024):
+        self.size = size
+        self._t = array('d', [0.0]) * size
+        self._x = array('d', [0.0]) * size
+        self._y = array('d', [0.0]) * size
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._count, self.size)
+
+    @property
+    def version(self):
+        """
+        Total number of samples ever appended. Changes whenever a sample is
+        added, so readers can cheaply tell whether anything is new.
+        """
+        return self._count
+
+    def append(self, t, x, y):
+        with self._lock:
+            i = self._count % self.size
+            self._t[i] = t
+            self._x[i] = x
+            self._y[i] = y
+            self._count += 1
+
+    def latest(self):
+        """
+        Returns the newest (t, x, y) sample, or None if empty.
+        """
+        with self._lock:
+            if not self._count:
+                return None
+            i = (self._count - 1) % self.size
+            return self._t[i], self._x[i], self._y[i]
+
+    def since(self, t):
+        """
+        Returns the (t, x, y) samples newer than `t`, oldest first.
+        """
+        samples = []
+        with self._lock:
+            for n in range(self._count - 1,
+                           max(self._count - self.size, 0) - 1, -1):
+                i = n % self.size
+                if self._t[i] <= t:
+                    break
+                samples.append((self._t[i], self._x[i], self._y[i]))
+        samples.reverse()
+        return samples
+
+    def clear(self):
+        with self._lock:
+            self._count = 0
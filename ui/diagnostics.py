@@ -0,0 +1,84 @@
+from PyQt4 import QtGui, QtCore  # noqa
+
+
+class DiagnosticsDialog(QtGui.QDialog):
+    """
+    A dialog which shows command latency statistics of a LatencyTracker,
+    and move settle statistics of a SettleTracker if given, refreshed once a
+    second.
+    """
+
+    COLUMNS = ['Axis', 'Command', 'Count', 'Mean', 'p50', 'p90', 'p99', 'Max',
+               'Last']
+    SETTLE_COLUMNS = ['Axis', 'Moves', 'Mean', 'p90', 'Max', 'Error mean',
+                      'Error max', 'Corrections', 'Off target', 'Clamped']
+
+    def __init__(self, latency, parent=None, settle=None):
+        super().__init__(parent)
+        self.latency = latency
+        self.settle = settle
+        self.setWindowTitle('Diagnostics')
+        self.resize(640, 400 if settle is not None else 240)
+
+        self.table = QtGui.QTableWidget(0, len(self.COLUMNS), self)
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.verticalHeader().setVisible(False)
+        self.table.setEditTriggers(QtGui.QAbstractItemView.NoEditTriggers)
+        self.resetButton = QtGui.QPushButton('Reset', self)
+        self.resetButton.clicked.connect(self.on_reset)
+
+        layout = QtGui.QVBoxLayout(self)
+        layout.addWidget(QtGui.QLabel('Command to reply latency (ms)', self))
+        layout.addWidget(self.table)
+        self.settleTable = None
+        if settle is not None:
+            self.settleTable = QtGui.QTableWidget(
+                0, len(self.SETTLE_COLUMNS), self)
+            self.settleTable.setHorizontalHeaderLabels(self.SETTLE_COLUMNS)
+            self.settleTable.verticalHeader().setVisible(False)
+            self.settleTable.setEditTriggers(
+                QtGui.QAbstractItemView.NoEditTriggers)
+            layout.addWidget(QtGui.QLabel(
+                'Move settle time (ms) and final error (counts)', self))
+            layout.addWidget(self.settleTable)
+        buttons = QtGui.QHBoxLayout()
+        buttons.addStretch()
+        buttons.addWidget(self.resetButton)
+        layout.addLayout(buttons)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self.refresh)
+        self._timer.start(1000)
+        self.refresh()
+
+    def refresh(self):
+        summary = self.latency.summary()
+        self.table.setRowCount(len(summary))
+        for row, ((axis, kind), stats) in enumerate(summary.items()):
+            values = [axis, kind, str(stats['count'])]
+            for name in self.COLUMNS[3:]:
+                values.append('{:.1f}'.format(stats[name.lower()] * 1000))
+            for col, value in enumerate(values):
+                self.table.setItem(row, col, QtGui.QTableWidgetItem(value))
+        if self.settle is not None:
+            self.refresh_settle()
+
+    def refresh_settle(self):
+        summary = self.settle.summary()
+        self.settleTable.setRowCount(len(summary))
+        for row, (axis, stats) in enumerate(summary.items()):
+            values = [axis, str(stats['count'])]
+            for name in ('mean', 'p90', 'max'):
+                values.append('{:.0f}'.format(stats[name] * 1000))
+            values.append('{:.1f}'.format(stats['error_mean']))
+            for name in ('error_max', 'corrections', 'off_target', 'clamped'):
+                values.append(str(stats[name]))
+            for col, value in enumerate(values):
+                self.settleTable.setItem(row, col,
+                                         QtGui.QTableWidgetItem(value))
+
+    def on_reset(self):
+        self.latency.reset()
+        if self.settle is not None:
+            self.settle.reset()
+        self.refresh()
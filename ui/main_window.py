@@ -115,6 +115,9 @@ class Ui_MainWindow(object):
         self.homeButton = QtGui.QPushButton(self.centralwidget)
         self.homeButton.setObjectName(_fromUtf8("homeButton"))
         self.gridLayout_2.addWidget(self.homeButton, 7, 1, 1, 1)
+        self.diagnosticsButton = QtGui.QPushButton(self.centralwidget)
+        self.diagnosticsButton.setObjectName(_fromUtf8("diagnosticsButton"))
+        self.gridLayout_2.addWidget(self.diagnosticsButton, 8, 0, 1, 2)
         self.verticalLayout.addLayout(self.gridLayout_2)
         self.horizontalLayout_3 = QtGui.QHBoxLayout()
         self.horizontalLayout_3.setObjectName(_fromUtf8("horizontalLayout_3"))
@@ -187,6 +190,7 @@ class Ui_MainWindow(object):
         self.okLabel.setText(_translate("MainWindow", "Jog Speed", None))
         self.zeroButton.setText(_translate("MainWindow", "Zero", None))
         self.homeButton.setText(_translate("MainWindow", "Home Stage", None))
+        self.diagnosticsButton.setText(_translate("MainWindow", "Diagnostics", None))
         self.yAxisLabel.setText(_translate("MainWindow", "Y Axis", None))
         self.returnYButton.setText(_translate("MainWindow", "Return", None))
         self.retractYButton.setText(_translate("MainWindow", "Retract", None))
@@ -1,72 +1,239 @@
 from PyQt4 import QtGui, QtCore  # noqa
 
+import time
+
+import mea
+
 
 class MEANavigationWidget(QtGui.QWidget):
     """
     A widget which displays an MEA overview grid.
+
+    The grid is rendered once per widget size into a cached pixmap. Only the
+    crosshair is drawn on each paint, and moving it repaints just the regions
+    it left and entered.
+
+    Given a PositionTrail with set_trail(), the actual stage position and a
+    fading trail of its recent motion are drawn over the grid. However often
+    schedule_frame() is called, the overlay is redrawn at most once every
+    FRAME_INTERVAL ms, and `frame` is emitted with the latest (t, x, y)
+    sample when there is a new one.
+
+    With set_estimator(), the position is estimated on every frame while the
+    stage moves, so the marker and `frame` follow it smoothly between
+    position reports.
+
+    The electrodes come from an mea.Layout, the 120 electrode MEA unless
+    another is given to set_layout(). Positions are in layout um, and a
+    click moves the crosshair to the nearest electrode and emits `clicked`
+    with its position.
     """
     clicked = QtCore.pyqtSignal(object)
+    frame = QtCore.pyqtSignal(object)
 
-    mea_120_electrodes = ['f7', 'f8', 'f12', 'f11', 'f10', 'f9', 'e12', 'e11',
-                          'e10', 'e9', 'd12', 'd11', 'd10', 'd9', 'c11', 'c10',
-                          'b10', 'e8', 'c9', 'b9', 'a9', 'd8', 'c8', 'b8',
-                          'a8', 'd7', 'c7', 'b7', 'a7', 'e7', 'f6', 'e6', 'a6',
-                          'b6', 'c6', 'd6', 'a5', 'b5', 'c5', 'd5', 'a4', 'b4',
-                          'c4', 'd4', 'b3', 'c3', 'c2', 'e5', 'd3', 'd2', 'd1',
-                          'e4', 'e3', 'e2', 'e1', 'f4', 'f3', 'f2', 'f1', 'f5',
-                          'g6', 'g5', 'g1', 'g2', 'g3', 'g4', 'h1', 'h2', 'h3',
-                          'h4', 'j1', 'j2', 'j3', 'j4', 'k2', 'k3', 'l3', 'h5',
-                          'k4', 'l4', 'm4', 'j5', 'k5', 'l5', 'm5', 'j6', 'k6',
-                          'l6', 'm6', 'h6', 'g7', 'h7', 'm7', 'l7', 'k7', 'j7',
-                          'm8', 'l8', 'k8', 'j8', 'm9', 'l9', 'k9', 'j9',
-                          'l10', 'k10', 'k11', 'h8', 'j10', 'j11', 'j12', 'h9',
-                          'h10', 'h11', 'h12', 'g8', 'g9', 'g10', 'g11', 'g12']
+    FRAME_INTERVAL = 16
+    TRAIL_SECONDS = 2.0
+    MAX_LABELS = 300
 
     def __init__(self, parent):
         super().__init__(parent)
-        self.mea_120_columns = {'a':  0, 'b': 1, 'c': 2, 'd': 3, 'e': 4,
-                                'f': 5, 'g': 6, 'h': 7, 'j': 8, 'k': 9,
-                                'l': 10, 'm': 11}
         self.current_pos = (0, 0)
+        self._background = None
+        self.trail = None
+        self._trail_version = None
+        self.estimate = None
+        self._overlay = []
+        self._overlay_time = 0
+        self._overlay_rect = QtCore.QRect()
+        self._frame_timer = QtCore.QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.timeout.connect(self._on_frame)
+        self.set_layout(mea.MEA_120)
 
-    def paintEvent(self, event):
-        d = min(self.width(), self.height())
-        p = QtGui.QPainter(self)
+    def set_layout(self, layout):
+        """
+        Shows the electrodes of `layout`, an mea.Layout.
+        """
+        self.mea_layout = layout
+        pitch = layout.pitch
+        left, top, right, bottom = layout.bounds
+        self._box = QtCore.QRectF(left - pitch, top - pitch,
+                                  right - left + 2*pitch,
+                                  bottom - top + 2*pitch)
+        # Markers stay visible however many electrodes there are.
+        self._unit = max(pitch, max(self._box.width(),
+                                    self._box.height()) / 13)
+        self._points = QtGui.QPolygonF(
+            [QtCore.QPointF(x, y) for x, y in layout.positions])
+        self._labels = []
+        if len(layout) <= self.MAX_LABELS:
+            self._labels = [
+                (QtCore.QRectF(x - 0.3*pitch, y - 0.55*pitch,
+                               0.6*pitch, 0.4*pitch), tag.upper())
+                for tag, (x, y) in zip(layout.tags, layout.positions)]
+        self._background = None
+        self.update()
+
+    def _transform(self):
+        """
+        Returns the transform from layout um to widget pixels.
+        """
+        box = self._box
+        scale = min(self.width() / box.width(), self.height() / box.height())
+        t = QtGui.QTransform()
+        t.translate(self.width()/2, self.height()/2)
+        t.scale(scale, scale)
+        t.translate(-box.center().x(), -box.center().y())
+        return t
+
+    def _render_background(self):
+        pixmap = QtGui.QPixmap(self.size())
+        pixmap.fill(QtCore.Qt.transparent)
+        p = QtGui.QPainter(pixmap)
         p.setRenderHint(QtGui.QPainter.Antialiasing)
+        p.setTransform(self._transform())
+        pitch = self.mea_layout.pitch
         font = p.font()
-        font.setPixelSize(30)
+        font.setPixelSize(max(1, int(0.3*pitch)))
         p.setFont(font)
 
-        if self.width() > self.height():
-            p.translate(self.width()/2 - 650*d/1300, 0)
-        else:
-            p.translate(0, self.height()/2 - 650*d/1300)
-        p.scale(d/1300, d/1300)
-
         # Draw background
         p.setPen(QtCore.Qt.NoPen)
         p.setBrush(QtGui.QColor(167, 231, 255, 98))
-        p.drawRoundedRect(0, 0, 1300, 1300, 65, 65)
+        p.drawRoundedRect(self._box, 0.65*pitch, 0.65*pitch)
 
         # Draw electrodes
-        p.setBrush(QtGui.QColor(0, 98, 136))
-        for tag in self.mea_120_electrodes:
-            p.setPen(QtCore.Qt.NoPen)
-            col = self.mea_120_columns[tag[0]]
-            row = int(tag[1:]) - 1
-            x = col*100 + 100
-            y = row*100 + 100
-            p.drawEllipse(QtCore.QPointF(x, y), 15, 15)
-            p.setPen(QtGui.QColor(217, 38, 0))
-            p.drawText(QtCore.QRectF(x-30, y-55, 60, 40),
-                       QtCore.Qt.AlignCenter, tag.upper())
+        pen = QtGui.QPen(QtGui.QColor(0, 98, 136))
+        pen.setWidthF(0.3*pitch)
+        pen.setCapStyle(QtCore.Qt.RoundCap)
+        p.setPen(pen)
+        p.drawPoints(self._points)
+        p.setPen(QtGui.QColor(217, 38, 0))
+        for rect, label in self._labels:
+            p.drawText(rect, QtCore.Qt.AlignCenter, label)
+        p.end()
+        return pixmap
+
+    def _crosshair_rect(self, pos):
+        """
+        Returns the widget rect covered by the crosshair at `pos`.
+        """
+        x, y = pos
+        r = 0.31*self._unit
+        rect = QtCore.QRectF(x - r, y - r, 2*r, 2*r)
+        return self._transform().mapRect(rect).toAlignedRect().adjusted(
+            -2, -2, 2, 2)
+
+    def set_position(self, pos):
+        """
+        Moves the crosshair to `pos` in layout um, repainting only the
+        area around its old and new position.
+        """
+        if pos == self.current_pos:
+            return
+        self.update(self._crosshair_rect(self.current_pos))
+        self.current_pos = pos
+        self.update(self._crosshair_rect(pos))
+
+    def set_trail(self, trail):
+        """
+        Draws the stage position recorded in `trail`, a PositionTrail.
+        """
+        self.trail = trail
+        self._trail_version = None
+        self.schedule_frame()
+
+    def set_estimator(self, estimate):
+        """
+        Uses `estimate(t)`, which returns the estimated stage (x, y) at
+        time.monotonic() `t` while it moves and None otherwise.
+        """
+        self.estimate = estimate
+        self.schedule_frame()
+
+    def schedule_frame(self):
+        """
+        Redraws the stage overlay on the next frame.
+        """
+        if not self._frame_timer.isActive():
+            self._frame_timer.start(self.FRAME_INTERVAL)
+
+    def _on_frame(self):
+        if self.trail is None:
+            return
+        now = time.monotonic()
+        overlay = []
+        for t, x, y in self.trail.since(now - self.TRAIL_SECONDS):
+            lx, ly = self.mea_layout.stage_layout_position((x, y))
+            overlay.append((t, QtCore.QPointF(lx, ly)))
+        latest = self.trail.latest()
+        fading = len(overlay) > 0
+        estimated = None
+        if self.estimate is not None:
+            estimated = self.estimate(now)
+        if estimated is not None:
+            lx, ly = self.mea_layout.stage_layout_position(estimated)
+            overlay.append((now, QtCore.QPointF(lx, ly)))
+            latest = (now,) + tuple(estimated)
+        elif not overlay and latest is not None:
+            # Keep showing where the stage is once the trail has faded.
+            lx, ly = self.mea_layout.stage_layout_position(latest[1:])
+            overlay.append((latest[0], QtCore.QPointF(lx, ly)))
+        self._overlay = overlay
+        self._overlay_time = now
+
+        self.update(self._overlay_rect)
+        if overlay:
+            bounds = QtGui.QPolygonF([p for _, p in overlay]).boundingRect()
+            r = 0.16*self._unit
+            self._overlay_rect = self._transform().mapRect(
+                bounds.adjusted(-r, -r, r, r)).toAlignedRect().adjusted(
+                    -2, -2, 2, 2)
+            self.update(self._overlay_rect)
+        else:
+            self._overlay_rect = QtCore.QRect()
+
+        if self.trail.version != self._trail_version or estimated is not None:
+            self._trail_version = self.trail.version
+            if latest is not None:
+                self.frame.emit(latest)
+        if fading or estimated is not None:
+            self.schedule_frame()
+
+    def _draw_overlay(self, p):
+        if not self._overlay:
+            return
+        pen = QtGui.QPen(QtGui.QColor(255, 140, 0))
+        pen.setWidthF(0.06*self._unit)
+        pen.setCapStyle(QtCore.Qt.RoundCap)
+        for (_, a), (t, b) in zip(self._overlay, self._overlay[1:]):
+            age = (self._overlay_time - t) / self.TRAIL_SECONDS
+            color = pen.color()
+            color.setAlphaF(max(0.0, min(1.0, 1 - age)))
+            pen.setColor(color)
+            p.setPen(pen)
+            p.drawLine(a, b)
+        p.setPen(QtCore.Qt.NoPen)
+        p.setBrush(QtGui.QColor(255, 140, 0))
+        p.drawEllipse(self._overlay[-1][1], 0.12*self._unit, 0.12*self._unit)
+
+    def resizeEvent(self, event):
+        self._background = None
+        super().resizeEvent(event)
+
+    def paintEvent(self, event):
+        if self._background is None:
+            self._background = self._render_background()
+        p = QtGui.QPainter(self)
+        p.drawPixmap(event.rect(), self._background, event.rect())
 
         # Draw current position.
+        p.setRenderHint(QtGui.QPainter.Antialiasing)
+        p.setTransform(self._transform())
+        self._draw_overlay(p)
         x, y = self.current_pos
-        x += 100
-        y += 100
-        offset = 5
-        length = 25
+        offset = 0.05*self._unit
+        length = 0.25*self._unit
         p.setPen(QtGui.QColor(0, 172, 11))
         p.setBrush(QtCore.Qt.NoBrush)
         p.drawLine(x - offset, y, x - offset - length, y)
@@ -76,12 +243,10 @@ class MEANavigationWidget(QtGui.QWidget):
 
     def mouseReleaseEvent(self, event):
         if event.button() == QtCore.Qt.LeftButton:
-            w = self.width()
-            h = self.height()
-            spacing = min(w, h) / 13
-            x = 5.5 - ((self.width() / 2 - event.x()) / spacing)
-            y = 5.5 - ((self.height() / 2 - event.y()) / spacing)
-            self.current_pos = (100*x, 100*y)
-            self.clicked.emit(self.current_pos)
-            self.update()
+            inverse, _ = self._transform().inverted()
+            pos = inverse.map(QtCore.QPointF(event.pos()))
+            tag = self.mea_layout.nearest((pos.x(), pos.y()))
+            if tag is not None:
+                self.set_position(self.mea_layout.position(tag))
+                self.clicked.emit(self.current_pos)
             event.accept()